@@ -0,0 +1,344 @@
+"""Benchmarks against the simulated device (device_simulator.py)
+
+    python benchmark.py transfer --size-kb 4096
+    python benchmark.py suite --record benchmarks.jsonl
+    python benchmark.py suite --list-files 1000 --download-mb 64 --fleet 4 --bandwidth 1000000
+
+transfer compares the ways of downloading the same files. suite measures the
+latency and throughput of the main operations: listing 10k files, downloading
+1 GB, setting the time and syncing a fleet of 16 devices. With --record the
+results are appended to a JSON lines file and compared with the previous run
+recorded there, to follow the performance over time.
+
+    python benchmark.py startup
+
+startup checks how long the window takes to come up (and the imports it
+needs, also without a display), and fails above the targets.
+"""
+import argparse
+import ast
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import datalogger
+import perf_log
+from device_session import DeviceSession
+from device_simulator import SimulatedDevice
+from device_worker import DeviceWorker
+from fleet import Fleet
+from sd_transfer import download_files
+
+# amount of work done in seconds, the throughput is amount / seconds in unit per second
+BenchResult = collections.namedtuple("BenchResult", ["name", "seconds", "amount", "unit"])
+
+MB = 1024 * 1024
+
+# seconds allowed before the window is shown, and for python to import what it needs before that
+STARTUP_TARGET = 1.5
+IMPORT_TARGET = 0.5
+HERE = os.path.dirname(os.path.abspath(__file__))
+GUI_SCRIPT = os.path.join(HERE, "full_datalogger_management_gui.py")
+# imported by the fleet mode and the live monitor when they are opened, never before the window is shown
+LAZY_MODULES = ["fleet", "deploy", "live_monitor"]
+
+
+def _device(i=0, bandwidth=None, drift_ppm=0.0):
+    return SimulatedDevice(unique_id=b"\xe6\x61\x41\x04\x03\x57\x2a" + bytes([i]), bandwidth=bandwidth, drift_ppm=drift_ppm)
+
+
+def _timed(name, amount, unit, function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return BenchResult(name, time.perf_counter() - start, amount, unit)
+
+
+def bench_transfer(size_kb=2048, files=4, bandwidth=None):
+    """Download the same files with the hex per-file path, the hex batch, the binary batch and deflate"""
+    results = []
+    with _device(bandwidth=bandwidth) as device:
+        names = device.populate_sd(files, size_kb * 1024 // files)
+        total = sum(os.path.getsize(os.path.join(device.sd_dir, name)) / 1024 for name in names)
+        session = DeviceSession(device.port)
+        session.ensure_sd_mounted()
+        dest = tempfile.mkdtemp(prefix="bench_")
+        try:
+            def one_call_per_file():
+                for name in names:
+                    with open(os.path.join(dest, name), "wb") as f:
+                        f.write(session.fs_readfile("/sd/" + name))
+            results.append(_timed("hex, one call per file (512 B)", total, "KB", one_call_per_file))
+
+            for label, chunk_size, binary, compress in (("hex batch (1 KB)", 1024, False, False),
+                                                        ("binary + CRC batch (4 KB)", 4096, True, False),
+                                                        ("binary + CRC batch (16 KB)", 16384, True, False),
+                                                        ("deflate + CRC batch (4 KB)", 4096, True, True)):
+                start = time.perf_counter()
+                result = download_files(session, names, dest, chunk_size=chunk_size, binary=binary, compress=compress)
+                results.append(BenchResult(label, time.perf_counter() - start, total, "KB"))
+            results.append(BenchResult(f"deflate ratio {result.bytes / result.link_bytes:.1f}x", 0, 0, ""))
+        finally:
+            session.close()
+            shutil.rmtree(dest, ignore_errors=True)
+    return results
+
+
+def bench_list(files=10000, bandwidth=None):
+    """Listing of a card of `files` files: first listing, listing again, listing after 10 files grew"""
+    results = []
+    with _device(bandwidth=bandwidth) as device:
+        names = device.populate_sd(files, 2000, folders=max(files // 1000, 1))
+        cache = tempfile.mkdtemp(prefix="bench_")
+        session = DeviceSession(device.port)
+        try:
+            session.ensure_sd_mounted()
+            results.append(_timed(f"list {files} files, no cache", files, "files",
+                                  datalogger.list_files, session, cache))
+            results.append(_timed(f"list {files} files, cached", files, "files",
+                                  datalogger.list_files, session, cache))
+            for name in names[:10]:
+                with open(os.path.join(device.sd_dir, name), "a") as f:
+                    f.write("2030-01-01 00:00:00,1,2,3\n")
+            results.append(_timed(f"list {files} files, 10 changed", files, "files",
+                                  datalogger.list_files, session, cache))
+        finally:
+            session.close()
+            shutil.rmtree(cache, ignore_errors=True)
+    return results
+
+
+def bench_download(total_mb=1024, files=8, bandwidth=None):
+    """Download of total_mb spread over `files` files, then a sync with nothing new"""
+    results = []
+    with _device(bandwidth=bandwidth) as device:
+        names = device.populate_sd(files, total_mb * MB // files)
+        total = sum(os.path.getsize(os.path.join(device.sd_dir, name)) for name in names) / MB
+        dest = tempfile.mkdtemp(prefix="bench_")
+        session = DeviceSession(device.port)
+        try:
+            results.append(_timed(f"download {total:.0f} MB ({files} files)", total, "MB",
+                                  datalogger.download, session, names, dest))
+            results.append(_timed("sync, nothing new", files, "files", datalogger.sync, session, dest))
+        finally:
+            session.close()
+            shutil.rmtree(dest, ignore_errors=True)
+    return results
+
+
+def bench_clock(drift_ppm=30.0, bandwidth=None):
+    """Latency of reading and setting the time, and the offset left after setting it"""
+    results = []
+    with _device(bandwidth=bandwidth, drift_ppm=drift_ppm) as device:
+        device.ext_rtc_value -= 3  # start 3 s late
+        state = os.path.join(tempfile.mkdtemp(prefix="bench_"), "clock_sync.json")
+        session = DeviceSession(device.port)
+        try:
+            results.append(_timed("get time", 1, "calls", datalogger.get_time, session))
+            start = time.perf_counter()
+            synced = datalogger.set_time(session, state)
+            results.append(BenchResult("set time on a second boundary", time.perf_counter() - start, 1, "calls"))
+            check = datalogger.check_clock(session, state)
+            results.append(BenchResult(f"offset after setting: {check.offset_before * 1000:+.1f} ms, "
+                                       f"link latency {synced.latency * 1000:.2f} ms", 0, 0, ""))
+        finally:
+            session.close()
+            shutil.rmtree(os.path.dirname(state), ignore_errors=True)
+    return results
+
+
+def bench_fleet(devices=16, files=10, file_size=1 * MB, bandwidth=None):
+    """Sync and set the time of `devices` loggers in parallel, like the fleet window does"""
+    simulated = [_device(i, bandwidth=bandwidth) for i in range(devices)]
+    dest = tempfile.mkdtemp(prefix="bench_")
+    fleet = Fleet(dest)
+    try:
+        total = 0
+        for device in simulated:
+            names = device.populate_sd(files, file_size)
+            total += sum(os.path.getsize(os.path.join(device.sd_dir, name)) for name in names) / MB
+            device.start()
+            fleet.adopt(device.port, DeviceSession(device.port), DeviceWorker(device.port))
+
+        def wait():
+            # what the GUI does with root.after
+            while any(d.worker.busy for d in fleet.devices.values()):
+                fleet.poll()
+                time.sleep(0.01)
+            fleet.poll()
+
+        def sync_all():
+            fleet.sync_all()
+            wait()
+
+        results = [_timed(f"fleet of {devices}: sync {total:.0f} MB", total, "MB", sync_all)]
+        failed = [d.label for d in fleet.devices.values() if not d.status.startswith("Synced")]
+        if failed:
+            print(f"fleet sync failed on {', '.join(failed)}")
+
+        def set_time_all():
+            fleet.set_time_all()
+            wait()
+
+        results.append(_timed(f"fleet of {devices}: set time", devices, "devices", set_time_all))
+    finally:
+        for fleet_device in fleet.devices.values():
+            fleet_device.worker.stop(then=fleet_device.session.close)
+        while any(d.worker.busy for d in fleet.devices.values()):
+            time.sleep(0.01)
+        for device in simulated:
+            device.stop()
+        shutil.rmtree(dest, ignore_errors=True)
+    return results
+
+
+def window_modules():
+    """Modules imported at the top of the window script: what python loads before the window is shown"""
+    with open(GUI_SCRIPT) as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules.append(node.module)
+    return modules
+
+
+def time_imports():
+    """(seconds for a new python to import the modules of the window, the LAZY_MODULES it loaded with them)"""
+    code = (f"import sys, {', '.join(window_modules())}\n"
+            f"print(' '.join(name for name in {LAZY_MODULES!r} if name in sys.modules))")
+    start = time.perf_counter()
+    done = subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True, capture_output=True, text=True)
+    return time.perf_counter() - start, done.stdout.split()
+
+
+def has_display():
+    return not (sys.platform.startswith("linux") and not os.environ.get("DISPLAY"))
+
+
+def time_window():
+    """(seconds until the window is shown, seconds until the process ended), the window closing itself"""
+    # in an empty directory with a port that does not exist: no device is touched, the queue is new
+    env = dict(os.environ, DATALOGGER_EXIT_WHEN_SHOWN="1", DATALOGGER_PORT="/dev/null-benchmark")
+    with tempfile.TemporaryDirectory(prefix="bench_") as cwd:
+        start = time.perf_counter()
+        done = subprocess.run([sys.executable, GUI_SCRIPT], cwd=cwd, env=env, capture_output=True, text=True,
+                              timeout=60)
+        total = time.perf_counter() - start
+    shown = [line for line in done.stdout.splitlines() if line.startswith("window shown after")]
+    if not shown:
+        raise RuntimeError(f"the window did not start:\n{done.stderr}")
+    return float(shown[0].split()[3]), total
+
+
+def bench_startup():
+    """Start python with the modules of the window, then the window itself when there is a display"""
+    seconds, lazy = time_imports()
+    if lazy:
+        print(f"imported before the window is shown: {', '.join(lazy)}")
+    results = [BenchResult("startup: python + window modules", seconds, 1, "runs")]
+    if not has_display():
+        print("no display, the window is not started")
+        return results
+    shown, total = time_window()
+    results.append(BenchResult("startup: window shown", shown, 1, "runs"))
+    results.append(BenchResult("startup: window shown and closed", total, 1, "runs"))
+    return results
+
+
+def print_results(results, previous=None):
+    """One line per result: latency, throughput, and the change since the previous recorded run"""
+    previous = previous or {}
+    for result in results:
+        if not result.unit:
+            print(result.name)
+            continue
+        line = f"{result.name:<40} {result.seconds:>9.3f} s {result.amount / result.seconds:>12.1f} {result.unit}/s"
+        if result.name in previous and previous[result.name]:
+            change = (result.seconds - previous[result.name]) / previous[result.name] * 100
+            line += f"   {change:+.0f}% time"
+        print(line)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def load_previous(path):
+    """Seconds of each benchmark of the last run recorded in path"""
+    try:
+        with open(path) as f:
+            lines = [line for line in f if line.strip()]
+    except OSError:
+        return {}
+    if not lines:
+        return {}
+    return {name: seconds for name, seconds, amount, unit in json.loads(lines[-1])["results"]}
+
+
+def record(path, results, settings):
+    with open(path, "a") as f:
+        f.write(json.dumps({"time": datetime.now().isoformat(timespec="seconds"), "commit": _git_commit(),
+                            "settings": settings, "results": [list(result) for result in results]}) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks against the simulated datalogger")
+    parser.add_argument("--bandwidth", type=int, help="bytes per second of the simulated link (default: unlimited)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    transfer = commands.add_parser("transfer", help="SD card download throughput")
+    transfer.add_argument("--size-kb", type=int, default=2048, help="total size of the files to download")
+    transfer.add_argument("--files", type=int, default=4, help="number of files")
+    startup = commands.add_parser("startup", help="time to show the window, fails above the targets")
+    startup.add_argument("--target", type=float, default=STARTUP_TARGET, help="seconds allowed to show the window")
+    suite = commands.add_parser("suite", help="latency and throughput of listing, download, time setting and fleet sync")
+    suite.add_argument("--list-files", type=int, default=10000, help="files on the card for the listing")
+    suite.add_argument("--download-mb", type=int, default=1024, help="size of the download")
+    suite.add_argument("--fleet", type=int, default=16, help="number of devices of the fleet")
+    suite.add_argument("--fleet-mb", type=int, default=10, help="data to sync on each device of the fleet")
+    suite.add_argument("--drift-ppm", type=float, default=30.0, help="drift of the simulated PCF8523")
+    suite.add_argument("--only", help="comma separated subset of list,download,clock,fleet")
+    suite.add_argument("--record", help="JSON lines file to append the results to and compare with")
+    args = parser.parse_args()
+    perf_log.log_path = None  # the fleet workers would log into ./data
+    if args.command == "transfer":
+        print_results(bench_transfer(args.size_kb, args.files, args.bandwidth))
+        return
+    if args.command == "startup":
+        results = bench_startup()
+        print_results(results)
+        targets = {"startup: python + window modules": IMPORT_TARGET, "startup: window shown": args.target}
+        slow = [f"{result.name}: {result.seconds:.2f} s, target {targets[result.name]} s"
+                for result in results if result.seconds > targets.get(result.name, float("inf"))]
+        if slow:
+            print("too slow\n" + "\n".join(slow))
+            sys.exit(1)
+        return
+    only = args.only.split(",") if args.only else ["list", "download", "clock", "fleet"]
+    previous = load_previous(args.record) if args.record else {}
+    results = []
+    for name, run in (("list", lambda: bench_list(args.list_files, args.bandwidth)),
+                      ("download", lambda: bench_download(args.download_mb, bandwidth=args.bandwidth)),
+                      ("clock", lambda: bench_clock(args.drift_ppm, args.bandwidth)),
+                      ("fleet", lambda: bench_fleet(args.fleet, 10, args.fleet_mb * MB // 10, args.bandwidth))):
+        if name in only:
+            part = run()
+            print_results(part, previous)
+            results += part
+    if args.record:
+        record(args.record, results, {key: value for key, value in vars(args).items() if key not in ("command", "record")})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Precise setting of the logger clock and follow up of its drift
+
+The PCF8523 of the Cowbell shield only counts whole seconds and the serial
+link adds a few milliseconds of latency. So the latency is measured first,
+the clock is written exactly on a second boundary (the time written is the
+one the computer will have when the command reaches the device) and the
+offset is measured on a tick of the device clock.
+
+The offset measured before each setting, compared with the residual offset
+left by the previous setting, gives the drift rate of the logger in ppm. It
+is kept per device in data/clock_sync.json and can be used to correct the
+timestamps of the downloaded files.
+"""
+import collections
+import json
+import os
+import statistics
+import time
+from datetime import datetime
+
+ClockSync = collections.namedtuple(
+    "ClockSync", ["device_id", "latency", "offset_before", "offset_after", "drift_ppm"])
+
+STATE_FILE = os.path.join("data", "clock_sync.json")
+# a setting is not worth it if the clock is better than this (seconds)
+SET_THRESHOLD = 0.05
+
+
+def measure_latency(session, samples=5):
+    """One way latency of a command (half the median round trip of a call like the one setting the clock)"""
+    session.ensure_script("rtc_sync.py")
+    round_trips = []
+    for i in range(samples):
+        start = time.perf_counter()
+        session.exec("rtc.datetime; machine.RTC")
+        round_trips.append(time.perf_counter() - start)
+    return statistics.median(round_trips) / 2
+
+
+def measure_offset(session, latency):
+    """Device clock minus computer clock (seconds), measured on a tick of the PCF8523"""
+    session.ensure_script("rtc_sync.py")
+    output = session.exec("wait_second_edge()", timeout=5)
+    received = time.time()
+    device_time = datetime(*[int(n) for n in output.split()]).timestamp()
+    # the line was printed right after the tick, it took about one latency to arrive
+    return device_time - (received - latency)
+
+
+def set_on_second_boundary(session, latency):
+    """Write the next whole second into the clocks so that it arrives right when the computer reaches it"""
+    session.ensure_script("rtc_sync.py")
+    target = int(time.time()) + 2
+    t = datetime.fromtimestamp(target)
+    code = f"set_clocks({t.year}, {t.month}, {t.day}, {t.weekday()}, {t.hour}, {t.minute}, {t.second})"
+    delay = target - latency - time.time()
+    if delay > 0.02:
+        time.sleep(delay - 0.02)
+    # the last milliseconds are waited actively, sleep is not precise enough
+    while time.time() < target - latency:
+        pass
+    session.exec(code)
+    return target
+
+
+def load_state(path=STATE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, path=STATE_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def drift_ppm(record, offset_now, now):
+    """Drift since the last setting recorded for a device, None if it was never set"""
+    if not record or "set_at" not in record:
+        return None
+    elapsed = now - record["set_at"]
+    if elapsed < 60:
+        return None
+    return (offset_now - record["offset_after"]) / elapsed * 1e6
+
+
+def sync_clock(session, samples=5, state_path=STATE_FILE, force=True):
+    """Measure the latency and the clock offset, set the clock on a second boundary and record the drift
+
+    With force=False the clock is only measured (and set when it is more than SET_THRESHOLD off).
+    """
+    device_id = session.device_id()
+    latency = measure_latency(session, samples)
+    offset_before = measure_offset(session, latency)
+    now = time.time()
+    state = load_state(state_path)
+    record = state.get(device_id, {})
+    drift = drift_ppm(record, offset_before, now)
+    offset_after = offset_before
+    if force or abs(offset_before) > SET_THRESHOLD:
+        set_at = set_on_second_boundary(session, latency)
+        offset_after = measure_offset(session, latency)
+        record["set_at"] = set_at
+        record["offset_after"] = offset_after
+    if drift is not None:
+        record["drift_ppm"] = drift
+    history = record.setdefault("history", [])
+    history.append({"time": now, "latency": latency, "offset_before": offset_before,
+                    "offset_after": offset_after, "drift_ppm": drift})
+    del history[:-50]
+    state[device_id] = record
+    save_state(state, state_path)
+    return ClockSync(device_id, latency, offset_before, offset_after, drift)
+
+
+def check_clock(session, samples=5, state_path=STATE_FILE):
+    """Measure the offset and drift of the device clock without changing it"""
+    device_id = session.device_id()
+    latency = measure_latency(session, samples)
+    offset = measure_offset(session, latency)
+    record = load_state(state_path).get(device_id, {})
+    return ClockSync(device_id, latency, offset, None, drift_ppm(record, offset, time.time()))
+
+
+def device_clock_error(record, when):
+    """Estimated device clock minus real time at the computer time `when`, from a device record"""
+    error = record.get("offset_after", 0.0)
+    if record.get("drift_ppm") is not None and "set_at" in record:
+        error += record["drift_ppm"] * 1e-6 * (when - record["set_at"])
+    return error
+
+
+def correct_timestamp(device_id, device_timestamp, state_path=STATE_FILE):
+    """Real time (epoch seconds) of a timestamp written by a logger, using its measured offset and drift"""
+    record = load_state(state_path).get(device_id)
+    if not record:
+        return device_timestamp
+    return device_timestamp - device_clock_error(record, device_timestamp)
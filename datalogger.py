@@ -0,0 +1,337 @@
+"""Datalogger operations without the GUI
+
+Everything the GUI buttons do, as plain functions returning structured
+results, for scripts and cron jobs (this module never imports tkinter):
+
+    import datalogger
+    session = datalogger.connect()
+    for f in datalogger.list_files(session):
+        print(f.name, f.size, f.mtime)
+    print(datalogger.sync(session, "data"))
+    print(datalogger.ingest("data"))
+
+or from the command line:
+
+    python -m datalogger sync --dest data --ingest
+    python -m datalogger --port all sync --dest data
+    python -m datalogger ingest --data data
+    python -m datalogger inspect log_00001.csv --column temperature
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import clock_sync
+import perf_log
+from device_session import DeviceSession, DeviceError, DeviceExecError, find_ports
+from ingest import STORE_DIR, ingest_dir
+from sd_index import FileEntry, SDIndex
+from sd_preview import format_summary, preview, summarize
+from sd_sync import sync_sd
+from sd_transfer import download_files, format_transfer
+
+# Value written in info.json for the fields left empty
+MISSING = 9999
+
+
+def connect(port="auto", sd_baudrate=None):
+    """Open a session to the device (the first one found with "auto")"""
+    session = DeviceSession(port, sd_baudrate=sd_baudrate)
+    session.connect()
+    return session
+
+
+def list_files(session, cache_dir=None):
+    """Files of the SD card (subfolders included), as FileEntry(name, size, mtime)
+
+    The listing is cached per device and only the changed files are looked at again.
+    """
+    index = SDIndex(session.device_id()) if cache_dir is None else SDIndex(session.device_id(), cache_dir)
+    index.refresh(session)
+    return index.entries
+
+
+def download(session, names, dest_dir="data", progress=None, cancel=None, compress=False):
+    """Download SD card files, returns DownloadResult(downloaded, failed, bytes, link_bytes, seconds)
+
+    compress: deflate the files on the device, when its firmware can.
+    """
+    result = download_files(session, names, dest_dir, progress=progress, cancel=cancel, compress=compress)
+    save_device_config(session, dest_dir)
+    return result
+
+
+def sync(session, dest_dir="data", verify=False, progress=None, cancel=None, compress=False):
+    """Copy only what is new on the SD card, returns a SyncResult"""
+    result = sync_sd(session, dest_dir, verify=verify, progress=progress, cancel=cancel, compress=compress)
+    save_device_config(session, dest_dir)
+    return result
+
+
+def tail(session, name, rows=10):
+    """Last rows of an SD card file, read on the device: FilePreview(name, size, lines)"""
+    return preview(session, name, rows)
+
+
+def inspect(session, name, column=1, gap=0, size=None):
+    """Rows, time span, min/max of a column and timestamp gaps of an SD card file, scanned on the device
+
+    Returns a FileSummary, only the result goes over the serial link.
+    """
+    return summarize(session, name, column, gap, size)
+
+
+def save_device_config(session, dest_dir):
+    """Keep a copy of the device info.json with its files, the ingest tags the rows with it"""
+    config = read_config(session)
+    if config is not None:
+        with open(f"{dest_dir}/info.json", "w") as f:
+            json.dump(config, f, indent=2)
+
+
+def ingest(data_dir="data", store_dir=STORE_DIR, progress=None):
+    """Add the new rows of the downloaded files to the columnar store, returns an IngestResult
+
+    Runs on the computer only, no session needed.
+    """
+    return ingest_dir(data_dir, store_dir, progress=progress)
+
+
+def get_time(session):
+    """Time of the PCF8523 clock of the Cowbell shield, as a datetime"""
+    output = session.run_file("read_rtc_time.py")
+    numbers = [int(n) for n in re.findall(r"\d+", output)]
+    if len(numbers) < 6:
+        raise DeviceError(f"unexpected answer from read_rtc_time.py: {output.strip()}")
+    return datetime(*numbers[-6:])
+
+
+def set_time(session, state_path=clock_sync.STATE_FILE):
+    """Set the processor RTC and the PCF8523 to the computer time, on a second boundary
+
+    Returns a ClockSync(device_id, latency, offset_before, offset_after,
+    drift_ppm), the offsets being device minus computer time in seconds.
+    """
+    return clock_sync.sync_clock(session, state_path=state_path)
+
+
+def check_clock(session, state_path=clock_sync.STATE_FILE):
+    """Offset and drift of the device clock, without setting it"""
+    return clock_sync.check_clock(session, state_path=state_path)
+
+
+def read_config(session):
+    """Content of info.json on the device, None if there is none"""
+    try:
+        return json.loads(session.fs_readfile("info.json"))
+    except (DeviceExecError, ValueError):
+        return None
+
+
+def push_config(session, config):
+    """Write info.json on the device"""
+    session.fs_writefile("info.json", json.dumps(config, indent=2).encode())
+
+
+def build_config(latitude="", longitude="", named_location="", device_name="", description="", timestep=""):
+    """info.json content from the form values, the empty ones are saved as 9999
+
+    Raises ValueError for a device name with spaces or coordinates that are not numbers.
+    """
+    latitude, longitude = str(latitude).strip(), str(longitude).strip()
+    named_location, device_name = named_location.strip(), device_name.strip()
+    description, timestep = description.strip(), str(timestep).strip()
+    if " " in device_name:
+        raise ValueError(f"device name contains spaces: '{device_name}', replace them with underscores (_)")
+    return {
+        "latitude": float(latitude) if latitude else MISSING,
+        "longitude": float(longitude) if longitude else MISSING,
+        "named_location": named_location if named_location else str(MISSING),
+        "device_name": device_name if device_name else str(MISSING),
+        "description": description if description else str(MISSING),
+        "timestep": timestep if timestep else str(MISSING),
+        "generated_at": datetime.now().isoformat()
+    }
+
+
+def format_clock(result):
+    """One line description of a ClockSync"""
+    text = f"device {result.device_id}: latency {result.latency * 1000:.1f} ms, offset {result.offset_before:+.3f} s"
+    if result.offset_after is not None:
+        text += f", after setting {result.offset_after:+.3f} s"
+    if result.drift_ppm is not None:
+        text += f", drift {result.drift_ppm:+.1f} ppm"
+    return text
+
+
+# ----------------------------------------------------------------------
+# command line
+
+def _to_json(value):
+    if hasattr(value, "_asdict"):
+        return {key: _to_json(v) for key, v in value._asdict().items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    if isinstance(value, dict):
+        return {key: _to_json(v) for key, v in value.items()}
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _run_command(args, port):
+    with perf_log.operation(port, args.command):
+        return _run_session_command(args, port)
+
+
+def _run_session_command(args, port):
+    session = DeviceSession(port, sd_baudrate=args.sd_baudrate)
+    try:
+        if args.command == "list":
+            return list_files(session)
+        if args.command == "download":
+            return download(session, args.names, args.dest, compress=args.compress)
+        if args.command == "sync":
+            dest = args.dest
+            if args.port == "all":
+                dest = f"{args.dest}/{session.device_id()}"
+            result = sync(session, dest, verify=args.verify, compress=args.compress)
+            if args.ingest:
+                ingest(dest, args.store or os.path.join(args.dest, "store"))
+            return result
+        if args.command == "tail":
+            return tail(session, args.name, args.rows)
+        if args.command == "inspect":
+            column = int(args.column) if args.column.isdigit() else args.column
+            return inspect(session, args.name, column, args.gap)
+        if args.command == "get-time":
+            return get_time(session)
+        if args.command == "set-time":
+            return set_time(session)
+        if args.command == "check-clock":
+            return check_clock(session)
+        if args.command == "read-config":
+            return read_config(session)
+        if args.command == "push-config":
+            with open(args.file) as f:
+                config = json.load(f)
+            push_config(session, config)
+            return config
+    finally:
+        session.close()
+
+
+def _print_result(command, result):
+    if command == "list":
+        for f in result:
+            print(f"{f.size:>12} {datetime.fromtimestamp(f.mtime):%Y-%m-%d %H:%M} {f.name}")
+    elif command == "download":
+        for name in result.downloaded:
+            print(f"downloaded {name}")
+        for name, error in result.failed:
+            print(f"FAILED {name}: {error}")
+        print(format_transfer(result))
+    elif command == "sync":
+        print(f"new: {len(result.new)}, updated: {len(result.updated)}, up to date: {len(result.up_to_date)}, "
+              f"transferred: {result.bytes} bytes")
+        if result.link_bytes:
+            print(format_transfer(result))
+        for name, error in result.failed:
+            print(f"FAILED {name}: {error}")
+    elif command == "ingest":
+        print(f"ingested {result.rows} rows of {len(result.files)} file(s), {result.skipped_lines} lines skipped, "
+              f"days: {', '.join(result.partitions) or '-'}")
+    elif command == "tail":
+        print("\n".join(result.lines))
+    elif command == "inspect":
+        print(format_summary(result))
+    elif command in ("read-config", "push-config"):
+        print(json.dumps(result, indent=2))
+    elif command in ("set-time", "check-clock"):
+        print(format_clock(result))
+    else:
+        print(result.isoformat(sep=" ", timespec="seconds"))
+
+
+def _failed(result):
+    return bool(getattr(result, "failed", None))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m datalogger", description="Datalogger management without the GUI")
+    parser.add_argument("--port", default="auto", help="serial port, 'auto' for the first device, 'all' for every device")
+    parser.add_argument("--sd-baudrate", type=int, help="SPI clock of the SD card")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list the SD card files")
+    download_parser = commands.add_parser("download", help="download SD card files")
+    download_parser.add_argument("names", nargs="+")
+    download_parser.add_argument("--dest", default="data")
+    download_parser.add_argument("--compress", action="store_true", help="deflate the files on the device (if its firmware can)")
+    sync_parser = commands.add_parser("sync", help="copy what is new on the SD card (into DEST/<device id> with --port all)")
+    sync_parser.add_argument("--dest", default="data")
+    sync_parser.add_argument("--verify", action="store_true", help="check the local copies with a device side hash")
+    sync_parser.add_argument("--ingest", action="store_true", help="add the new rows to the columnar store afterwards")
+    sync_parser.add_argument("--store", help="columnar store of --ingest (default: DEST/store)")
+    sync_parser.add_argument("--compress", action="store_true", help="deflate the files on the device (if its firmware can)")
+    ingest_parser = commands.add_parser("ingest", help="add the rows of the downloaded files to the columnar store (no device needed)")
+    ingest_parser.add_argument("--data", default="data")
+    ingest_parser.add_argument("--store", default=STORE_DIR)
+    tail_parser = commands.add_parser("tail", help="last rows of an SD card file, without downloading it")
+    tail_parser.add_argument("name")
+    tail_parser.add_argument("--rows", type=int, default=10)
+    inspect_parser = commands.add_parser("inspect", help="rows, time span, min/max and gaps of an SD card file, scanned on the device")
+    inspect_parser.add_argument("name")
+    inspect_parser.add_argument("--column", default="1", help="column for the min/max: its name or index (0 is the time)")
+    inspect_parser.add_argument("--gap", type=int, default=0, help="seconds between rows counted as a gap (default: twice the usual step)")
+    commands.add_parser("get-time", help="read the device clock")
+    commands.add_parser("set-time", help="set the device clock to the computer time, on a second boundary")
+    commands.add_parser("check-clock", help="measure the offset and drift of the device clock")
+    commands.add_parser("read-config", help="print info.json of the device")
+    push_parser = commands.add_parser("push-config", help="write a JSON file as info.json on the device")
+    push_parser.add_argument("file")
+    args = parser.parse_args(argv)
+
+    if args.command == "ingest":
+        result = ingest(args.data, args.store)
+        if args.json:
+            print(json.dumps(_to_json(result), indent=2))
+        else:
+            _print_result(args.command, result)
+        return 0
+
+    ports = find_ports() if args.port == "all" else [args.port]
+    if not ports:
+        print("No device found", file=sys.stderr)
+        return 1
+    # one thread per device, they all work in parallel
+    with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        futures = {port: executor.submit(_run_command, args, port) for port in ports}
+    status = 0
+    results = {}
+    for port, future in futures.items():
+        try:
+            results[port] = future.result()
+        except (DeviceError, OSError) as e:
+            print(f"{port}: {e}", file=sys.stderr)
+            results[port] = {"error": str(e)}
+            status = 1
+            continue
+        if _failed(results[port]):
+            status = 1
+        if not args.json:
+            if len(ports) > 1:
+                print(f"== {port}")
+            _print_result(args.command, results[port])
+    if args.json:
+        output = results if len(ports) > 1 else results[ports[0]]
+        print(json.dumps(_to_json(output), indent=2))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
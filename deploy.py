@@ -0,0 +1,219 @@
+"""Deployment of the info.json of many loggers from one table
+
+A plan is a CSV or JSON table with one row per logger: its port or its serial
+number (the USB serial number of a Pico, the hex of machine.unique_id) to find
+it, and the fields of the form (device_name, latitude, longitude,
+named_location, description, timestep):
+
+    serial_number,device_name,latitude,longitude,named_location,timestep
+    *,,,,,60
+    E6614104035A2A2B,river_01,45.52,4.87,upstream,
+    E6614104035A2A2C,river_02,45.53,4.88,downstream,
+
+A row with "*" gives the defaults of every device. An empty cell keeps the
+value already on the device, and the values can use {serial_number}, {port}
+and {device_name} (the current one): "logger_{serial_number}". A JSON plan
+is a list of such objects, or {"defaults": {...}, "devices": [...]}.
+
+The info.json of each device is read first and only written when something
+changed (generated_at aside), on all the devices in parallel:
+
+    python deploy.py plan.csv --dry-run
+    python deploy.py plan.csv
+"""
+import argparse
+import collections
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import datalogger
+from device_session import DeviceSession, DeviceError, find_port_infos
+
+FIELDS = ("device_name", "latitude", "longitude", "named_location", "description", "timestep")
+# keys that identify the device of a row
+MATCH_KEYS = ("port", "serial_number")
+# keys of info.json that change at every generation and do not count as a difference
+IGNORED_KEYS = {"generated_at"}
+
+# status: "updated", "unchanged", "would update" (dry run), "not connected" or "error: ..."
+# changes: [(key, value on the device, new value), ...]
+DeployResult = collections.namedtuple("DeployResult", ["target", "port", "device_name", "status", "changes"])
+
+
+def _rows(path):
+    if os.path.splitext(path)[1].lower() == ".json":
+        with open(path) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            return [dict(data.get("defaults", {}), serial_number="*")] + list(data.get("devices", []))
+        return list(data)
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def load_plan(path):
+    """Rows of a plan file, the defaults merged into each of them
+
+    Raises ValueError for a row that does not say which device it is for, or
+    names the same one as another row.
+    """
+    defaults = {}
+    rows = []
+    seen = set()
+    for i, row in enumerate(_rows(path), 1):
+        row = {key.strip(): str(value).strip() for key, value in row.items() if key and value is not None}
+        if row.get("serial_number") == "*" or row.get("port") == "*":
+            defaults.update({key: value for key, value in row.items() if key in FIELDS and value})
+            continue
+        if not any(row.get(key) for key in MATCH_KEYS):
+            raise ValueError(f"row {i} of {path} has no port nor serial_number")
+        if target(row).upper() in seen:
+            raise ValueError(f"row {i} of {path}: {target(row)} is already in an earlier row")
+        seen.add(target(row).upper())
+        rows.append(row)
+    return [dict(defaults, **{key: value for key, value in row.items() if value}) for row in rows]
+
+
+def target(row):
+    """How a row names its device"""
+    return row.get("serial_number") or row.get("port")
+
+
+def match(rows, ports):
+    """[(row, port or None), ...] of the rows and the connected devices they are for
+
+    ports maps the port of each connected device to its serial number. A
+    device is only given to the first row that names it.
+    """
+    by_serial = {serial.upper(): port for port, serial in ports.items() if serial}
+    matched = []
+    taken = set()
+    for row in rows:
+        port = None
+        if row.get("serial_number"):
+            port = by_serial.get(row["serial_number"].upper())
+        if port is None and row.get("port") in ports:
+            port = row["port"]
+        if port in taken:
+            port = None
+        taken.add(port)
+        matched.append((row, port))
+    return matched
+
+
+def _fill(value, fields):
+    try:
+        return value.format(**fields)
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"cannot fill '{value}': {e}")
+
+
+def config_for(row, current, port="", serial_number=""):
+    """The info.json of a device: the values of its row, its current ones where the row has none"""
+    current = current or {}
+    fields = {"port": port, "serial_number": serial_number, "device_name": current.get("device_name", "")}
+    values = {}
+    for key in FIELDS:
+        if row.get(key):
+            values[key] = _fill(row[key], fields)
+        elif current.get(key) not in (None, datalogger.MISSING, str(datalogger.MISSING)):
+            values[key] = str(current[key])
+    config = datalogger.build_config(**values)
+    # what the row does not know about stays as it is
+    for key, value in current.items():
+        config.setdefault(key, value)
+    return config
+
+
+def config_diff(current, config):
+    """[(key, current value, new value), ...] of what differs, generated_at aside"""
+    current = current or {}
+    return [(key, current.get(key), value) for key, value in config.items()
+            if key not in IGNORED_KEYS and current.get(key) != value]
+
+
+def deploy_config(session, row, serial_number="", dry_run=False):
+    """Bring the info.json of one device to its row of the plan, only writing it if it changed
+
+    Returns a DeployResult.
+    """
+    current = datalogger.read_config(session)
+    if not serial_number:
+        # no USB serial number (a row matched by port): the same hex, from machine.unique_id
+        serial_number = session.device_id().upper()
+    config = config_for(row, current, session.port, serial_number)
+    changes = config_diff(current, config)
+    if changes and not dry_run:
+        datalogger.push_config(session, config)
+    status = ("would update" if dry_run else "updated") if changes else "unchanged"
+    return DeployResult(target(row), session.port, config["device_name"], status, changes)
+
+
+def _deploy_one(row, port, serial_number, dry_run, sd_baudrate):
+    session = DeviceSession(port, sd_baudrate=sd_baudrate)
+    try:
+        return deploy_config(session, row, serial_number, dry_run)
+    except (DeviceError, OSError, ValueError) as e:
+        return DeployResult(target(row), port, row.get("device_name", ""), f"error: {e}", [])
+    finally:
+        session.close()
+
+
+def deploy(rows, ports=None, dry_run=False, sd_baudrate=None):
+    """Deploy the rows of a plan on the connected devices, all in parallel, returns [DeployResult, ...]
+
+    ports maps the port of each device to its serial number, all the USB devices by default.
+    """
+    if ports is None:
+        ports = {info.device: info.serial_number or "" for info in find_port_infos()}
+    matched = match(rows, ports)
+    connected = [(row, port) for row, port in matched if port is not None]
+    results = {}
+    if connected:
+        with ThreadPoolExecutor(max_workers=len(connected)) as executor:
+            futures = {id(row): executor.submit(_deploy_one, row, port, ports[port], dry_run, sd_baudrate)
+                       for row, port in connected}
+        results = {key: future.result() for key, future in futures.items()}
+    return [results.get(id(row)) or DeployResult(target(row), "", row.get("device_name", ""), "not connected", [])
+            for row, port in matched]
+
+
+def format_result(result):
+    """Report of one device: its status and what changed"""
+    lines = [f"{result.target} ({result.port or '-'}) {result.device_name}: {result.status}"]
+    lines += [f"    {key}: {old!r} -> {new!r}" for key, old, new in result.changes]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upload the info.json of many loggers from a CSV or JSON table")
+    parser.add_argument("plan", help="CSV or JSON file, one row per device (port or serial_number + the info.json fields)")
+    parser.add_argument("--dry-run", action="store_true", help="only show what would change")
+    parser.add_argument("--port", action="append", help="serial port to use, not a USB device (can be repeated)")
+    parser.add_argument("--sd-baudrate", type=int, help="SPI clock of the SD card")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+    try:
+        rows = load_plan(args.plan)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    ports = {info.device: info.serial_number or "" for info in find_port_infos()}
+    for port in args.port or []:
+        ports.setdefault(port, "")
+    results = deploy(rows, ports, args.dry_run, args.sd_baudrate)
+    if args.json:
+        print(json.dumps([result._asdict() for result in results], indent=2))
+    else:
+        for result in results:
+            print(format_result(result))
+        counts = collections.Counter(result.status.split(":")[0] for result in results)
+        print(", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    return 1 if any(result.status.startswith("error") for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+import ast
+import os
+import struct
+import time
+
+import serial
+import serial.tools.list_ports
+
+import perf_log
+
+# Device side scripts (read_sd.py, read_rtc_time.py, ...) live next to this file
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RAW_REPL_BANNER = b"raw REPL; CTRL-B to exit\r\n"
+
+
+class DeviceError(Exception):
+    """Communication with the device failed"""
+
+
+class DeviceNotFound(DeviceError):
+    """No device is connected (or the requested port is gone)"""
+
+
+class Cancelled(DeviceError):
+    """The operation was cancelled by the user"""
+
+
+class DeviceExecError(DeviceError):
+    """Code sent to the device raised an exception"""
+
+    def __init__(self, output, error):
+        super().__init__(error.strip().splitlines()[-1] if error.strip() else "device error")
+        self.output = output
+        self.error = error
+
+
+def find_port_infos():
+    """pyserial port information of the USB serial devices (same rule as mpremote auto)"""
+    return [p for p in sorted(serial.tools.list_ports.comports()) if p.vid is not None and p.pid is not None]
+
+
+def find_ports():
+    """List the serial ports that look like USB micropython devices"""
+    return [p.device for p in find_port_infos()]
+
+
+def script_path(name):
+    """Full path of one of the device side scripts shipped with the GUI"""
+    return os.path.join(SCRIPTS_DIR, name)
+
+
+class DeviceSession:
+    """Long lived connection to one micropython device
+
+    The serial port is opened once and the raw REPL is kept entered, so each
+    operation is only a code upload and a read of the answer. If the device
+    is unplugged the next operation reconnects automatically.
+    """
+
+    def __init__(self, port="auto", baudrate=115200, timeout=10, sd_baudrate=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.sd_baudrate = sd_baudrate  # SPI clock of the SD card, None for the read_sd.py default
+        self.serial = None
+        self.device = None  # the port actually in use
+        self.sd_mounted = False
+        self.loaded_scripts = set()
+        self.use_raw_paste = True
+        self._buf = bytearray()
+
+    @property
+    def connected(self):
+        return self.serial is not None
+
+    def connect(self):
+        """Open the serial port and enter the raw REPL"""
+        if self.serial is not None:
+            return
+        with perf_log.phase("connect"):
+            self._connect()
+
+    def _connect(self):
+        if self.port == "auto":
+            candidates = find_ports()
+        else:
+            candidates = [self.port]
+        if not candidates:
+            raise DeviceNotFound("no device found")
+        last_error = None
+        for device in candidates:
+            try:
+                # exclusive: another session (fleet mode) can never share the port
+                self.serial = serial.serial_for_url(device, baudrate=self.baudrate, timeout=0.05, exclusive=True)
+            except (serial.SerialException, OSError) as e:
+                last_error = e
+                continue
+            self.device = device
+            try:
+                self._enter_raw_repl()
+            except (DeviceError, serial.SerialException, OSError):
+                self.close()
+                raise
+            return
+        raise DeviceNotFound(f"no device found ({last_error})")
+
+    def close(self):
+        """Leave the raw REPL and release the serial port"""
+        if self.serial is not None:
+            try:
+                self.serial.write(b"\r\x02")  # ctrl-B: back to the friendly REPL
+                self.serial.close()
+            except (serial.SerialException, OSError):
+                pass
+        self.serial = None
+        self.sd_mounted = False
+        self.loaded_scripts = set()
+        self.use_raw_paste = True
+        self._buf = bytearray()
+
+    def interrupt(self):
+        """Stop the code running on the device and drop the connection, the next operation reconnects cleanly"""
+        if self.serial is not None:
+            try:
+                self.serial.write(b"\r\x03\x03")  # ctrl-C twice
+            except (serial.SerialException, OSError):
+                pass
+        self.close()
+
+    # ------------------------------------------------------------------
+    # low level serial helpers
+
+    def _read_available(self):
+        n = self.serial.in_waiting
+        data = self.serial.read(n or 1)
+        if data:
+            self._buf += data
+        return len(data)
+
+    def read_until(self, ending, timeout=None):
+        """Read up to and including `ending`, raise DeviceError if it never comes"""
+        timeout = self.timeout if timeout is None else timeout
+        last_data = time.monotonic()
+        while True:
+            i = self._buf.find(ending)
+            if i >= 0:
+                i += len(ending)
+                data = bytes(self._buf[:i])
+                del self._buf[:i]
+                return data
+            if self._read_available():
+                last_data = time.monotonic()
+            elif time.monotonic() - last_data > timeout:
+                raise DeviceError(f"timeout waiting for {ending!r} from device")
+
+    def read_exact(self, n, timeout=None):
+        """Read exactly n bytes (used for binary transfers)"""
+        timeout = self.timeout if timeout is None else timeout
+        last_data = time.monotonic()
+        while len(self._buf) < n:
+            if self._read_available():
+                last_data = time.monotonic()
+            elif time.monotonic() - last_data > timeout:
+                raise DeviceError(f"timeout reading {n} bytes from device")
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+    def read_line(self, timeout=None):
+        """Read one line of output, without the line ending"""
+        return self.read_until(b"\n", timeout).rstrip(b"\r\n")
+
+    def _enter_raw_repl(self):
+        self.serial.write(b"\r\x03\x03")  # ctrl-C twice: interrupt any running program
+        time.sleep(0.05)
+        self.serial.reset_input_buffer()
+        self._buf = bytearray()
+        self.serial.write(b"\r\x01")  # ctrl-A: enter raw REPL
+        self.read_until(RAW_REPL_BANNER + b">")
+
+    # ------------------------------------------------------------------
+    # code execution
+
+    def exec_start(self, code):
+        """Send code to the raw REPL and start it, its output is read by the caller"""
+        if isinstance(code, str):
+            code = code.encode()
+        if self.use_raw_paste:
+            sent = time.perf_counter()
+            self.serial.write(b"\x05A\x01")
+            answer = self.read_exact(2)
+            perf_log.round_trip(time.perf_counter() - sent)
+            if answer == b"R\x01":
+                self._raw_paste_write(code)
+                return
+            if answer != b"R\x00":
+                # very old firmware, it echoed the bytes as a normal raw REPL line
+                self.read_until(b"w REPL; CTRL-B to exit\r\n>")
+            self.use_raw_paste = False
+        for i in range(0, len(code), 256):
+            self.serial.write(code[i:i + 256])
+            time.sleep(0.01)
+        sent = time.perf_counter()
+        self.serial.write(b"\x04")
+        answer = self.read_exact(2)
+        perf_log.round_trip(time.perf_counter() - sent)
+        if answer != b"OK":
+            raise DeviceError(f"could not execute code (response: {answer!r})")
+
+    def _raw_paste_write(self, code):
+        window_size = struct.unpack("<H", self.read_exact(2))[0]
+        window = window_size
+        i = 0
+        while i < len(code):
+            while window == 0 or self.serial.in_waiting or self._buf:
+                flow = self.read_exact(1)
+                if flow == b"\x01":
+                    window += window_size
+                elif flow == b"\x04":
+                    # device aborted the paste, the error comes as normal output
+                    self.serial.write(b"\x04")
+                    return
+                else:
+                    raise DeviceError(f"unexpected data during raw paste: {flow!r}")
+            chunk = code[i:i + window]
+            self.serial.write(chunk)
+            window -= len(chunk)
+            i += len(chunk)
+        self.serial.write(b"\x04")
+        self.read_until(b"\x04")
+
+    def exec_finish(self, timeout=None):
+        """Collect the rest of the output of the running code and its error output"""
+        output = self.read_until(b"\x04", timeout)[:-1]
+        error = self.read_until(b"\x04", timeout)[:-1]
+        self.read_until(b">", timeout)
+        if error:
+            raise DeviceExecError(output.decode(errors="replace"), error.decode(errors="replace"))
+        return output
+
+    def _exec(self, code, timeout):
+        self.exec_start(code)
+        return self.exec_finish(timeout)
+
+    def call(self, function, *args, **kwargs):
+        """Run function(*args) with the session connected, reconnecting once if the device was unplugged"""
+        for attempt in range(2):
+            try:
+                self.connect()
+                perf_log.set_device(self.device)
+                return function(*args, **kwargs)
+            except (serial.SerialException, OSError) as e:
+                self.close()
+                if attempt == 1:
+                    raise DeviceNotFound(f"device disconnected ({e})")
+                perf_log.retry()
+            except DeviceExecError:
+                raise
+            except DeviceError:
+                # out of sync with the REPL (timeout, garbage...): start again cleanly next time
+                self.close()
+                raise
+
+    def exec(self, code, timeout=None):
+        """Execute code on the device and return what it printed"""
+        return self.call(self._exec, code, timeout).decode(errors="replace")
+
+    def eval(self, expression, timeout=None):
+        """Evaluate a python expression on the device and return its value"""
+        return ast.literal_eval(self.exec(f"print(repr({expression}))", timeout).strip())
+
+    def run_file(self, name, timeout=None):
+        """Execute one of the device side scripts (like `mpremote run <name>`)"""
+        with open(script_path(name)) as f:
+            return self.exec(f.read(), timeout)
+
+    def soft_reset(self):
+        """Soft reset the device and enter the raw REPL again"""
+        def reset():
+            self.serial.write(b"\x04")  # ctrl-D at the raw REPL prompt: soft reboot
+            self.read_until(b"soft reboot\r\n")
+            self.read_until(RAW_REPL_BANNER + b">")
+            self.sd_mounted = False
+            self.loaded_scripts = set()
+        self.call(reset)
+
+    def device_id(self):
+        """Unique id of the board (machine.unique_id, the USB serial number on a Pico)"""
+        return self.eval("__import__('binascii').hexlify(__import__('machine').unique_id()).decode()")
+
+    def ensure_script(self, name):
+        """Run a device side script that only defines helpers, once per session"""
+        if self.connected and name in self.loaded_scripts:
+            return
+        self.run_file(name)
+        self.loaded_scripts.add(name)
+
+    # ------------------------------------------------------------------
+    # SD card and filesystem helpers
+
+    def ensure_sd_mounted(self):
+        """Mount the SD card with read_sd.py, only once per session"""
+        if self.connected and self.sd_mounted:
+            return
+        self.connect()
+        with perf_log.phase("mount"):
+            try:
+                self.exec("import os\nos.stat('/sd')")
+            except DeviceExecError:
+                if self.sd_baudrate:
+                    self.exec(f"SD_BAUDRATE = {int(self.sd_baudrate)}")
+                self.run_file("read_sd.py", timeout=15)
+        self.sd_mounted = True
+
+    def fs_listdir(self, path):
+        """List a directory on the device, as (name, size, is_dir) tuples"""
+        entries = self.eval(f"[(e[0], e[3] if len(e) > 3 else 0, e[1] == 0x4000) for e in __import__('os').ilistdir({path!r})]")
+        return [(name, size, is_dir) for name, size, is_dir in entries]
+
+    def fs_readfile(self, path, chunk_size=512):
+        """Read a whole file from the device"""
+        output = self.exec(
+            "import binascii\n"
+            f"with open({path!r}, 'rb') as f:\n"
+            f"    b = bytearray({chunk_size})\n"
+            "    while True:\n"
+            "        n = f.readinto(b)\n"
+            "        if not n:\n"
+            "            break\n"
+            "        print(binascii.hexlify(b[:n]).decode())\n",
+            timeout=30)
+        data = bytes.fromhex("".join(output.split()))
+        perf_log.add_bytes(len(data))
+        return data
+
+    def fs_writefile(self, path, data, chunk_size=256):
+        """Write a whole file on the device"""
+        self.exec(f"f = open({path!r}, 'wb')")
+        try:
+            for i in range(0, len(data), chunk_size):
+                self.exec(f"f.write({bytes(data[i:i + chunk_size])!r})")
+        finally:
+            self.exec("f.close()\ndel f")
+        perf_log.add_bytes(len(data))
@@ -0,0 +1,485 @@
+"""Simulated Pico + Cowbell datalogger speaking the micropython raw REPL over a pty
+
+The code sent by the GUI is executed with the host python, with small stand-ins
+for the micropython modules used by the device side scripts (machine, vfs,
+sdcard, urtc, os, time, deflate). The SD card is a directory on the computer.
+
+The SD card can be filled with generated logger files, the PCF8523 can
+drift and the link can be slowed down to the bandwidth of a real Pico, so
+that the benchmarks (benchmark.py) see realistic numbers.
+
+Run it on its own to get a port the GUI can use:
+
+    python device_simulator.py --sd some/dir
+    python device_simulator.py --files 1000 --file-size 20000 --drift-ppm 30 --bandwidth 100000
+    python device_simulator.py --no-compression  # firmware built without deflate compression
+    DATALOGGER_PORT=/dev/pts/5 python full_datalogger_management_gui.py
+"""
+import argparse
+import builtins
+import calendar
+import collections
+import importlib
+import os
+import pty
+import select
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import traceback
+import tty
+import types
+import zlib
+from datetime import datetime, timedelta
+
+RAW_PASTE_WINDOW = 128
+# one line of the generated logger files
+LOG_ROW = " {:02d}:{:02d}:{:02d},{:.2f},{:.1f},1013.2\n"  # after the date
+# Modules the device code may import that are the same in python and micropython
+REAL_MODULES = {"binascii", "hashlib", "json", "struct", "errno", "math", "re", "io", "array", "collections"}
+
+DateTimeTuple = collections.namedtuple(
+    "DateTimeTuple", ["year", "month", "day", "weekday", "hour", "minute", "second", "millisecond"])
+
+
+def datetime_tuple(year=None, month=None, day=None, weekday=None, hour=None, minute=None,
+                   second=None, millisecond=None):
+    return DateTimeTuple(year, month, day, weekday, hour, minute, second, millisecond)
+
+
+class _Stdout:
+    """sys.stdout of the simulated device, written straight to the pty"""
+
+    def __init__(self, send):
+        self.buffer = types.SimpleNamespace(write=send)
+        self._send = send
+
+    def write(self, text):
+        self._send(text.replace("\n", "\r\n").encode())
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class SimulatedDevice:
+    """One simulated device, the host connects to `port` like to a real Pico"""
+
+    def __init__(self, sd_dir=None, flash_dir=None, unique_id=b"\xe6\x61\x41\x04\x03\x57\x2a\x2b",
+                 drift_ppm=0.0, bandwidth=None, compression=True):
+        """drift_ppm: how fast the PCF8523 runs compared to the computer clock,
+        bandwidth: bytes per second of the USB link in each direction (None for as fast as the pty goes),
+        compression: whether the deflate module can compress (MICROPY_PY_DEFLATE_COMPRESS)
+        """
+        self._tmp = tempfile.mkdtemp(prefix="pico_sim_")
+        self.sd_dir = sd_dir or os.path.join(self._tmp, "sd")
+        self.flash_dir = flash_dir or os.path.join(self._tmp, "flash")
+        os.makedirs(self.sd_dir, exist_ok=True)
+        os.makedirs(self.flash_dir, exist_ok=True)
+        self.unique_id = unique_id
+        self.port = None
+        self.sd_mounted = False
+        # machine.RTC and the PCF8523 are kept as offsets from the computer clock
+        self.rtc_offset = 0.0
+        self.ext_rtc_value = int(time.time())
+        self.ext_rtc_set_at = time.time()
+        self.drift_ppm = drift_ppm
+        self.bandwidth = bandwidth
+        self.compression = compression
+        self._link_free = {"out": 0.0, "in": 0.0}  # time when each direction of the link is free again
+        self._master = None
+        self._slave = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._inbuf = bytearray()
+        self._soft_reboot()
+
+    # ------------------------------------------------------------------
+    # pty plumbing
+
+    def start(self):
+        """Create the pty and serve the REPL in a background thread, return the port"""
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2)
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+        shutil.rmtree(self._tmp, ignore_errors=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _pace(self, direction, size):
+        """Wait as long as size bytes take on a link of self.bandwidth bytes per second"""
+        if not self.bandwidth:
+            return
+        now = time.monotonic()
+        free = max(now, self._link_free[direction]) + size / self.bandwidth
+        self._link_free[direction] = free
+        if free - now > 0.001:
+            time.sleep(free - now)
+
+    def _send(self, data):
+        self._pace("out", len(data))
+        view = memoryview(bytes(data))
+        while view:
+            n = os.write(self._master, view)
+            view = view[n:]
+        return len(data)
+
+    def _getc(self):
+        while not self._inbuf:
+            if self._stop.is_set():
+                raise EOFError
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if ready:
+                try:
+                    received = os.read(self._master, 4096)
+                except OSError:
+                    raise EOFError
+                self._pace("in", len(received))
+                self._inbuf += received
+        c = bytes(self._inbuf[:1])
+        del self._inbuf[:1]
+        return c
+
+    # ------------------------------------------------------------------
+    # REPL
+
+    def _serve(self):
+        raw = False
+        code = bytearray()
+        try:
+            while True:
+                c = self._getc()
+                if not raw:
+                    if c == b"\x01":
+                        raw = True
+                        code.clear()
+                        self._send(b"\r\nraw REPL; CTRL-B to exit\r\n>")
+                    elif c == b"\x03":
+                        self._send(b"\r\n>>> ")
+                    elif c == b"\x04":
+                        self._soft_reboot()
+                        self._send(b"MPY: soft reboot\r\n>>> ")
+                    else:
+                        self._send(c)
+                elif c == b"\x01":
+                    code.clear()
+                    self._send(b"\r\nraw REPL; CTRL-B to exit\r\n>")
+                elif c == b"\x02":
+                    raw = False
+                    self._send(b"\r\n>>> ")
+                elif c == b"\x03":
+                    code.clear()
+                elif c == b"\x05" and not code:
+                    self._getc()  # 'A'
+                    self._getc()  # '\x01'
+                    self._send(b"R\x01" + struct.pack("<H", RAW_PASTE_WINDOW))
+                    self._execute(self._read_raw_paste())
+                elif c == b"\x04":
+                    if code:
+                        self._send(b"OK")
+                        self._execute(bytes(code))
+                        code.clear()
+                    else:
+                        self._soft_reboot()
+                        self._send(b"soft reboot\r\nraw REPL; CTRL-B to exit\r\n>")
+                else:
+                    code += c
+        except EOFError:
+            pass
+
+    def _read_raw_paste(self):
+        code = bytearray()
+        received = 0
+        while True:
+            c = self._getc()
+            if c == b"\x04":
+                self._send(b"\x04")
+                return bytes(code)
+            code += c
+            received += 1
+            if received == RAW_PASTE_WINDOW:
+                received = 0
+                self._send(b"\x01")
+
+    def _execute(self, code):
+        error = b""
+        try:
+            exec(compile(code.decode(), "<stdin>", "exec"), self.globals)
+        except SystemExit:
+            pass
+        except BaseException as e:
+            line = traceback.format_exception_only(type(e), e)[-1].strip()
+            error = f"Traceback (most recent call last):\r\n  File \"<stdin>\"\r\n{line}\r\n".encode()
+        self._send(b"\x04" + error + b"\x04>")
+
+    def _soft_reboot(self):
+        self.sd_mounted = False
+        self.modules = self._make_modules()
+        device_builtins = dict(vars(builtins))
+        device_builtins.update(open=self._open, print=self._print, __import__=self._import)
+        self.globals = {"__name__": "__main__", "__builtins__": device_builtins}
+
+    # ------------------------------------------------------------------
+    # micropython environment
+
+    def host_path(self, path):
+        """Path on the computer of a path on the device"""
+        parts = [p for p in path.split("/") if p and p != "."]
+        if parts and parts[0] == "sd" and self.sd_mounted:
+            return os.path.join(self.sd_dir, *parts[1:])
+        return os.path.join(self.flash_dir, *parts)
+
+    def _open(self, path, mode="r", *args, **kwargs):
+        return open(self.host_path(path), mode, *args, **kwargs)
+
+    def _print(self, *args, sep=" ", end="\n", file=None):
+        (file or self.modules["sys"].stdout).write(sep.join(str(a) for a in args) + end)
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if name in self.modules:
+            return self.modules[name]
+        if name in REAL_MODULES:
+            return importlib.import_module(name)
+        raise ImportError(f"no module named '{name}'")
+
+    def rtc_now(self):
+        """Seconds since the epoch according to machine.RTC"""
+        return time.time() + self.rtc_offset
+
+    def ext_rtc_now(self):
+        """Seconds since the epoch according to the PCF8523 (whole seconds only)"""
+        return int(self.ext_rtc_value + (time.time() - self.ext_rtc_set_at) * (1 + self.drift_ppm / 1e6))
+
+    def populate_sd(self, count, size, folders=0, start=None, interval=60):
+        """Fill the SD card with count logger files of about size bytes each
+
+        The files follow each other in time, one row every interval seconds.
+        With folders > 0 they are spread over that many subfolders. Returns
+        the SD card paths of the files.
+        """
+        rows = [LOG_ROW.format(t // 3600, t // 60 % 60, t % 60, 20 + t // interval % 997 / 100, 40 + t // interval % 300 / 10)
+                for t in range(0, 86400, interval)]
+        day = start or datetime(2025, 6, 1)
+        names = []
+        for i in range(count):
+            name = f"log_{i:05d}.csv"
+            if folders:
+                folder = f"day_{i % folders:03d}"
+                os.makedirs(os.path.join(self.sd_dir, folder), exist_ok=True)
+                name = f"{folder}/{name}"
+            with open(os.path.join(self.sd_dir, name), "wb") as f:
+                left = size
+                while left > 0:
+                    date = f"{day:%Y-%m-%d}"
+                    block = "".join(date + row for row in rows).encode()
+                    if len(block) > left:
+                        block = block[:block.rfind(b"\n", 0, left) + 1]
+                        if not block:
+                            break
+                    f.write(block)
+                    left -= len(block)
+                    day += timedelta(days=1)
+            names.append(name)
+        return names
+
+    def _make_modules(self):
+        device = self
+        modules = {}
+
+        def module(name, **attrs):
+            m = types.ModuleType(name)
+            m.__dict__.update(attrs)
+            modules[name] = m
+            return m
+
+        module("sys", stdout=_Stdout(self._send), implementation=types.SimpleNamespace(name="micropython"),
+               platform="rp2", print_exception=lambda e: traceback.print_exception(e))
+        module("gc", collect=lambda: None, mem_free=lambda: 180000, mem_alloc=lambda: 20000)
+        module("micropython", const=lambda x: x)
+
+        # os, restricted to the simulated flash and SD card
+        def ilistdir(path="."):
+            host = device.host_path(path)
+            for name in sorted(os.listdir(host)):
+                st = os.stat(os.path.join(host, name))
+                kind = 0x4000 if os.path.isdir(os.path.join(host, name)) else 0x8000
+                yield (name, kind, 0, st.st_size)
+
+        def stat(path):
+            st = os.stat(device.host_path(path))
+            mode = 0x4000 if os.path.isdir(device.host_path(path)) else 0x8000
+            mtime = int(st.st_mtime)
+            return (mode, 0, 0, 0, 0, 0, st.st_size, mtime, mtime, mtime)
+
+        module("os", ilistdir=ilistdir, listdir=lambda path=".": sorted(os.listdir(device.host_path(path))),
+               stat=stat, remove=lambda p: os.remove(device.host_path(p)),
+               rename=lambda a, b: os.rename(device.host_path(a), device.host_path(b)),
+               mkdir=lambda p: os.mkdir(device.host_path(p)), rmdir=lambda p: os.rmdir(device.host_path(p)),
+               getcwd=lambda: "/", sync=lambda: None,
+               uname=lambda: ("rp2", "rp2", "1.24.0", "v1.24.0", "Raspberry Pi Pico with RP2040"))
+
+        # time, following machine.RTC
+        start = time.monotonic()
+
+        def localtime(secs=None):
+            t = time.gmtime(device.rtc_now() if secs is None else secs)
+            return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, t.tm_wday, t.tm_yday)
+
+        module("time", time=lambda: int(device.rtc_now()), time_ns=lambda: int(device.rtc_now() * 1e9),
+               localtime=localtime, gmtime=localtime, mktime=lambda t: calendar.timegm(tuple(t[:6]) + (0, 0, 0)),
+               sleep=time.sleep, sleep_ms=lambda ms: time.sleep(ms / 1000), sleep_us=lambda us: time.sleep(us / 1e6),
+               ticks_ms=lambda: int((time.monotonic() - start) * 1000),
+               ticks_us=lambda: int((time.monotonic() - start) * 1e6),
+               ticks_diff=lambda a, b: a - b, ticks_add=lambda a, b: a + b)
+
+        # machine
+        class Pin:
+            IN, OUT, PULL_UP, PULL_DOWN = 0, 1, 1, 2
+
+            def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+                self.id = pin_id
+
+            def value(self, v=None):
+                return 0
+
+        class SPI:
+            MSB, LSB = 0, 1
+
+            def __init__(self, bus_id, baudrate=1000000, **kwargs):
+                self.baudrate = baudrate
+
+            def init(self, baudrate=1000000, **kwargs):
+                self.baudrate = baudrate
+
+        class I2C:
+            def __init__(self, bus_id, scl=None, sda=None, freq=400000):
+                pass
+
+        class RTC:
+            def datetime(self, dt=None):
+                if dt is None:
+                    t = time.gmtime(device.rtc_now())
+                    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_wday, t.tm_hour, t.tm_min, t.tm_sec, 0)
+                secs = calendar.timegm((dt[0], dt[1], dt[2], dt[4], dt[5], dt[6], 0, 0, 0))
+                device.rtc_offset = secs + dt[7] / 1e6 - time.time()
+
+        module("machine", Pin=Pin, SPI=SPI, I2C=I2C, RTC=RTC, unique_id=lambda: device.unique_id,
+               freq=lambda *a: 125000000, soft_reset=lambda: None)
+
+        # SD card
+        class SDCard:
+            def __init__(self, spi, cs, baudrate=1320000):
+                self.baudrate = baudrate
+
+        class VfsFat:
+            def __init__(self, block_device):
+                self.block_device = block_device
+
+        def mount(fs, mount_point):
+            if device.sd_mounted:
+                raise OSError(1, "EPERM")
+            device.sd_mounted = True
+
+        def umount(mount_point):
+            device.sd_mounted = False
+
+        module("sdcard", SDCard=SDCard)
+        module("vfs", VfsFat=VfsFat, mount=mount, umount=umount)
+
+        # PCF8523 on the Cowbell shield
+        class PCF8523:
+            def __init__(self, i2c, address=0x68):
+                pass
+
+            def datetime(self, dt=None):
+                if dt is None:
+                    t = time.gmtime(device.ext_rtc_now())
+                    return DateTimeTuple(t.tm_year, t.tm_mon, t.tm_mday, t.tm_wday, t.tm_hour, t.tm_min, t.tm_sec, 0)
+                device.ext_rtc_value = calendar.timegm((dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, 0, 0, 0))
+                device.ext_rtc_set_at = time.time()
+
+        module("urtc", PCF8523=PCF8523, datetime_tuple=datetime_tuple, DateTimeTuple=DateTimeTuple)
+
+        # deflate, the compressing side only exists when the firmware is built with it
+        class DeflateIO:
+            def __init__(self, stream, format=0, wbits=0, close=False):
+                if not device.compression:
+                    raise OSError(95, "EOPNOTSUPP")
+                if format not in (1, 2, 3):  # RAW, ZLIB, GZIP
+                    raise ValueError("format")
+                wbits = max(wbits or 8, 9)
+                self._stream = stream
+                self._close = close
+                self._z = zlib.compressobj(wbits=-wbits if format == 1 else wbits + (16 if format == 3 else 0))
+
+            def write(self, data):
+                out = self._z.compress(bytes(data))
+                if out:
+                    self._stream.write(out)
+                return len(data)
+
+            def close(self):
+                if self._z is not None:
+                    self._stream.write(self._z.flush())
+                    self._z = None
+                    if self._close:
+                        self._stream.close()
+
+        module("deflate", DeflateIO=DeflateIO, AUTO=0, RAW=1, ZLIB=2, GZIP=3)
+        return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Pico datalogger on a pty")
+    parser.add_argument("--sd", help="directory used as the SD card")
+    parser.add_argument("--flash", help="directory used as the internal flash")
+    parser.add_argument("--files", type=int, default=0, help="logger files to generate on the SD card")
+    parser.add_argument("--file-size", type=int, default=10000, help="bytes of each generated file")
+    parser.add_argument("--drift-ppm", type=float, default=0.0, help="drift of the PCF8523")
+    parser.add_argument("--bandwidth", type=int, help="bytes per second of the link (default: unlimited)")
+    parser.add_argument("--devices", type=int, default=1, help="number of simulated devices")
+    parser.add_argument("--no-compression", action="store_true", help="deflate module without compression")
+    args = parser.parse_args()
+    devices = []
+    try:
+        for i in range(args.devices):
+            sd_dir = args.sd if args.devices == 1 else None
+            flash_dir = args.flash if args.devices == 1 else None
+            device = SimulatedDevice(sd_dir, flash_dir, unique_id=b"\xe6\x61\x41\x04\x03\x57" + bytes([0x2a, 0x2b + i]),
+                                     drift_ppm=args.drift_ppm, bandwidth=args.bandwidth,
+                                     compression=not args.no_compression)
+            devices.append(device)
+            if args.files:
+                device.populate_sd(args.files, args.file_size)
+            device.start()
+            print(f"Simulated device on {device.port}  (SD card: {device.sd_dir})")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for device in devices:
+            device.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Run the device operations off the Tk main thread
+
+Each device gets one DeviceWorker: its operations are queued and executed one
+after the other by a background thread, so two clicks never talk to the same
+serial port at the same time. Results come back through poll(), which the
+GUI calls regularly with root.after, so widgets are only touched from the Tk
+thread.
+"""
+import queue
+import threading
+import traceback
+
+import perf_log
+from device_session import Cancelled
+
+
+class _Job:
+    def __init__(self, label, function, args, kwargs, on_done, on_error):
+        self.label = label
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancel = threading.Event()
+
+
+class DeviceWorker:
+    """Background thread executing the operations for one device, in order"""
+
+    def __init__(self, name="device"):
+        self.name = name
+        self._jobs = queue.Queue()
+        self._events = queue.Queue()  # callbacks to run on the GUI thread
+        self._lock = threading.Lock()
+        self._pending = []
+        self.current = None  # the job running now
+        self._thread = threading.Thread(target=self._run, name=f"worker-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, label, function, *args, on_done=None, on_error=None, cancellable=False, **kwargs):
+        """Queue function(*args, **kwargs)
+
+        on_done(result) or on_error(exception) are then called from poll().
+        With cancellable=True the function gets a `cancel` threading.Event
+        keyword argument that is set when the user cancels.
+        """
+        job = _Job(label, function, args, kwargs, on_done, on_error)
+        if cancellable:
+            job.kwargs["cancel"] = job.cancel
+        with self._lock:
+            self._pending.append(job)
+        self._jobs.put(job)
+        return job
+
+    def report(self, callback, *args):
+        """Run callback(*args) on the GUI thread (progress updates from inside a job)"""
+        self._events.put((callback, args))
+
+    def cancel(self):
+        """Cancel the running job and drop the queued ones"""
+        with self._lock:
+            dropped = self._pending
+            self._pending = []
+            current = self.current
+        for job in dropped:
+            job.cancel.set()
+            if job.on_error:
+                self.report(job.on_error, Cancelled("cancelled before it started"))
+        if current is not None:
+            current.cancel.set()
+
+    @property
+    def busy(self):
+        return self.current is not None or bool(self._pending)
+
+    @property
+    def queued(self):
+        return len(self._pending)
+
+    def poll(self):
+        """Call the finished jobs callbacks, from the GUI thread"""
+        while True:
+            try:
+                callback, args = self._events.get_nowait()
+            except queue.Empty:
+                return
+            callback(*args)
+
+    def stop(self, then=None):
+        """Cancel everything and end the thread, after running then() if given (to close the session)"""
+        self.cancel()
+        if then is not None:
+            self.submit("Stopping", then)
+        self._jobs.put(None)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            with self._lock:
+                if job not in self._pending:
+                    continue  # cancelled while queued
+                self._pending.remove(job)
+                self.current = job
+            try:
+                # timed by phase in the performance log
+                with perf_log.operation(self.name, job.label):
+                    result = job.function(*job.args, **job.kwargs)
+            except Exception as e:
+                if job.on_error:
+                    self.report(job.on_error, e)
+                else:
+                    traceback.print_exc()
+            else:
+                if job.on_done:
+                    self.report(job.on_done, result)
+            finally:
+                with self._lock:
+                    self.current = None
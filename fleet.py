@@ -0,0 +1,190 @@
+"""Fleet mode: several loggers plugged at once, one session and one worker per port
+
+Every device has its own DeviceWorker, so an operation started on the whole
+fleet runs on all the ports in parallel while the operations of one device
+stay serialized.
+"""
+import os
+
+import datalogger
+import deploy
+from device_session import DeviceSession, find_port_infos
+from device_worker import DeviceWorker
+
+
+class FleetDevice:
+    """One logger of the fleet"""
+
+    def __init__(self, port, serial_number=None, description=None, session=None, worker=None, sd_baudrate=None):
+        self.port = port
+        self.serial_number = serial_number or ""
+        self.description = description or ""
+        self.owned = session is None  # False for the session of the main window
+        self.session = session or DeviceSession(port, sd_baudrate=sd_baudrate)
+        self.worker = worker or DeviceWorker(port)
+        self.name = ""  # device_name of its info.json
+        self.status = "Connected"
+        self.present = True
+
+    @property
+    def label(self):
+        return self.name or self.serial_number or os.path.basename(self.port)
+
+
+class Fleet:
+    """All the loggers connected to the computer"""
+
+    def __init__(self, data_dir="data", sd_baudrate=None, on_status=None):
+        self.data_dir = data_dir
+        self.sd_baudrate = sd_baudrate
+        self.on_status = on_status  # called with the device when its status changes (GUI thread)
+        self.devices = {}
+
+    def adopt(self, port, session, worker):
+        """Use an already open session (the main window's) for this port instead of opening it twice"""
+        if port not in self.devices:
+            self.devices[port] = FleetDevice(port, session=session, worker=worker)
+
+    def refresh(self):
+        """Look for plugged and unplugged devices, return the new ones"""
+        infos = {p.device: p for p in find_port_infos()}
+        new = []
+        for port, info in infos.items():
+            device = self.devices.get(port)
+            if device is None:
+                device = FleetDevice(port, info.serial_number, info.description, sd_baudrate=self.sd_baudrate)
+                self.devices[port] = device
+                new.append(device)
+            elif not device.present:
+                device.present = True
+                new.append(device)
+            if not device.serial_number:
+                device.serial_number = info.serial_number or ""
+                device.description = info.description or ""
+        for port, device in self.devices.items():
+            if port not in infos and device.present:
+                device.present = False
+                device.worker.submit("Disconnecting", device.session.close)
+                self._set_status(device, "Disconnected")
+        for device in new:
+            self.identify(device)
+        return new
+
+    def identify(self, device):
+        """Read the device name from its info.json"""
+        def identified(config):
+            device.name = (config or {}).get("device_name", "")
+            self._set_status(device, "Ready")
+        self._submit(device, "Identifying", datalogger.read_config, on_done=identified)
+
+    def _set_status(self, device, status):
+        device.status = status
+        if self.on_status:
+            self.on_status(device)
+
+    def _submit(self, device, label, operation, *args, on_done=None, describe=None, **kwargs):
+        def done(result):
+            if on_done:
+                on_done(result)
+            if describe:
+                self._set_status(device, describe(result))
+
+        def failed(e):
+            self._set_status(device, f"Error: {e}")
+
+        self._set_status(device, f"{label}...")
+        device.worker.submit(label, operation, device.session, *args, on_done=done, on_error=failed, **kwargs)
+
+    def present_devices(self):
+        return [device for device in self.devices.values() if device.present]
+
+    def data_dir_for(self, session):
+        """Each logger syncs into its own folder of the data directory, named after its unique id
+
+        Like `datalogger --port all sync`: the device names are not unique
+        (every logger whose form was left empty is "9999").
+        """
+        return os.path.join(self.data_dir, session.device_id())
+
+    def set_time_all(self, devices=None):
+        # the clock drift of every logger is followed in the data directory
+        state_path = os.path.join(self.data_dir, "clock_sync.json")
+        for device in devices or self.present_devices():
+            self._submit(device, "Setting time", datalogger.set_time, state_path, describe=lambda result: "Time set")
+
+    def push_config_all(self, data, devices=None):
+        """Upload the same configuration everywhere, each logger keeps its own device_name"""
+        def push(session, data):
+            current = datalogger.read_config(session) or {}
+            data = dict(data)
+            if current.get("device_name"):
+                data["device_name"] = current["device_name"]
+            if not deploy.config_diff(current, data):
+                return False  # spare the flash a write of the same content
+            datalogger.push_config(session, data)
+            return True
+        for device in devices or self.present_devices():
+            self._submit(device, "Uploading config", push, data,
+                         describe=lambda changed: "Config uploaded" if changed else "Config unchanged")
+
+    def deploy_all(self, rows, dry_run=False, on_result=None):
+        """Upload the info.json of each device from its row of a plan (deploy.load_plan), where it differs
+
+        on_result(DeployResult) is called for each device done. Returns the
+        rows of the plan for which no device is connected.
+        """
+        devices = {device.port: device for device in self.present_devices()}
+        missing = []
+        for row, port in deploy.match(rows, {port: device.serial_number for port, device in devices.items()}):
+            if port is None:
+                missing.append(row)
+                continue
+            device = devices[port]
+
+            def done(result, device=device):
+                if result.status == "updated":
+                    device.name = result.device_name
+                if on_result:
+                    on_result(result)
+
+            def describe(result):
+                if not result.changes:
+                    return "Config unchanged"
+                keys = ", ".join(key for key, old, new in result.changes)
+                return f"Config would change: {keys}" if dry_run else f"Config updated: {keys}"
+
+            self._submit(device, "Deploying config", deploy.deploy_config, row, device.serial_number, dry_run,
+                         on_done=done, describe=describe)
+        return missing
+
+    def sync_all(self, devices=None, progress=None, compress=False):
+        def sync(session, progress=None, cancel=None):
+            # in the worker: the unique id comes from the device
+            return datalogger.sync(session, self.data_dir_for(session), progress=progress, cancel=cancel,
+                                   compress=compress)
+
+        def describe(result):
+            return (f"Synced: {len(result.new)} new, {len(result.updated)} updated, "
+                    f"{result.bytes} bytes" + (f", {len(result.failed)} failed" if result.failed else ""))
+        for device in devices or self.present_devices():
+            device_progress = None
+            if progress:
+                device_progress = lambda *args, device=device: progress(device, *args)
+            self._submit(device, "Syncing SD card", sync, progress=device_progress, cancellable=True,
+                         describe=describe)
+
+    def cancel_all(self):
+        for device in self.devices.values():
+            device.worker.cancel()
+
+    def poll(self):
+        """Deliver the results of every device worker (GUI thread)"""
+        for device in list(self.devices.values()):
+            device.worker.poll()
+
+    def close(self):
+        """Stop the workers and close the sessions this fleet opened itself"""
+        for device in self.devices.values():
+            if device.owned:
+                device.worker.stop(then=device.session.close)
+        self.devices = {}
@@ -1,12 +1,37 @@
+import time
+STARTED = time.perf_counter()  # for the startup time check (benchmark.py startup)
+
 import tkinter as tk
-from tkinter import messagebox, filedialog
+from tkinter import messagebox, filedialog, ttk
 import json
-import subprocess
-import tempfile
 import os
-import re
 from datetime import datetime
 
+from device_session import DeviceSession, DeviceNotFound, Cancelled
+from device_worker import DeviceWorker
+from hotplug import PortWatcher
+import job_queue
+import datalogger
+import perf_log
+import sd_index
+from virtual_listbox import VirtualListbox
+
+# The window is drawn first, the job queue and the port scan start this long after the event loop
+STARTUP_DELAY_MS = 100
+
+# One connection to the device for the whole life of the GUI (DATALOGGER_PORT=/dev/ttyACM0 to force a port,
+# DATALOGGER_SD_BAUDRATE=8000000 to read the SD card with a faster SPI clock)
+session = DeviceSession(os.environ.get("DATALOGGER_PORT", "auto"),
+                        sd_baudrate=int(os.environ.get("DATALOGGER_SD_BAUDRATE", 0)) or None)
+# All the device operations run one after the other in this worker, never in the Tk thread
+worker = DeviceWorker("device")
+# The ingest of the downloaded files into the store only uses the disk, it runs beside the device operations
+ingest_worker = DeviceWorker("ingest")
+# Downloads, time settings and config uploads go through this queue on disk: they are retried when the
+# connection drops, and continue after a restart of the application. Opened once the window is shown.
+jobs = None
+job_running = False
+
 def update_computer_time():
     """Update the computer time display"""
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -14,83 +39,194 @@ def update_computer_time():
     # Schedule next update in 1000ms (1 second)
     root.after(1000, update_computer_time)
 
-def soft_reset_device():
-    result = subprocess.run('mpremote soft-reset', capture_output=True, text=True, timeout=10, shell=True)
-    if "no device found" in result.stdout:
-        print("No device found")
-        root.after(1000, soft_reset_device)
-    else:
+def poll_worker():
+    """Deliver the results of the device operations and show what is running"""
+    try:
+        watcher.poll()
+        worker.poll()
+        ingest_worker.poll()
+        if worker.busy:
+            current = worker.current.label if worker.current else "Waiting"
+            queued = f" (+{worker.queued} queued)" if worker.queued else ""
+            busy_label.config(text=f"⏳ {current}...{queued}", fg="darkorange")
+            cancel_btn.config(state="normal")
+        else:
+            busy_label.config(text="Ready", fg="gray")
+            cancel_btn.config(state="disabled")
+    finally:
+        # an error in one callback must not stop the delivery of all the next results
+        root.after(50, poll_worker)
+
+def update_perf_stats():
+    """Rolling throughput and latency of every device, with the phases of its last operation"""
+    lines = []
+    for stats in perf_log.all_stats():
+        lines.append(perf_log.format_stats(stats))
+        last = perf_log.last_operation(stats.device)
+        if last is not None:
+            lines.append("    last " + perf_log.format_operation(last))
+    perf_label.config(text="\n".join(lines) or "No device operation yet")
+    root.after(1000, update_perf_stats)
+
+def cancel_device_operations():
+    """Cancel the running device operation and the queued ones"""
+    worker.cancel()
+
+def soft_reset_device(attempts=5):
+    """Soft reset the device that was just plugged, it can take a moment before it answers"""
+    def reset_failed(e):
+        print(f"Device not ready ({e})")
+        if attempts > 1 and device_present():
+            root.after(1000, lambda: soft_reset_device(attempts - 1))
+    def reset_done(result):
         print("Device soft reset ready to work")
+        # list the SD card meanwhile, it is there when the user looks for a file
+        if not sd_entries:
+            get_sd_files()
+    worker.submit("Waiting for device", session.soft_reset, on_done=reset_done, on_error=reset_failed)
+
+def start_background_tasks():
+    """What can wait until the window is shown: the job queue on disk and the first scan of the ports"""
+    global jobs
+    jobs = job_queue.JobQueue()
+    clear_jobs_btn.config(state="normal")
+    watcher.start()
+    poll_jobs()
+    if os.environ.get("DATALOGGER_EXIT_WHEN_SHOWN"):
+        # startup time check of benchmark.py
+        print(f"window shown after {time.perf_counter() - STARTED:.3f} s")
+        root.after(0, root.destroy)
+
+def device_present():
+    """Whether the device of the session is plugged, from the port watcher (nothing is sent to it)"""
+    return watcher.connected(None if session.port == "auto" else session.port)
+
+def device_plugged(info):
+    if not session.connected and session.port in ("auto", info.device):
+        soft_reset_device()
+    # the jobs waiting for a retry do not wait for the end of their delay
+    jobs.wake()
+    device_changed()
+
+def device_unplugged(port):
+    if port in (session.device, session.port):
+        # close it in the worker, an operation may still be using it
+        worker.submit("Disconnecting", session.close)
+    device_changed()
+
+def device_changed():
+    """Follow the plugged devices in the buttons and in the fleet window"""
+    present = device_present()
+    state = "normal" if present else "disabled"
+    for button in (get_time_btn, set_time_btn, get_files_btn, sync_btn, save_device_btn, tail_btn, inspect_btn):
+        button.config(state=state)
+    download_btn.config(state=state if sd_files_listbox.items else "disabled")
+    if present:
+        ports = ", ".join(sorted(watcher.ports))
+        device_label.config(text=f"🔌 {ports}", fg="darkgreen")
+    else:
+        device_label.config(text="No device connected", fg="red")
+    if fleet is not None:
+        refresh_fleet()
 
 def get_device_time():
     """Get and display the time from the device"""
-    result = subprocess.run('mpremote run read_rtc_time.py', 
-                          capture_output=True, text=True, timeout=10, shell=True)
-    
-    if "no device found" in result.stdout:
+    device_time_output.config(text="Device Time:\nReading...")
+    worker.submit("Reading device time", datalogger.get_time, session,
+                  on_done=show_device_time, on_error=show_device_time_error)
+
+def show_device_time(device_time):
+    # Format as HH:MM:SS
+    device_time_output.config(text=f"Device Time:\n{device_time:%H:%M:%S}")
+
+def show_device_time_error(e):
+    if isinstance(e, DeviceNotFound):
         device_time_output.config(text="Device Time:\nNo device found")
-    elif result.returncode == 0:
-        # Extract numbers from the output string
-        numbers = re.findall(r'\d+', result.stdout.strip())
-        
-        if len(numbers) >= 3:
-            # Last number = seconds, second to last = minutes, third to last = hours
-            seconds = int(numbers[-1])
-            minutes = int(numbers[-2])
-            hours = int(numbers[-3])
-            
-            # Format as HH:MM:SS
-            formatted_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-            device_time_output.config(text=f"Device Time:\n{formatted_time}")
-        else:
-            # If we can't extract 3 numbers, show raw output
-            device_time_output.config(text=f"Device Time:\n{result.stdout.strip()}")
     else:
-        device_time_output.config(text=f"Device Time:\n{result.stdout.strip()}")
+        device_time_output.config(text=f"Device Time:\n{e}")
 
 def get_sd_files():
     """Get list of files on the device SD card"""
-    result = subprocess.run('mpremote connect auto run read_sd.py fs ls sd/', 
-                          capture_output=True, text=True, timeout=15, shell=True)
-    
-    if "no device found" in result.stdout:
-        sd_files_listbox.delete(0, tk.END)
-        sd_files_listbox.insert(0, "No device found")
-        download_btn.config(state="disabled")
-    elif result.returncode == 0:
-        # Parse the file list from stdout
-        files = []
-        lines = result.stdout.strip().split('\n')
-        for line in lines:
-            line = line.strip()
-            #line = line.split()
-            #filesize = line[0]
-            #line = line[1]
-            if line and not line.startswith('ls :') and line != ':sd/':
-                # Remove directory prefix if present
-                if line.startswith('sd/'):
-                    line = line[3:]
-                files.append(line)
-        
-        # Clear and populate the listbox
-        sd_files_listbox.delete(0, tk.END)
-        if files:
-            for file in files:
-                sd_files_listbox.insert(tk.END, file)
-            download_btn.config(state="normal")
-        else:
-            sd_files_listbox.insert(0, "No files found on SD card")
-            download_btn.config(state="disabled")
+    worker.submit("Listing SD card", datalogger.list_files, session, on_done=show_sd_files, on_error=show_sd_files_error)
+
+# Files of the last SD card listing, and the measured download speed (bytes/s) for the time estimates
+sd_entries = []
+transfer_rate = 50000
+
+def format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def format_sd_entry(entry):
+    return f"{entry.name}   {format_size(entry.size)}   {datetime.fromtimestamp(entry.mtime):%Y-%m-%d %H:%M}"
+
+def show_sd_files(entries):
+    global sd_entries
+    sd_entries = entries
+    if entries:
+        apply_sd_view()
     else:
-        sd_files_listbox.delete(0, tk.END)
-        sd_files_listbox.insert(0, "Error reading SD card")
+        sd_files_listbox.set_message("No files found on SD card")
         download_btn.config(state="disabled")
+        sd_summary.config(text="")
+
+def apply_sd_view(event=None):
+    """Sort and filter the SD card listing with the controls above the list"""
+    if not sd_entries:
+        return
+    since = None
+    if since_entry.get().strip():
+        try:
+            since = datetime.strptime(since_entry.get().strip(), "%Y-%m-%d").timestamp()
+        except ValueError:
+            pass
+    try:
+        min_size = float(min_size_entry.get() or 0) * 1024
+    except ValueError:
+        min_size = 0
+    view = sd_index.filter_entries(sd_entries, filter_entry.get().strip(), min_size, since)
+    view = sd_index.sort_entries(view, sort_var.get().lower(), reverse_var.get())
+    sd_files_listbox.set_items(view, keep_selection=True)
+    download_btn.config(state="normal" if view else "disabled")
+    update_sd_summary()
+
+def update_sd_summary():
+    """Total size of the listing and of the selection, with the time to download it"""
+    shown = sd_files_listbox.items
+    selected = sd_files_listbox.selected_items()
+    text = f"{len(shown)}/{len(sd_entries)} files, {format_size(sd_index.total_bytes(shown))}"
+    if selected:
+        selected_bytes = sd_index.total_bytes(selected)
+        text += (f"\nselected {len(selected)}: {format_size(selected_bytes)}, "
+                 f"≈ {selected_bytes / transfer_rate:.0f} s to download")
+    sd_summary.config(text=text)
+
+def show_sd_files_error(e):
+    if isinstance(e, DeviceNotFound):
+        sd_files_listbox.set_message("No device found")
+    else:
+        print(e)
+        sd_files_listbox.set_message("Error reading SD card")
+    download_btn.config(state="disabled")
+    sd_summary.config(text="")
+
+def show_download_progress(filename, file_bytes, file_size, total_bytes, total_size):
+    """Show the progress of the current download below the file list"""
+    download_progress.config(text=f"{filename}: {file_bytes}/{file_size} bytes\n"
+                                  f"Total: {total_bytes}/{total_size} bytes")
+
+def report_download_progress(*args):
+    """Progress callback of the transfers, called in the worker thread"""
+    worker.report(show_download_progress, *args)
 
 def download_selected_files():
     """Download selected files from device SD card"""
-    selected_indices = sd_files_listbox.curselection()
+    selected = sd_files_listbox.selected_items()
     
-    if not selected_indices:
+    if not selected:
         messagebox.showwarning("No Selection", "Please select one or more files to download.")
         return
     
@@ -99,68 +235,466 @@ def download_selected_files():
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
     
-    downloaded_files = []
-    failed_files = []
-    
-    for index in selected_indices:
-        filename = sd_files_listbox.get(index)
-        
-        # Skip error messages
-        if filename in ["No device found", "No files found on SD card", "Error reading SD card"]:
-            continue
-        print(filename)
-        filename = filename.split()[1] # get only the filename and not the size
-        try:
-            # Download file using mpremote
-            result = subprocess.run(f'mpremote run read_sd.py cp :sd/{filename} data/{filename}',capture_output=True, text=True,timeout=30, shell=True)
-            
-            print(result.stdout)
-
-            if result.returncode == 0:
-                downloaded_files.append(filename)
-            else:
-                failed_files.append(f"{filename}: {result.stdout.strip()}")
-                
-        except Exception as e:
-            print(e)
-            failed_files.append(f"{filename}: {str(e)}")
+    filenames = [entry.name for entry in selected]
+    # queued on disk: after a lost connection only the files (and the parts of files) not yet here are transferred
+    jobs.add("download", names=filenames, dest_dir=data_dir, compress=compress_var.get())
+    update_jobs()
+
+def show_download_result(downloaded_files, failed, transfer=""):
+    failed_files = [f"{filename}: {error}" for filename, error in failed]
+    download_progress.config(text="")
+    if transfer:
+        transfer = "\n\n" + transfer
     
     # Show results
     if downloaded_files and not failed_files:
         messagebox.showinfo("Download Complete", 
             f"Successfully downloaded {len(downloaded_files)} file(s) to 'data' directory:\n" + 
-            "\n".join(downloaded_files))
+            "\n".join(downloaded_files) + transfer)
     elif downloaded_files and failed_files:
         messagebox.showwarning("Partial Download", 
             f"Downloaded {len(downloaded_files)} file(s):\n" + "\n".join(downloaded_files) + 
-            f"\n\nFailed {len(failed_files)} file(s):\n" + "\n".join(failed_files))
+            f"\n\nFailed {len(failed_files)} file(s):\n" + "\n".join(failed_files) + transfer)
     elif failed_files:
         messagebox.showerror("Download Failed", 
             f"Failed to download {len(failed_files)} file(s):\n" + "\n".join(failed_files))
 
+def preview_entry():
+    """First selected file of the list, for the preview panel"""
+    selected = sd_files_listbox.selected_items()
+    if not selected:
+        messagebox.showwarning("No Selection", "Please select a file to preview.")
+        return None
+    return selected[0]
+
+def show_preview(text):
+    preview_text.config(state="normal")
+    preview_text.delete("1.0", tk.END)
+    preview_text.insert(tk.END, text)
+    preview_text.config(state="disabled")
+
+def preview_failed(e):
+    show_preview("No device found" if isinstance(e, DeviceNotFound) else f"Error: {e}")
+
+def tail_sd_file():
+    """Last rows of the selected file, read from its end on the device"""
+    entry = preview_entry()
+    if entry is None:
+        return
+    show_preview(f"Reading the end of {entry.name}...")
+    worker.submit(f"Reading the end of {entry.name}", datalogger.tail, session, entry.name, 20,
+                  on_done=lambda result: show_preview("\n".join(result.lines) or "(empty file)"),
+                  on_error=preview_failed)
+
+def inspect_sd_file():
+    """Rows, time span, min/max and gaps of the selected file, scanned on the device"""
+    entry = preview_entry()
+    if entry is None:
+        return
+    column = preview_column_entry.get().strip() or "1"
+    column = int(column) if column.isdigit() else column
+    show_preview(f"Scanning {entry.name} on the device...")
+    worker.submit(f"Inspecting {entry.name}", datalogger.inspect, session, entry.name, column, size=entry.size,
+                  on_done=lambda result: show_preview(datalogger.format_summary(result)),
+                  on_error=preview_failed)
+
+def sync_sd_card():
+    """Copy only what is new on the SD card into the data directory"""
+    worker.submit("Syncing SD card", datalogger.sync, session, "data", verify=verify_sync_var.get(),
+                  compress=compress_var.get(),
+                  progress=report_download_progress, cancellable=True,
+                  on_done=show_sync_result, on_error=show_sync_error)
+
+def show_sync_error(e):
+    download_progress.config(text="")
+    if isinstance(e, DeviceNotFound):
+        messagebox.showerror("Sync Failed", "No device found")
+    elif isinstance(e, Cancelled):
+        messagebox.showinfo("Sync Cancelled", "The sync was cancelled, run it again to continue where it stopped.")
+    else:
+        messagebox.showerror("Sync Failed", f"Error during the SD card sync:\n{e}")
+
+def show_sync_result(result):
+    download_progress.config(text="")
+    if result.new or result.updated:
+        ingest_data("data")
+    summary = (f"New files: {len(result.new)}\n"
+               f"Updated files: {len(result.updated)}\n"
+               f"Already up to date: {len(result.up_to_date)}\n"
+               f"Transferred: {result.bytes} bytes")
+    if result.link_bytes:
+        summary += "\n" + datalogger.format_transfer(result)
+    if result.failed:
+        messagebox.showwarning("Partial Sync", summary + f"\n\nFailed {len(result.failed)} file(s):\n" +
+            "\n".join(f"{filename}: {error}" for filename, error in result.failed))
+    else:
+        messagebox.showinfo("Sync Complete", summary)
+
+def ingest_data(data_dir):
+    """Add the new rows of the downloaded files to the store, if asked"""
+    if not ingest_var.get():
+        return
+    def ingested(result):
+        download_progress.config(text=f"Ingested {result.rows} rows of {len(result.files)} file(s) into {datalogger.STORE_DIR}")
+    def ingest_failed(e):
+        print(e)
+        download_progress.config(text=f"Ingest failed: {e}")
+    download_progress.config(text="Ingesting into the store...")
+    ingest_worker.submit("Ingesting", datalogger.ingest, data_dir, on_done=ingested, on_error=ingest_failed)
+
+def show_time_set(result):
+    text = f"Set Time Result:\nDevice time was set\nwas off by {result['offset_before']:+.2f} s"
+    if result["drift_ppm"] is not None:
+        text += f"\ndrift {result['drift_ppm']:+.1f} ppm"
+    set_time_output.config(text=text)
+
 def set_device_time():
     """Set the time on the device"""
-    # Run first command: mpremote rtc --set
-    result1 = subprocess.run('mpremote rtc --set', 
-                           capture_output=True, text=True, timeout=10, shell=True)
-    
-    if "no device found" in result1.stdout:
-        set_time_output.config(text="Set Time Result:\nNo device found")
+    set_time_output.config(text="Set Time Result:\nQueued...")
+    jobs.add("set_time")
+    update_jobs()
+
+def run_next_job():
+    """Start the next job of the queue whose time has come, one at a time and only with a device plugged"""
+    global job_running
+    if job_running or not device_present():
         return
-    elif result1.returncode != 0:
-        set_time_output.config(text=f"Set Time Result:\n{result1.stdout.strip()}")
+    job = jobs.next_due()
+    if job is None:
+        return
+    job_running = True
+    def failed(e):
+        # not a device error (those are retried by run_job): cancelled before it started, or a bug
+        if isinstance(e, Cancelled):
+            jobs.cancel(job.id)
+        else:
+            print(e)
+            jobs.fail(job.id, e, retry=False)
+        job_ended(job.id, jobs.get(job.id).state)
+    worker.submit(f"Job #{job.id}: {job_queue.what(job)}", job_queue.run_job, session, jobs, job,
+                  progress=report_download_progress if job.kind == "download" else None, cancellable=True,
+                  on_done=lambda state: job_ended(job.id, state), on_error=failed)
+
+def job_ended(job_id, state):
+    global job_running, transfer_rate
+    job_running = False
+    job = jobs.get(job_id)
+    download_progress.config(text="")
+    if state == "done":
+        if job.kind == "download":
+            # remember the real speed for the next estimates
+            if job.result["bytes"] > 100000 and job.result["seconds"]:
+                transfer_rate = job.result["bytes"] / job.result["seconds"]
+            show_download_result(job.result["downloaded"], job.result["failed"], job.result["transfer"])
+            update_sd_summary()
+            if job.result["downloaded"]:
+                ingest_data(job.args["dest_dir"])
+        elif job.kind == "set_time":
+            show_time_set(job.result)
+        else:
+            messagebox.showinfo("Success", "JSON file uploaded to device successfully!\n"
+                                "Saved as 'info.json' on the device.")
+    elif state == "failed":
+        messagebox.showerror("Job Failed", f"{job_queue.describe(job)}\n\n"
+                             "Use \"Retry Failed\" to run it again.")
+    elif state == "queued":
+        # lost connection: the job runs again by itself, say when
+        download_progress.config(text=job_queue.describe(job))
+    update_jobs()
+
+def update_jobs():
+    """Show the jobs not done yet, and start the next one when its time has come"""
+    pending = jobs.jobs(("queued", "running", "failed"))
+    lines = [job_queue.describe(job) for job in pending[:4]]
+    if len(pending) > 4:
+        lines.append(f"... {len(pending) - 4} more")
+    jobs_label.config(text="\n".join(lines) or "No job waiting")
+    retry_jobs_btn.config(state="normal" if any(job.state == "failed" for job in pending) else "disabled")
+    run_next_job()
+
+def poll_jobs():
+    update_jobs()
+    root.after(1000, poll_jobs)
+
+def retry_failed_jobs():
+    for job in jobs.jobs(("failed",)):
+        jobs.retry(job.id)
+    update_jobs()
+
+def clear_finished_jobs():
+    jobs.clear_finished()
+    update_jobs()
+
+# Fleet mode: all the connected loggers at once, one worker per port
+fleet = None
+fleet_window = None
+
+def open_fleet_window():
+    """Open the table of all connected devices"""
+    global fleet, fleet_window, fleet_table, deploy_dry_run_var
+    if fleet_window is not None and fleet_window.winfo_exists():
+        fleet_window.lift()
         return
+    # imported on first use, most sessions never open the fleet window
+    from fleet import Fleet
+    fleet = Fleet("data", sd_baudrate=session.sd_baudrate, on_status=show_fleet_status)
+    if session.connected:
+        # the main window already holds this port, share its session
+        fleet.adopt(session.device, session, worker)
+    
+    fleet_window = tk.Toplevel(root)
+    fleet_window.title("Fleet mode")
+    fleet_window.geometry("700x400")
+    fleet_window.protocol("WM_DELETE_WINDOW", close_fleet_window)
     
-    # Run second command: mpremote run set_rtc_time.py
-    result2 = subprocess.run('mpremote run set_rtc_time.py', 
-                           capture_output=True, text=True, timeout=10, shell=True)
+    fleet_table = ttk.Treeview(fleet_window, columns=("port", "serial", "name", "status"), show="headings",
+                               selectmode="extended")
+    for column, title, width in (("port", "Port", 110), ("serial", "Serial number", 140),
+                                 ("name", "Device name", 120), ("status", "Status", 300)):
+        fleet_table.heading(column, text=title)
+        fleet_table.column(column, width=width, anchor="w")
+    fleet_table.grid(row=0, column=0, columnspan=5, sticky="nsew", padx=10, pady=10)
     
-    if "no device found" in result2.stdout:
-        set_time_output.config(text="Set Time Result:\nNo device found")
-    elif result2.returncode == 0:
-        set_time_output.config(text="Set Time Result:\nDevice time was set")
+    tk.Button(fleet_window, text="Refresh Devices", command=refresh_fleet,
+              bg="lightsteelblue", font=("Arial", 9, "bold")).grid(row=1, column=0, padx=5, pady=5, sticky="ew")
+    tk.Button(fleet_window, text="Set Time", command=lambda: fleet.set_time_all(selected_fleet_devices()),
+              bg="lightcoral", font=("Arial", 9, "bold")).grid(row=1, column=1, padx=5, pady=5, sticky="ew")
+    tk.Button(fleet_window, text="Upload Config", command=upload_fleet_config,
+              bg="lightgreen", font=("Arial", 9, "bold")).grid(row=1, column=2, padx=5, pady=5, sticky="ew")
+    tk.Button(fleet_window, text="Sync SD Cards", command=sync_fleet,
+              bg="palegreen", font=("Arial", 9, "bold")).grid(row=1, column=3, padx=5, pady=5, sticky="ew")
+    tk.Button(fleet_window, text="Cancel All", command=lambda: fleet.cancel_all(),
+              font=("Arial", 9)).grid(row=1, column=4, padx=5, pady=5, sticky="ew")
+    deploy_frame = tk.Frame(fleet_window)
+    deploy_frame.grid(row=2, column=0, columnspan=5, padx=5, pady=5, sticky="ew")
+    tk.Button(deploy_frame, text="Deploy Config Table...", command=deploy_fleet_table,
+              bg="lightyellow", font=("Arial", 9, "bold")).pack(side="left")
+    deploy_dry_run_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(deploy_frame, text="dry run (only show what would change)", variable=deploy_dry_run_var,
+                   font=("Arial", 8)).pack(side="left", padx=5)
+    tk.Label(fleet_window, text="Operations run on the selected devices (all of them if none is selected), "
+             "in parallel.\nUploaded configs keep the device name already on each logger. "
+             "SD cards sync into data/<unique id of the board>.\nA config table (CSV or JSON) has one row per logger, "
+             "by port or serial number; only the loggers whose info.json differs are written.",
+             font=("Arial", 8), fg="gray").grid(row=3, column=0, columnspan=5)
+    fleet_window.grid_rowconfigure(0, weight=1)
+    for column in range(5):
+        fleet_window.grid_columnconfigure(column, weight=1)
+    
+    refresh_fleet()
+    poll_fleet()
+
+def close_fleet_window():
+    global fleet
+    # the jobs of the adopted session run on the main worker, which goes on: their results must not reach the table
+    fleet.on_status = None
+    fleet.close()
+    fleet = None
+    fleet_window.destroy()
+
+def poll_fleet():
+    """Deliver the results of the fleet workers while the window is open"""
+    if fleet is None:
+        return
+    fleet.poll()
+    fleet_window.after(50, poll_fleet)
+
+def refresh_fleet():
+    fleet.refresh()
+    for device in fleet.devices.values():
+        show_fleet_status(device)
+
+def show_fleet_status(device):
+    if fleet_window is None or not fleet_window.winfo_exists():
+        return
+    values = (device.port, device.serial_number, device.name, device.status)
+    if fleet_table.exists(device.port):
+        fleet_table.item(device.port, values=values)
     else:
-        set_time_output.config(text=f"Set Time Result:\n{result2.stdout.strip()}")
+        fleet_table.insert("", tk.END, iid=device.port, values=values)
+
+def selected_fleet_devices():
+    selection = fleet_table.selection()
+    if not selection:
+        return fleet.present_devices()
+    return [fleet.devices[port] for port in selection if fleet.devices[port].present]
+
+def upload_fleet_config():
+    data = collect_sensor_data()
+    if data is None:
+        return
+    fleet.push_config_all(data, selected_fleet_devices())
+
+def deploy_fleet_table():
+    """Upload the info.json of every connected logger from its row of a CSV or JSON table"""
+    filename = filedialog.askopenfilename(parent=fleet_window, title="Select the configuration table",
+                                          filetypes=[("Config tables", "*.csv *.json"), ("All files", "*.*")])
+    if not filename:
+        return
+    import deploy
+    try:
+        rows = deploy.load_plan(filename)
+    except (OSError, ValueError) as e:
+        messagebox.showerror("Deploy Error", f"Could not read the table:\n{e}", parent=fleet_window)
+        return
+    # the status column shows the outcome of each device, the details go to the console
+    missing = fleet.deploy_all(rows, dry_run=deploy_dry_run_var.get(),
+                               on_result=lambda result: print(deploy.format_result(result)))
+    if missing:
+        messagebox.showwarning("Deploy", f"No connected device for {len(missing)} row(s) of the table:\n" +
+                               "\n".join(deploy.target(row) for row in missing), parent=fleet_window)
+
+def sync_fleet():
+    def progress(device, filename, file_bytes, file_size, total_bytes, total_size):
+        percent = 100 * total_bytes // total_size if total_size else 100
+        device.worker.report(show_fleet_progress, device, f"Syncing SD card... {percent}% ({filename})")
+    fleet.sync_all(selected_fleet_devices(), progress=progress, compress=compress_var.get())
+
+def show_fleet_progress(device, status):
+    # a late progress message must not hide the final status
+    if device.status.startswith("Syncing"):
+        device.status = status
+        show_fleet_status(device)
+
+# Live monitor: redrawn at most every LIVE_REDRAW_MS and only when new readings came, so the CPU stays
+# low whatever the rate of the logger; the SD card file is asked for its new rows every LIVE_SD_POLL_MS
+LIVE_REDRAW_MS = 500
+LIVE_SD_POLL_MS = 2000
+live_window = None
+live_source = None
+
+def open_live_window():
+    """Open the live view of the readings of the logger"""
+    global live_window, live_buffer, live_canvas, live_line, live_scale, live_source_var, live_column_box, live_label, live_drawn
+    if live_window is not None and live_window.winfo_exists():
+        live_window.lift()
+        return
+    # imported on first use, like the fleet mode
+    from live_monitor import LiveBuffer
+    live_buffer = LiveBuffer()
+    live_drawn = None
+    live_window = tk.Toplevel(root)
+    live_window.title("Live monitor")
+    live_window.geometry("700x400")
+    live_window.protocol("WM_DELETE_WINDOW", close_live_window)
+
+    controls = tk.Frame(live_window)
+    controls.pack(side="top", fill="x", padx=10, pady=5)
+    live_source_var = tk.StringVar(value="sd")
+    tk.Radiobutton(controls, text="SD card file", variable=live_source_var, value="sd").pack(side="left")
+    tk.Radiobutton(controls, text="Serial output", variable=live_source_var, value="serial").pack(side="left")
+    tk.Button(controls, text="Start", command=start_live, bg="palegreen",
+              font=("Arial", 9, "bold")).pack(side="left", padx=5)
+    tk.Button(controls, text="Stop", command=stop_live, font=("Arial", 9)).pack(side="left")
+    live_column_box = ttk.Combobox(controls, state="readonly", width=16)
+    live_column_box.pack(side="right")
+    live_column_box.bind("<<ComboboxSelected>>", lambda event: draw_live(force=True))
+    tk.Label(controls, text="Column:", font=("Arial", 9)).pack(side="right")
+
+    live_label = tk.Label(live_window, text="Not started", font=("Courier", 9), anchor="w")
+    live_label.pack(side="top", fill="x", padx=10)
+    live_canvas = tk.Canvas(live_window, bg="white", highlightthickness=0)
+    live_canvas.pack(side="top", fill="both", expand=True, padx=10, pady=5)
+    # one line item moved with coords(), nothing is created at each redraw
+    live_line = live_canvas.create_line(0, 0, 0, 0, fill="blue", width=2)
+    live_scale = live_canvas.create_text(5, 5, anchor="nw", font=("Arial", 8), fill="gray")
+    tk.Label(live_window, text="SD card file: the new rows of the file being written (the logging must run from a "
+             "timer).\nSerial output: what the logger prints; the device buttons cannot use the port meanwhile.",
+             font=("Arial", 8), fg="gray").pack(side="bottom")
+    update_live()
+
+def close_live_window():
+    global live_window
+    stop_live()
+    live_window.destroy()
+    live_window = None
+
+def start_live():
+    global live_source
+    from live_monitor import SerialReader, SDFollower
+    stop_live()
+    live_buffer.clear()
+    live_buffer.error = None
+    if live_source_var.get() == "serial":
+        port = session.device or (session.port if session.port != "auto" else None) or next(iter(sorted(watcher.ports)), None)
+        if port is None:
+            messagebox.showerror("Live Monitor", "No device connected", parent=live_window)
+            return
+        # the logger program stopped when the session entered the REPL: restart it once the port is free
+        restart = session.connected
+        live_source = SerialReader(port, live_buffer, restart=restart)
+        reader = live_source
+        worker.submit("Releasing the port", session.close, on_done=lambda result: reader is live_source and reader.start())
+        live_label.config(text=f"Listening to {port}...")
+    else:
+        live_source = SDFollower(live_buffer)
+        live_label.config(text="Looking for the file being written...")
+        poll_live_sd(live_source)
+
+def stop_live():
+    global live_source
+    # the serial reader is a thread to stop, the SD card follower is just not polled anymore
+    if hasattr(live_source, "stop"):
+        live_source.stop()
+    live_source = None
+
+def poll_live_sd(follower):
+    """Ask the device for the new rows, the next request only once this one is done"""
+    if follower is not live_source:
+        return
+    def failed(e):
+        live_buffer.error = str(e)
+        root.after(LIVE_SD_POLL_MS, poll_live_sd, follower)
+    worker.submit("Reading the new rows", follower.poll, session,
+                  on_done=lambda count: root.after(LIVE_SD_POLL_MS, poll_live_sd, follower), on_error=failed)
+
+def draw_live(force=False):
+    global live_drawn
+    if live_window is None or (live_buffer.version == live_drawn and not force):
+        return
+    live_drawn = live_buffer.version
+    records = live_buffer.snapshot()
+    parser = live_source.parser if live_source is not None else None
+    width = max(live_canvas.winfo_width(), 2)
+    height = max(live_canvas.winfo_height(), 2)
+    count = max((len(record.values) for record in records), default=0)
+    if count and parser is not None:
+        names = [parser.column_name(i) for i in range(count)]
+        if list(live_column_box["values"]) != names:
+            live_column_box.config(values=names)
+            if live_column_box.current() < 0 or live_column_box.current() >= count:
+                live_column_box.current(0)
+    index = max(live_column_box.current(), 0)
+    points = [(record.time, record.values[index]) for record in records if index < len(record.values)]
+    low = min((value for t, value in points), default=0)
+    high = max((value for t, value in points), default=0)
+    if live_buffer.error:
+        live_label.config(text=f"❌ {live_buffer.error}", fg="red")
+    elif points:
+        stamp = datetime.fromtimestamp(points[-1][0]).strftime("%H:%M:%S")
+        live_label.config(text=f"{stamp}  {live_column_box.get()} = {points[-1][1]:g}   "
+                          f"(min {low:g}, max {high:g}, {len(points)} readings)", fg="black")
+    if len(points) < 2:
+        live_canvas.coords(live_line, 0, 0, 0, 0)
+        return
+    # at most one point per pixel: the drawing costs the same with 2000 readings or 200
+    step = max(1, len(points) // width)
+    points = points[::step]
+    first, last = points[0][0], points[-1][0]
+    span = (last - first) or 1
+    spread = (high - low) or 1
+    coords = []
+    for t, value in points:
+        coords.append((t - first) / span * (width - 10) + 5)
+        coords.append(height - 5 - (value - low) / spread * (height - 25))
+    live_canvas.coords(live_line, *coords)
+    live_canvas.itemconfig(live_scale, text=f"{low:g} .. {high:g} over {last - first:.0f} s")
+
+def update_live():
+    if live_window is None:
+        return
+    draw_live()
+    live_window.after(LIVE_REDRAW_MS, update_live)
 
 def import_json_file():
     """Import JSON file to prefill input fields"""
@@ -261,27 +795,14 @@ def collect_sensor_data():
     
     # Process data and replace empty values with 9999
     try:
-        data = {
-            "latitude": float(lat_value) if lat_value else 9999,
-            "longitude": float(lon_value) if lon_value else 9999,
-            "named_location": location_value if location_value else "9999",
-            "device_name": name_value if name_value else "9999",
-            "description": desc_value if desc_value else "9999",
-            "timestep": timestep_value if timestep_value else "9999",
-            "generated_at": datetime.now().isoformat()
-        }
-        return data
+        return datalogger.build_config(lat_value, lon_value, location_value, name_value, desc_value, timestep_value)
     except ValueError:
         messagebox.showerror("Error", "Please enter valid numbers for latitude and longitude!")
         return None
 
 def check_device_connection():
-    """Check if a device is connected using mpremote"""
-    result = subprocess.run('mpremote exec "print(\"connected\")"', 
-                          capture_output=True, text=True, timeout=5, shell=True)
-    if "no device found" in result.stdout:
-        return False
-    return result.returncode == 0 and "connected" in result.stdout
+    """Check if a device is connected"""
+    return device_present()
 
 def generate_and_save_to_computer():
     """Generate JSON and save to computer"""
@@ -307,7 +828,7 @@ def generate_and_save_to_computer():
         messagebox.showerror("Error", f"An error occurred: {str(e)}")
 
 def generate_and_save_to_device():
-    """Generate JSON and save to device using mpremote"""
+    """Generate JSON and save to device"""
     try:
         # Check if device is connected
         #if not check_device_connection():
@@ -321,39 +842,17 @@ def generate_and_save_to_device():
             messagebox.showerror("Error", "⚠️ No No imputs!\n\n","Please fill in minimum information")
             return
         
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_file:
-            json.dump(data, temp_file, indent=2)
-            temp_filename = temp_file.name
-        
-        try:
-            # Copy file to device using mpremote
-            result = subprocess.run(f'mpremote cp "{temp_filename}" :info.json', 
-                                  capture_output=True, text=True, timeout=10, shell=True)
-            
-            if result.returncode == 0:
-                messagebox.showinfo("Success", 
-                    "JSON file uploaded to device successfully!\n"
-                    "Saved as 'info.json' on the device.")
-            elif "no device found" in result2.stdout:
-                messagebox.showerror("Error", "⚠️ No device found")
-            else:
-                messagebox.showerror("Upload Error", 
-                    f"Failed to upload to device:\n{result.stderr}")
-        
-        finally:
-            # Clean up temporary file
-            os.unlink(temp_filename)
+        # Write the file straight to the device flash, retried until the device takes it
+        jobs.add("push_config", config=data)
+        update_jobs()
             
-    except subprocess.TimeoutExpired:
-        messagebox.showerror("Error", "Device communication timeout!")
     except Exception as e:
         messagebox.showerror("Error", f"An error occurred: {str(e)}")
 
 # Create main window
 root = tk.Tk()
 root.title("Datalogger management tool")
-root.geometry("750x600")
+root.geometry("1100x900")
 
 # Create import button at the top left
 import_btn = tk.Button(root, text="Import JSON File", command=import_json_file,
@@ -400,7 +899,14 @@ save_device_btn.grid(row=8, column=0, columnspan=2, pady=5)
 tk.Label(root, text="Example: Latitude: 40.7128, Longitude: -74.0060", 
          font=("Arial", 8), fg="gray").grid(row=9, column=0, columnspan=2, pady=5)
 
-tk.Label(root, text="Note: Device upload requires mpremote tool and connected device", 
+fleet_btn = tk.Button(root, text="Fleet Mode (all connected devices)", command=open_fleet_window,
+                      bg="khaki", font=("Arial", 10, "bold"))
+fleet_btn.grid(row=11, column=0, pady=10)
+live_btn = tk.Button(root, text="Live Monitor", command=open_live_window,
+                     bg="lightcyan", font=("Arial", 10, "bold"))
+live_btn.grid(row=11, column=1, pady=10)
+
+tk.Label(root, text="Note: Device upload requires pyserial and a connected device", 
          font=("Arial", 8), fg="orange").grid(row=10, column=0, columnspan=2, pady=2)
 
 # Add vertical separator
@@ -441,31 +947,128 @@ get_files_btn = tk.Button(root, text="Get SD Card Files", command=get_sd_files,
                          bg="lightsteelblue", font=("Arial", 9, "bold"))
 get_files_btn.grid(row=6, column=3, padx=10, pady=5, sticky="ew")
 
-# Listbox for file selection
-sd_files_listbox = tk.Listbox(root, height=6, selectmode=tk.MULTIPLE, font=("Arial", 8))
-sd_files_listbox.grid(row=7, column=3, padx=10, pady=5, sticky="ew")
-sd_files_listbox.insert(0, "Click 'Get SD Card Files' to load")
+# Sorting and filtering of the file list
+sd_frame = tk.Frame(root)
+sd_frame.grid(row=7, column=3, padx=10, pady=5, sticky="ew")
+
+tk.Label(sd_frame, text="Filter:", font=("Arial", 8)).grid(row=0, column=0, sticky="w")
+filter_entry = tk.Entry(sd_frame, width=12, font=("Arial", 8))
+filter_entry.grid(row=0, column=1, sticky="ew")
+filter_entry.bind("<KeyRelease>", apply_sd_view)
+tk.Label(sd_frame, text="Sort:", font=("Arial", 8)).grid(row=0, column=2, sticky="w")
+sort_var = tk.StringVar(value="Name")
+sort_box = ttk.Combobox(sd_frame, textvariable=sort_var, values=("Name", "Date", "Size"), width=6,
+                        state="readonly", font=("Arial", 8))
+sort_box.grid(row=0, column=3, sticky="w")
+sort_box.bind("<<ComboboxSelected>>", apply_sd_view)
+reverse_var = tk.BooleanVar(value=False)
+tk.Checkbutton(sd_frame, text="desc", variable=reverse_var, command=apply_sd_view,
+               font=("Arial", 8)).grid(row=0, column=4, sticky="w")
+
+tk.Label(sd_frame, text="Min KB:", font=("Arial", 8)).grid(row=1, column=0, sticky="w")
+min_size_entry = tk.Entry(sd_frame, width=12, font=("Arial", 8))
+min_size_entry.grid(row=1, column=1, sticky="ew")
+min_size_entry.bind("<KeyRelease>", apply_sd_view)
+tk.Label(sd_frame, text="Since:", font=("Arial", 8)).grid(row=1, column=2, sticky="w")
+since_entry = tk.Entry(sd_frame, width=10, font=("Arial", 8))
+since_entry.grid(row=1, column=3, columnspan=2, sticky="ew")
+since_entry.bind("<KeyRelease>", apply_sd_view)
 
-# Scrollbar for the listbox
-scrollbar = tk.Scrollbar(root, orient="vertical")
-scrollbar.grid(row=7, column=4, sticky="ns", pady=5)
-sd_files_listbox.config(yscrollcommand=scrollbar.set)
-scrollbar.config(command=sd_files_listbox.yview)
+# List of the files for selection, only the visible rows are real listbox rows
+sd_files_listbox = VirtualListbox(sd_frame, height=6, format_item=format_sd_entry, on_select=update_sd_summary,
+                                  font=("Arial", 8))
+sd_files_listbox.grid(row=2, column=0, columnspan=5, pady=(5, 0), sticky="ew")
+sd_files_listbox.set_message("Click 'Get SD Card Files' to load")
+tk.Button(sd_frame, text="Select all", command=sd_files_listbox.select_all,
+          font=("Arial", 8)).grid(row=3, column=0, columnspan=2, sticky="ew")
+tk.Button(sd_frame, text="Clear selection", command=sd_files_listbox.clear_selection,
+          font=("Arial", 8)).grid(row=3, column=2, columnspan=3, sticky="ew")
+sd_summary = tk.Label(sd_frame, text="", font=("Arial", 8), fg="gray", justify="left")
+sd_summary.grid(row=4, column=0, columnspan=5, sticky="w")
+sd_frame.grid_columnconfigure(1, weight=1)
+
+# Quick look at the selected file, the scan runs on the device and only its result comes back
+preview_frame = tk.LabelFrame(root, text="Preview (on the device)", font=("Arial", 8))
+preview_frame.grid(row=5, column=4, rowspan=7, padx=10, pady=5, sticky="nsew")
+preview_buttons = tk.Frame(preview_frame)
+preview_buttons.pack(fill="x")
+tail_btn = tk.Button(preview_buttons, text="Last rows", command=tail_sd_file, font=("Arial", 8))
+tail_btn.pack(side="left")
+inspect_btn = tk.Button(preview_buttons, text="Inspect", command=inspect_sd_file, font=("Arial", 8))
+inspect_btn.pack(side="left")
+tk.Label(preview_buttons, text="Column:", font=("Arial", 8)).pack(side="left", padx=(5, 0))
+preview_column_entry = tk.Entry(preview_buttons, width=10, font=("Arial", 8))
+preview_column_entry.insert(0, "1")
+preview_column_entry.pack(side="left")
+preview_text = tk.Text(preview_frame, width=45, height=20, font=("Courier", 8), wrap="none", state="disabled")
+preview_text.pack(fill="both", expand=True)
 
 download_btn = tk.Button(root, text="Download Selected Files", command=download_selected_files,
                         bg="lightsalmon", font=("Arial", 9, "bold"), state="disabled")
 download_btn.grid(row=8, column=3, padx=10, pady=5, sticky="ew")
 
+sync_frame = tk.Frame(root)
+sync_frame.grid(row=9, column=3, padx=10, pady=5, sticky="ew")
+sync_btn = tk.Button(sync_frame, text="Sync SD Card to 'data'", command=sync_sd_card,
+                     bg="palegreen", font=("Arial", 9, "bold"))
+sync_btn.pack(side="left", fill="x", expand=True)
+verify_sync_var = tk.BooleanVar(value=False)
+tk.Checkbutton(sync_frame, text="verify", variable=verify_sync_var, font=("Arial", 8)).pack(side="left")
+ingest_var = tk.BooleanVar(value=True)
+tk.Checkbutton(sync_frame, text="ingest", variable=ingest_var, font=("Arial", 8)).pack(side="left")
+# deflate on the device: 3 to 5 times less to transfer for text logs, the device falls back if it cannot
+compress_var = tk.BooleanVar(value=False)
+tk.Checkbutton(sync_frame, text="compress", variable=compress_var, font=("Arial", 8)).pack(side="left")
+
+download_progress = tk.Label(root, text="", font=("Arial", 8), justify="center")
+download_progress.grid(row=10, column=3, padx=10, sticky="ew")
+
+# Busy indicator of the device operations, with a cancel button
+status_frame = tk.Frame(root)
+status_frame.grid(row=11, column=3, padx=10, pady=5, sticky="ew")
+device_label = tk.Label(status_frame, text="No device connected", font=("Arial", 8), fg="red", anchor="w")
+device_label.pack(side="left", padx=(0, 10))
+busy_label = tk.Label(status_frame, text="Ready", font=("Arial", 8), fg="gray", anchor="w")
+busy_label.pack(side="left", fill="x", expand=True)
+cancel_btn = tk.Button(status_frame, text="Cancel", command=cancel_device_operations,
+                       font=("Arial", 8), state="disabled")
+cancel_btn.pack(side="right")
+
+# Performance of the device operations, the details are in data/perf_log.jsonl
+perf_frame = tk.LabelFrame(root, text="Performance", font=("Arial", 8))
+perf_frame.grid(row=12, column=0, columnspan=5, padx=10, pady=5, sticky="ew")
+perf_label = tk.Label(perf_frame, text="", font=("Courier", 8), fg="gray", justify="left", anchor="w")
+perf_label.pack(fill="x")
+
+# Jobs queued on disk (data/jobs.sqlite), retried after a lost connection and after a restart
+jobs_frame = tk.LabelFrame(root, text="Jobs", font=("Arial", 8))
+jobs_frame.grid(row=13, column=0, columnspan=5, padx=10, pady=5, sticky="ew")
+jobs_label = tk.Label(jobs_frame, text="", font=("Courier", 8), fg="gray", justify="left", anchor="w")
+jobs_label.pack(side="left", fill="x", expand=True)
+clear_jobs_btn = tk.Button(jobs_frame, text="Clear Finished", command=clear_finished_jobs, font=("Arial", 8),
+                           state="disabled")
+clear_jobs_btn.pack(side="right")
+retry_jobs_btn = tk.Button(jobs_frame, text="Retry Failed", command=retry_failed_jobs, font=("Arial", 8),
+                           state="disabled")
+retry_jobs_btn.pack(side="right", padx=5)
+
 # Configure column weights for proper resizing
 root.grid_columnconfigure(1, weight=1)
 root.grid_columnconfigure(3, weight=1)
-root.grid_columnconfigure(4, weight=0)  # Scrollbar column
+root.grid_columnconfigure(4, weight=1)
 
 # Start updating computer time
 update_computer_time()
 
-# Execute until a device is there to soft reset
-soft_reset_device()
+# Watch the serial ports: the device is soft reset when it is plugged and the buttons follow its presence.
+# The ports are listed by the watcher thread, started with the job queue once the window is on the screen.
+watcher = PortWatcher(device_plugged, device_unplugged, extra_ports=[session.port])
+device_changed()
+
+# Deliver the device operations results to the widgets
+poll_worker()
+update_perf_stats()
+root.after(STARTUP_DELAY_MS, start_background_tasks)
 
 # Start the GUI event loop
 root.mainloop()
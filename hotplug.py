@@ -0,0 +1,103 @@
+"""Watch the USB serial ports for plugged and unplugged devices
+
+A background thread looks at the list of serial ports (pyserial reads it from
+the system, no process is started and nothing is sent to the devices) once a
+second, or waits for udev events on Linux when pyudev is installed. The
+changes are queued and delivered by poll(), which the GUI calls from the Tk
+thread like DeviceWorker.poll().
+"""
+import os
+import queue
+import threading
+
+from serial.tools.list_ports_common import ListPortInfo
+
+from device_session import find_port_infos
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+
+class PortWatcher:
+    """Up to date list of the connected devices, calling on_added(info) / on_removed(port) on changes"""
+
+    def __init__(self, on_added=None, on_removed=None, interval=1.0, use_udev=True, extra_ports=()):
+        """extra_ports: ports given by name that are not USB devices (the simulator pty), watched by their path"""
+        self.on_added = on_added
+        self.on_removed = on_removed
+        self.extra_ports = [port for port in extra_ports if port and port != "auto"]
+        self.interval = interval
+        self.ports = {}  # port: pyserial ListPortInfo, as seen by the GUI thread
+        self._events = queue.Queue()
+        self._stop = threading.Event()
+        self._known = set()
+        self._monitor = None
+        if use_udev and pyudev is not None:
+            try:
+                self._monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+                self._monitor.filter_by("tty")
+            except Exception:
+                self._monitor = None
+        self._thread = threading.Thread(target=self._run, name="port-watcher", daemon=True)
+
+    def start(self):
+        """Start watching, the ports already there come as added events once the thread listed them"""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def connected(self, port=None):
+        """Whether that port (or any device with port=None) is plugged"""
+        return bool(self.ports) if port is None else port in self.ports
+
+    def _scan(self):
+        infos = {info.device: info for info in find_port_infos()}
+        for port in self.extra_ports:
+            if port not in infos and (not port.startswith("/") or os.path.exists(port)):
+                infos[port] = ListPortInfo(port, skip_link_detection=True)
+        for port in sorted(set(infos) - self._known):
+            self._events.put(("added", infos[port]))
+        for port in sorted(self._known - set(infos)):
+            self._events.put(("removed", port))
+        self._known = set(infos)
+
+    def _run(self):
+        # the first listing is done here too: it can take a while, the caller does not wait for it
+        try:
+            self._scan()
+        except Exception as e:
+            print(f"could not list the serial ports: {e}")
+        while not self._stop.is_set():
+            if self._monitor is not None:
+                # sleeps until something happens on a tty, the timeout only lets stop() end the thread
+                if self._monitor.poll(timeout=self.interval) is None:
+                    continue
+                self._stop.wait(0.2)  # let the other events of the same plug arrive
+            else:
+                self._stop.wait(self.interval)
+            try:
+                self._scan()
+            except Exception as e:
+                print(f"could not list the serial ports: {e}")
+
+    def poll(self):
+        """Apply the changes and call the callbacks, from the GUI thread. Returns True if something changed"""
+        changed = False
+        while True:
+            try:
+                kind, value = self._events.get_nowait()
+            except queue.Empty:
+                return changed
+            changed = True
+            if kind == "added":
+                self.ports[value.device] = value
+                if self.on_added:
+                    self.on_added(value)
+            else:
+                self.ports.pop(value, None)
+                if self.on_removed:
+                    self.on_removed(value)
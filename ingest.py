@@ -0,0 +1,487 @@
+"""Ingest of the downloaded logger files into a columnar store
+
+The CSV files of data/ are parsed in chunks, each row tagged with the
+latitude, longitude and named_location of the info.json of its device, and
+appended to data/store/<device>/<YYYY-MM-DD>/: one file of raw machine
+values per column (array typecodes, memory-mappable) and a meta.json with
+the column types, the number of rows and how far each source file has been
+read. Asking for a few days of data only opens the folders of those days:
+
+    import ingest
+    ingest.ingest_dir("data")
+    data = ingest.query("data/store", "logger_1", date(2025, 6, 1), date(2025, 7, 1))
+    print(data["time"], data["temperature"])
+
+Ingesting again only reads what was appended to the files since the last
+time, and a row is never stored twice: every partition remembers up to
+which byte of each source it holds the rows, so an ingest interrupted
+halfway can simply be run again.
+"""
+import collections
+import json
+import mmap
+import os
+import re
+from array import array
+from datetime import datetime, timezone
+
+STORE_DIR = os.path.join("data", "store")
+STATE_FILE = ".ingest.json"  # in the data directory, how far each file was read
+CHUNK_SIZE = 1 << 20
+# rows kept in memory before they are written to the partitions
+FLUSH_ROWS = 100000
+LOGGER_EXTENSIONS = (".csv", ".txt", ".dat", ".log")
+
+NAN = float("nan")
+TIME_RE = re.compile(r"(\d{4})[-/](\d{1,2})[-/](\d{1,2})(?:[ T_,;\t]+(\d{1,2}):(\d{1,2})(?::(\d{1,2}(?:\.\d*)?))?)?")
+
+IngestResult = collections.namedtuple("IngestResult", ["files", "rows", "skipped_lines", "partitions"])
+
+
+def parse_time(text):
+    """Seconds since 1970 of a "2025-06-01 12:00:00" like date, None if it is not one
+
+    The device clock has no time zone, the time is stored as if it were UTC
+    so that the dates of the partitions are the ones written in the files.
+    """
+    match = TIME_RE.match(text.strip())
+    if match is None:
+        return None
+    year, month, day, hour, minute, second = match.groups()
+    try:
+        seconds = float(second or 0)
+        stamp = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0),
+                         int(seconds), tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return stamp.timestamp() + seconds % 1
+
+
+def _empty(typecode):
+    return NAN if typecode == "d" else 0
+
+
+def _number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return NAN
+
+
+def _column_name(text, taken):
+    name = re.sub(r"\W+", "_", text.strip()).strip("_").lower() or "value"
+    base, n = name, 2
+    while name in taken:
+        name = f"{base}_{n}"
+        n += 1
+    return name
+
+
+def _safe_name(text):
+    return re.sub(r"[^\w.-]+", "_", str(text)).strip("._") or "unknown"
+
+
+class Partition:
+    """Rows of one device for one day: a file per column and a meta.json
+
+    The column files are only appended to. meta.json is replaced after the
+    columns are written, so rows written by an interrupted flush are cut off
+    the next time the partition is opened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = {"time": "d"}
+        self.rows = 0
+        self.sources = {}  # source key: byte offset up to which its rows are stored here
+        self.locations = []  # values of the "location" column index this list
+        self._load()
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.path, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.columns = meta["columns"]
+        self.rows = meta["rows"]
+        self.sources = meta.get("sources", {})
+        self.locations = meta.get("locations", [])
+        for name, typecode in self.columns.items():
+            path = self._column_path(name)
+            if os.path.getsize(path) > self.rows * array(typecode).itemsize:
+                with open(path, "r+b") as f:
+                    f.truncate(self.rows * array(typecode).itemsize)
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f"{name}.col")
+
+    def location_code(self, location):
+        if location not in self.locations:
+            self.locations.append(location)
+        return self.locations.index(location)
+
+    def write(self, batch, count, sources):
+        """Append count rows, batch being {column: array}, the columns it does not have get NaN
+
+        sources is the new {source key: offset} the stored rows now go up to.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        for name, column in batch.items():
+            if name not in self.columns:
+                # a column the earlier rows did not have
+                with open(self._column_path(name), "wb") as f:
+                    (array(column.typecode, [_empty(column.typecode)]) * self.rows).tofile(f)
+                self.columns[name] = column.typecode
+        for name, typecode in self.columns.items():
+            column = batch[name] if name in batch else array(typecode, [_empty(typecode)]) * count
+            with open(self._column_path(name), "ab") as f:
+                column.tofile(f)
+        self.rows += count
+        self.sources.update(sources)
+        meta = {"columns": self.columns, "rows": self.rows, "sources": self.sources, "locations": self.locations}
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+    def column(self, name):
+        """Values of a column, memory-mapped (an empty array for a partition without rows)"""
+        typecode = self.columns[name]
+        if self.rows == 0:
+            return array(typecode)
+        with open(self._column_path(name), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped).cast("B")[:self.rows * array(typecode).itemsize].cast(typecode)
+
+
+def load_device_config(data_dir):
+    """info.json saved next to the downloaded files, {} if there is none"""
+    try:
+        with open(os.path.join(data_dir, "info.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _tag(value):
+    """Float of a latitude/longitude of info.json, NaN for the 9999 of the empty fields"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return NAN
+    return NAN if value == 9999 else value
+
+
+def device_name(config, default):
+    name = str(config.get("device_name", "")).strip()
+    return name if name and name != "9999" else default
+
+
+class _Batch:
+    """Rows of one file for one partition, waiting to be written"""
+
+    def __init__(self, partition, key):
+        self.partition = partition
+        self.skip_before = partition.sources.get(key, 0)  # rows of the file already in the partition
+        self.time = array("d")
+        self.values = []
+        self.count = 0
+
+
+class _FileIngest:
+    """Reads one logger file from a byte offset and routes its rows to the day partitions"""
+
+    def __init__(self, store, source, key, tags, columns):
+        self.store = store
+        self.source = source
+        # name of the file and time of its first row: a new file of the same name is another source
+        self.key = key
+        self.tags = tags
+        self.columns = columns  # names of the value columns, from the header
+        self.rows = 0
+        self.pending = 0
+        self.skipped = 0
+        self.batches = {}
+        self.days = {}  # "2025-06-01": seconds at midnight, so that most rows need no date parsing
+
+    def time(self, fields):
+        """(seconds, day, index of the first value) of a row, seconds being None if it has no date"""
+        text = fields[0]
+        if len(text) == 19 and text[13] == ":" and text[16] == ":":
+            midnight = self.days.get(text[:10])
+            if midnight is None:
+                midnight = self.days[text[:10]] = parse_time(text[:10])
+            if midnight is not None:
+                try:
+                    return midnight + int(text[11:13]) * 3600 + int(text[14:16]) * 60 + int(text[17:19]), text[:10], 1
+                except ValueError:
+                    pass
+        stamp = parse_time(text)
+        values_from = 1
+        if stamp is not None and len(fields) > 1 and ":" not in text and ":" in fields[1]:
+            # date and time in two columns
+            combined = parse_time(f"{text} {fields[1]}")
+            if combined is not None:
+                stamp, values_from = combined, 2
+        if stamp is None:
+            return None, None, 0
+        return stamp, datetime.fromtimestamp(stamp, timezone.utc).strftime("%Y-%m-%d"), values_from
+
+    def row(self, fields, offset):
+        """One line split in fields, starting at byte offset of the file"""
+        stamp, day, values_from = self.time(fields)
+        if stamp is None:
+            if not self.columns and self.key is None:
+                self.header(fields)
+            else:
+                self.skipped += 1
+            return
+        if self.key is None:
+            self.key = f"{self.source}@{int(stamp)}"
+            if values_from == 2 and len(self.columns) == len(fields) - 1:
+                del self.columns[0]  # the header named the time column too
+        batch = self.batches.get(day)
+        if batch is None:
+            batch = self.batches[day] = _Batch(self.store.partition(self.tags["device"], day), self.key)
+        if offset < batch.skip_before:
+            return  # already stored by an earlier ingest
+        values = fields[values_from:]
+        while len(batch.values) < len(values):
+            batch.values.append(array("d", [NAN]) * batch.count)
+        for column, text in zip(batch.values, values):
+            try:
+                column.append(float(text))
+            except ValueError:
+                column.append(NAN)
+        for column in batch.values[len(values):]:
+            column.append(NAN)
+        batch.time.append(stamp)
+        batch.count += 1
+        self.rows += 1
+        self.pending += 1
+
+    def header(self, fields):
+        taken = {"time", "latitude", "longitude", "location"}
+        for text in fields[1:]:
+            name = _column_name(text, taken)
+            taken.add(name)
+            self.columns.append(name)
+
+    def flush(self, offset):
+        """Write the rows read so far, the file having been read up to offset"""
+        for day, batch in self.batches.items():
+            if not batch.count:
+                continue
+            n = batch.count
+            columns = {
+                "time": batch.time,
+                "latitude": array("d", [self.tags["latitude"]]) * n,
+                "longitude": array("d", [self.tags["longitude"]]) * n,
+                "location": array("H", [batch.partition.location_code(self.tags["named_location"])]) * n,
+            }
+            for i, values in enumerate(batch.values):
+                if i >= len(self.columns):
+                    self.columns.append(_column_name(f"c{i + 1}", set(self.columns) | set(columns)))
+                columns[self.columns[i]] = values
+            batch.partition.write(columns, n, {self.key: offset})
+            self.store.written.add((self.tags["device"], day))
+        self.batches = {}
+        self.pending = 0
+
+
+class Store:
+    """The columnar store, partitioned by device and day"""
+
+    def __init__(self, path=STORE_DIR):
+        self.path = path
+        self._partitions = {}
+        self.written = set()  # (device, day) of the partitions that got rows
+
+    def partition(self, device, day):
+        key = (device, day)
+        if key not in self._partitions:
+            self._partitions[key] = Partition(os.path.join(self.path, _safe_name(device), day))
+        return self._partitions[key]
+
+    def devices(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, name)))
+
+    def partitions(self, device, start=None, end=None):
+        """Partitions of a device for the days from start (included) to end (excluded), dates or datetimes"""
+        folder = os.path.join(self.path, _safe_name(device))
+        if not os.path.isdir(folder):
+            return []
+        first = start.strftime("%Y-%m-%d") if start else ""
+        last = end.strftime("%Y-%m-%d") if end else "9999"
+        days = sorted(day for day in os.listdir(folder) if first <= day <= last)
+        return [self.partition(device, day) for day in days]
+
+    def ingest_file(self, path, source, tags, offset=0, key=None, columns=None, chunk_size=CHUNK_SIZE):
+        """Append the rows of path from byte offset
+
+        key and columns are the ones returned by the previous ingest of the
+        file when continuing it. Only complete lines are read: the last one
+        of a file still being written is left for the next ingest. Returns
+        (end offset, key, columns, rows, skipped lines).
+        """
+        reader = _FileIngest(self, source, key, tags, list(columns or []))
+        separator = None
+        with open(path, "rb") as f:
+            f.seek(offset)
+            rest = b""
+            position = offset
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                lines = (rest + chunk).split(b"\n")
+                rest = lines.pop()
+                for line in lines:
+                    start = position
+                    position += len(line) + 1
+                    text = line.decode("utf-8", "replace").strip()
+                    if not text:
+                        continue
+                    if separator is None:
+                        # comma, semicolon, tab or else spaces
+                        separator = next((c for c in ",;\t" if c in text), "")
+                    reader.row([field.strip() for field in text.split(separator)] if separator else text.split(), start)
+                if reader.pending >= FLUSH_ROWS:
+                    reader.flush(position)
+            reader.flush(position)
+        return position, reader.key, reader.columns, reader.rows, reader.skipped
+
+
+def _walk(data_dir, store_dir):
+    # os.walk of the folders of one device: the store, the hidden folders and the folders of other devices
+    # (with their own info.json: data/<unique id> of the fleet sync) are left out
+    store = os.path.realpath(store_dir)
+    for folder, dirs, files in os.walk(data_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(".") and os.path.realpath(os.path.join(folder, d)) != store)
+        yield folder, dirs, files
+        dirs[:] = [d for d in dirs if not os.path.exists(os.path.join(folder, d, "info.json"))]
+
+
+def device_dirs(data_dir, store_dir=STORE_DIR):
+    """Subfolders of data_dir holding the files of another device (they have their own info.json)"""
+    found = []
+    for folder, dirs, files in _walk(data_dir, store_dir):
+        found += [os.path.join(folder, d) for d in dirs if os.path.exists(os.path.join(folder, d, "info.json"))]
+    return found
+
+
+def logger_files(data_dir, store_dir=STORE_DIR):
+    """Logger files of the device of data_dir (relative paths), leaving out the store, the hidden folders,
+    the folders of other devices and the .part"""
+    found = []
+    for folder, dirs, files in _walk(data_dir, store_dir):
+        for name in sorted(files):
+            if name.lower().endswith(LOGGER_EXTENSIONS):
+                found.append(os.path.relpath(os.path.join(folder, name), data_dir))
+    return found
+
+
+def ingest_dir(data_dir="data", store_dir=STORE_DIR, config=None, device=None, progress=None):
+    """Ingest the new rows of every logger file of a data directory
+
+    The tags come from config, or else from the info.json of data_dir; the
+    partitions are named after its device_name (device, or the name of the
+    folder, when it has none). A subfolder with its own info.json holds the
+    files of another device and is ingested with its own tags. progress(path,
+    done, total) is called after each file. Returns an IngestResult(files,
+    rows, skipped_lines, partitions).
+    """
+    config = load_device_config(data_dir) if config is None else config
+    tags = {
+        "device": device_name(config, device or os.path.basename(os.path.abspath(data_dir))),
+        "latitude": _tag(config.get("latitude")),
+        "longitude": _tag(config.get("longitude")),
+        "named_location": str(config.get("named_location", "")),
+    }
+    state_path = os.path.join(data_dir, STATE_FILE)
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    store = Store(store_dir)
+    names = logger_files(data_dir, store_dir)
+    ingested = []
+    rows = skipped = 0
+    for i, name in enumerate(names):
+        path = os.path.join(data_dir, name)
+        size = os.path.getsize(path)
+        previous = state.get(name, {})
+        if size == previous.get("offset"):
+            continue
+        if size < previous.get("offset", 0) or previous.get("device") != tags["device"]:
+            # replaced by another file: read it again from the start, the rows
+            # already stored are recognized by their offsets
+            previous = {}
+        end, key, columns, file_rows, file_skipped = store.ingest_file(
+            path, name, tags, previous.get("offset", 0), previous.get("key"), previous.get("columns"))
+        state[name] = {"offset": end, "key": key, "columns": columns, "device": tags["device"]}
+        with open(state_path + ".tmp", "w") as f:
+            json.dump(state, f, indent=1)
+        os.replace(state_path + ".tmp", state_path)
+        if end > previous.get("offset", 0):
+            ingested.append(name)
+        rows += file_rows
+        skipped += file_skipped
+        if progress:
+            progress(name, i + 1, len(names))
+    partitions = {day for _, day in store.written}
+    for folder in device_dirs(data_dir, store_dir):
+        prefix = os.path.relpath(folder, data_dir)
+        report = None
+        if progress:
+            def report(name, done, total, prefix=prefix):
+                progress(os.path.join(prefix, name), done, total)
+        sub = ingest_dir(folder, store_dir, progress=report)
+        ingested += [os.path.join(prefix, name) for name in sub.files]
+        rows += sub.rows
+        skipped += sub.skipped_lines
+        partitions.update(sub.partitions)
+    return IngestResult(ingested, rows, skipped, sorted(partitions))
+
+
+def query(store_dir, device, start=None, end=None, columns=None):
+    """Rows of a device between two dates (datetimes for a finer range), as {column: array}
+
+    Only the partitions of the days asked are read.
+    """
+    store = Store(store_dir)
+    start_time = _seconds(start)
+    end_time = _seconds(end)
+    result = {}
+    count = 0
+    for partition in store.partitions(device, start, end):
+        times = partition.column("time")
+        keep = [i for i, t in enumerate(times)
+                if (start_time is None or t >= start_time) and (end_time is None or t < end_time)]
+        for name in columns or partition.columns:
+            if name not in result:
+                # location is given as text, the codes of each partition index its own list
+                result[name] = [""] * count if name == "location" else array("d", [NAN]) * count
+        for name, values in result.items():
+            if name not in partition.columns:
+                values.extend(["" if name == "location" else NAN] * len(keep))
+            elif name == "location":
+                codes = partition.column(name)
+                values.extend(partition.locations[codes[i]] for i in keep)
+            else:
+                column = partition.column(name)
+                values.extend(column[i] for i in keep)
+        count += len(keep)
+    return result
+
+
+def _seconds(when):
+    if when is None:
+        return None
+    if not isinstance(when, datetime):
+        when = datetime(when.year, when.month, when.day)
+    return when.replace(tzinfo=timezone.utc).timestamp()
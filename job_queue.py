@@ -0,0 +1,361 @@
+"""Jobs for the device kept on disk, retried until they succeed
+
+In the field the USB cable gets pulled, the logger reboots, the laptop goes
+to sleep. Downloads, time settings and config uploads are therefore queued
+in data/jobs.sqlite and run from there: a job that fails on a lost
+connection waits 5 s, 10 s, 20 s... (up to 5 min) and runs again, at once
+when the device is plugged back, and the queue is still there when the
+application starts again.
+
+A job is bound to the board it first ran on (its unique id): with another
+logger plugged it just waits. A download remembers the files already
+complete and continues the others from their .part file, so a retry only
+transfers what is missing.
+
+    python job_queue.py list
+    python job_queue.py download log1.csv log2.csv
+    python job_queue.py run --port /dev/ttyACM0
+"""
+import argparse
+import collections
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import datalogger
+from device_session import Cancelled, DeviceError, DeviceSession
+from sd_transfer import NOT_FOUND, download_files
+
+QUEUE_FILE = os.path.join("data", "jobs.sqlite")
+# seconds before the first retry, doubled at each failure up to MAX_DELAY
+BASE_DELAY = 5
+MAX_DELAY = 300
+MAX_ATTEMPTS = 20
+
+# state: queued, running, done, failed (no attempt left) or cancelled
+# args, progress: dicts (the files already downloaded...), device: unique id of the board, None before the first run
+Job = collections.namedtuple("Job", ["id", "kind", "args", "state", "device", "attempts", "next_try", "error",
+                                     "progress", "result", "created", "updated"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    args TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    device TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_try REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    progress TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+
+class WrongDevice(DeviceError):
+    """Another logger than the one of the job is connected"""
+
+
+def backoff(attempts, base=BASE_DELAY, maximum=MAX_DELAY):
+    """Seconds to wait after the attempts-th failure"""
+    return min(base * 2 ** (attempts - 1), maximum)
+
+
+class JobQueue:
+    """The jobs of data/jobs.sqlite, usable from the GUI thread and the device worker
+
+    Every call opens its own connection: sqlite then takes care of the
+    threads and of a second process (the command line) using the same file.
+    """
+
+    def __init__(self, path=QUEUE_FILE, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._db() as db:
+            db.execute(SCHEMA)
+            # running when the application stopped: run it again
+            db.execute("UPDATE jobs SET state = 'queued' WHERE state = 'running'")
+
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        return _Closing(db)
+
+    def _job(self, row):
+        return Job(row["id"], row["kind"], json.loads(row["args"]), row["state"], row["device"], row["attempts"],
+                   row["next_try"], row["error"], json.loads(row["progress"]),
+                   json.loads(row["result"]) if row["result"] else None, row["created"], row["updated"])
+
+    def add(self, kind, **args):
+        """Queue a job (a kind of JOBS) to run as soon as possible, returns its id"""
+        if kind not in JOBS:
+            raise ValueError(f"unknown job kind: {kind}")
+        now = time.time()
+        with self._lock, self._db() as db:
+            return db.execute("INSERT INTO jobs (kind, args, created, updated) VALUES (?, ?, ?, ?)",
+                              (kind, json.dumps(args), now, now)).lastrowid
+
+    def get(self, job_id):
+        with self._db() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def jobs(self, states=None):
+        """All the jobs, or those in one of states, oldest first"""
+        with self._db() as db:
+            rows = db.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        return [job for job in map(self._job, rows) if states is None or job.state in states]
+
+    def next_due(self, device=None, now=None):
+        """The oldest queued job whose retry time has come, for that board when given, None if there is none"""
+        now = time.time() if now is None else now
+        with self._db() as db:
+            rows = db.execute("SELECT * FROM jobs WHERE state = 'queued' AND next_try <= ? ORDER BY id",
+                              (now,)).fetchall()
+        for row in rows:
+            if device is None or row["device"] in (None, device):
+                return self._job(row)
+        return None
+
+    def _update(self, job_id, **values):
+        values["updated"] = time.time()
+        columns = ", ".join(f"{key} = ?" for key in values)
+        with self._lock, self._db() as db:
+            db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", list(values.values()) + [job_id])
+
+    def start(self, job_id, device=None):
+        self._update(job_id, state="running", **({"device": device} if device else {}))
+
+    def set_progress(self, job_id, progress):
+        """Save what is already done, a retry starts from there"""
+        self._update(job_id, progress=json.dumps(progress))
+
+    def finish(self, job_id, result=None):
+        self._update(job_id, state="done", error=None, result=json.dumps(result))
+
+    def fail(self, job_id, error, retry=True):
+        """Record a failed attempt, the job runs again after the backoff delay while attempts are left
+
+        Returns the new state of the job.
+        """
+        job = self.get(job_id)
+        attempts = job.attempts + 1
+        if retry and attempts < self.max_attempts:
+            state = "queued"
+        else:
+            state = "failed"
+        self._update(job_id, state=state, attempts=attempts, error=str(error),
+                     next_try=time.time() + backoff(attempts))
+        return state
+
+    def wait(self, job_id, error, delay=BASE_DELAY):
+        """Put the job back without counting an attempt (its device is not the one connected)"""
+        self._update(job_id, state="queued", error=str(error), next_try=time.time() + delay)
+
+    def wake(self):
+        """Retry the waiting jobs now, when a device was just plugged"""
+        self._update_all("UPDATE jobs SET next_try = 0 WHERE state = 'queued'")
+
+    def retry(self, job_id):
+        """Run a failed or cancelled job again, with all its attempts"""
+        self._update(job_id, state="queued", attempts=0, next_try=0)
+
+    def cancel(self, job_id):
+        self._update(job_id, state="cancelled")
+
+    def clear_finished(self):
+        """Forget the done and cancelled jobs"""
+        self._update_all("DELETE FROM jobs WHERE state IN ('done', 'cancelled')")
+
+    def _update_all(self, statement):
+        with self._lock, self._db() as db:
+            db.execute(statement)
+
+
+class _Closing:
+    """sqlite3 connection as a context manager that commits and closes"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, kind, value, traceback):
+        try:
+            if kind is None:
+                self.db.commit()
+        finally:
+            self.db.close()
+
+
+def _download(session, queue, job, progress=None, cancel=None):
+    # the files already complete are not transferred again, the others continue from their .part
+    done = list(job.progress.get("done", []))
+    missing = list(job.progress.get("missing", []))
+    dest_dir = job.args.get("dest_dir", "data")
+    names = [name for name in job.args["names"] if name not in done and name not in missing]
+    offsets = {}
+    for name in names:
+        # the .part of an earlier attempt, even when an older complete copy is there too
+        part = os.path.join(dest_dir, name) + ".part"
+        if os.path.exists(part):
+            offsets[name] = os.path.getsize(part)
+    result = download_files(session, names, dest_dir, progress=progress, cancel=cancel,
+                            compress=job.args.get("compress", False), offsets=offsets, parts=list(offsets))
+    done += result.downloaded
+    missing += [name for name, error in result.failed if error == NOT_FOUND]
+    queue.set_progress(job.id, {"done": done, "missing": missing})
+    if cancel is not None and cancel.is_set():
+        # download_files keeps the files saved before the cancel and returns: the job stops there
+        raise Cancelled("download cancelled")
+    datalogger.save_device_config(session, dest_dir)
+    failed = [(name, error) for name, error in result.failed if error != NOT_FOUND]
+    if failed:
+        raise DeviceError(", ".join(f"{name}: {error}" for name, error in failed))
+    return {"downloaded": done, "failed": [(name, NOT_FOUND) for name in missing], "bytes": result.bytes,
+            "seconds": result.seconds, "transfer": datalogger.format_transfer(result)}
+
+
+def _set_time(session, queue, job, progress=None, cancel=None):
+    result = datalogger.set_time(session)
+    return {"offset_before": result.offset_before, "drift_ppm": result.drift_ppm}
+
+
+def _push_config(session, queue, job, progress=None, cancel=None):
+    datalogger.push_config(session, job.args["config"])
+    return {}
+
+
+# kind: function(session, queue, job, progress, cancel) returning the result of the job (JSON)
+JOBS = {
+    "download": _download,
+    "set_time": _set_time,
+    "push_config": _push_config,
+}
+
+
+def what(job):
+    """What a job does, in a few words"""
+    if job.kind == "download":
+        return f"download {len(job.progress.get('done', []))}/{len(job.args['names'])} file(s)"
+    if job.kind == "set_time":
+        return "set the time"
+    return f"upload info.json ({job.args['config'].get('device_name', '')})"
+
+
+def describe(job):
+    """One line about a job and its state, for the lists"""
+    text = f"#{job.id} {what(job)}: {job.state}"
+    if job.state == "queued" and job.attempts:
+        text += f", attempt {job.attempts + 1} in {max(0, job.next_try - time.time()):.0f} s"
+    if job.error and job.state != "done":
+        text += f" ({job.error})"
+    return text
+
+
+def run_job(session, queue, job, progress=None, cancel=None):
+    """Run one job of the queue with the session, and record how it went
+
+    Returns the new state of the job: "done", "queued" (it will be retried),
+    "failed" or "cancelled". Lost connections and device errors are retried,
+    a job for another logger waits without counting an attempt.
+    """
+    try:
+        device = session.device_id()
+        if job.device is not None and device != job.device:
+            raise WrongDevice(f"waiting for the logger {job.device}, {device} is connected")
+        queue.start(job.id, device)
+        result = JOBS[job.kind](session, queue, job, progress, cancel)
+    except WrongDevice as e:
+        queue.wait(job.id, e)
+        return "queued"
+    except Cancelled:
+        queue.cancel(job.id)
+        return "cancelled"
+    except (DeviceError, OSError) as e:
+        return queue.fail(job.id, e)
+    except (KeyError, ValueError, TypeError) as e:
+        # a job that cannot work, retrying would not help
+        return queue.fail(job.id, e, retry=False)
+    queue.finish(job.id, result)
+    return "done"
+
+
+def run_all(queue, session, wait=True, progress=None):
+    """Run the jobs until none is left, waiting for the device and the retry delays with wait"""
+    while True:
+        job = queue.next_due()
+        if job is not None:
+            state = run_job(session, queue, job, progress)
+            print(describe(queue.get(job.id)))
+            if state == "queued":
+                session.close()
+            continue
+        left = queue.jobs(("queued",))
+        if not left or not wait:
+            return
+        time.sleep(max(0.5, min(job.next_try for job in left) - time.time()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Queue of the device jobs, retried until they succeed")
+    parser.add_argument("--queue", default=QUEUE_FILE, help="queue file")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="show the jobs")
+    download = sub.add_parser("download", help="queue the download of SD card files")
+    download.add_argument("names", nargs="+")
+    download.add_argument("--dest", default="data")
+    download.add_argument("--compress", action="store_true")
+    sub.add_parser("set-time", help="queue setting the device time")
+    config = sub.add_parser("push-config", help="queue the upload of an info.json")
+    config.add_argument("path")
+    run = sub.add_parser("run", help="run the queued jobs, waiting for the device")
+    run.add_argument("--port", default="auto")
+    run.add_argument("--no-wait", action="store_true", help="stop when the jobs left have to wait")
+    retry = sub.add_parser("retry", help="run a failed or cancelled job again")
+    retry.add_argument("id", type=int)
+    cancel = sub.add_parser("cancel", help="cancel a job")
+    cancel.add_argument("id", type=int)
+    sub.add_parser("clear", help="forget the done and cancelled jobs")
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(args.queue)
+    if args.command == "list":
+        for job in queue.jobs():
+            print(describe(job))
+    elif args.command == "download":
+        print(queue.add("download", names=args.names, dest_dir=args.dest, compress=args.compress))
+    elif args.command == "set-time":
+        print(queue.add("set_time"))
+    elif args.command == "push-config":
+        with open(args.path) as f:
+            print(queue.add("push_config", config=json.load(f)))
+    elif args.command == "retry":
+        queue.retry(args.id)
+    elif args.command == "cancel":
+        queue.cancel(args.id)
+    elif args.command == "clear":
+        queue.clear_finished()
+    else:
+        session = DeviceSession(args.port)
+        try:
+            run_all(queue, session, wait=not args.no_wait)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            session.close()
+        return 1 if queue.jobs(("failed",)) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Live readings of a running logger, to check its sensors while installing it
+
+Two ways to get the readings, neither stops the logging:
+
+- SerialReader listens to what the logger program prints on the USB serial
+  port, without entering the REPL (the session has to be closed meanwhile,
+  and the logger program started again if the session had stopped it);
+- SDFollower asks the device for the lines added to the file being written
+  on the SD card (read_from() of sd_query.py). It needs the REPL, so the
+  logging must run from a machine.Timer callback, which keeps going while
+  the REPL is used, or be the simulator.
+
+The lines are parsed one by one into Records kept in a LiveBuffer of fixed
+size: memory and drawing time do not grow over an hour long session.
+"""
+import collections
+import re
+import threading
+import time
+
+import serial
+
+from ingest import TIME_RE, parse_time
+from sd_preview import latest_file, read_from
+
+# readings kept, the oldest ones are dropped
+BUFFER_SIZE = 2000
+NUMBER_RE = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+# time: seconds since 1970 (the logger time when the line has one, else when it was received)
+Record = collections.namedtuple("Record", ["time", "values"])
+
+
+class RecordParser:
+    """Readings of logger lines: an optional date and time, then numbers
+
+    Works with the CSV rows of the SD card files ("2025-06-01 12:00:00,21.5,40.2")
+    as well as with what a logger program prints ("T=21.5 H=40.2"). A line
+    without digits but with separators is taken as the names of the columns.
+    """
+
+    def __init__(self):
+        self.columns = []
+        self._rest = b""
+
+    def parse(self, line):
+        """Record of one line, None for a line without readings"""
+        line = line.strip()
+        stamp = None
+        match = TIME_RE.match(line)
+        if match is not None and match.group(4) is not None:
+            stamp = parse_time(match.group(0))
+            line = line[match.end():]
+        values = [float(number) for number in NUMBER_RE.findall(line)]
+        if not values:
+            if stamp is None and re.search(r"[,;\t]", line) and not re.search(r"\d", line):
+                self.columns = [name.strip() for name in re.split(r"[,;\t]", line) if name.strip()]
+                # the first column names the time of the rows
+                if self.columns and re.search(r"date|time", self.columns[0], re.I):
+                    self.columns = self.columns[1:]
+            return None
+        return Record(stamp if stamp is not None else time.time(), values)
+
+    def feed(self, data):
+        """Records of the complete lines of data (bytes), the end of an incomplete line is kept"""
+        lines = (self._rest + data).split(b"\n")
+        self._rest = lines.pop()[-4096:]
+        records = []
+        for line in lines:
+            record = self.parse(line.decode(errors="replace"))
+            if record is not None:
+                records.append(record)
+        return records
+
+    def column_name(self, index):
+        return self.columns[index] if index < len(self.columns) else f"value {index + 1}"
+
+
+class LiveBuffer:
+    """The last `size` records, shared between the reading thread and the GUI"""
+
+    def __init__(self, size=BUFFER_SIZE):
+        self.records = collections.deque(maxlen=size)
+        self.version = 0  # changes with every new record, to redraw only when needed
+        self.error = None
+        self._lock = threading.Lock()
+
+    def add(self, records):
+        if not records:
+            return
+        with self._lock:
+            self.records.extend(records)
+            self.version += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.records)
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+            self.version += 1
+
+
+class SerialReader(threading.Thread):
+    """Read the lines a logger program prints on its serial port, without interrupting it"""
+
+    def __init__(self, port, buffer, baudrate=115200, restart=False):
+        super().__init__(name=f"live-{port}", daemon=True)
+        self.port = port
+        self.buffer = buffer
+        self.baudrate = baudrate
+        self.restart = restart  # soft reset first: main.py runs again after a session interrupted it
+        self.parser = RecordParser()
+        self._stopping = threading.Event()
+
+    def run(self):
+        try:
+            with serial.serial_for_url(self.port, baudrate=self.baudrate, timeout=0.2, exclusive=True) as link:
+                if self.restart:
+                    link.write(b"\r\x04")  # ctrl-D at the friendly REPL
+                while not self._stopping.is_set():
+                    data = link.read(max(link.in_waiting, 1))
+                    if data:
+                        self.buffer.add(self.parser.feed(data.replace(b"\r", b"")))
+        except (serial.SerialException, OSError) as e:
+            self.buffer.error = str(e)
+
+    def stop(self):
+        self._stopping.set()
+
+
+class SDFollower:
+    """Follow the file being written on the SD card, poll() reads what was added since the last call
+
+    poll() talks to the device: the GUI runs it in the DeviceWorker of the
+    session, between the other operations.
+    """
+
+    def __init__(self, buffer, name=None, history=4096):
+        self.buffer = buffer
+        self.name = name  # None: the file modified last
+        self.offset = None
+        self.history = history  # bytes of the file shown when starting
+        self.parser = RecordParser()
+
+    def poll(self, session):
+        if self.name is None:
+            self.name = latest_file(session)
+            if self.name is None:
+                return 0
+        if self.offset is None:
+            # start with the end of the file: the rows written just before
+            self.offset = 0
+            limit = self.history
+        else:
+            limit = 64 * 1024
+        self.offset, lines = read_from(session, self.name, self.offset, limit)
+        records = [record for record in map(self.parser.parse, lines) if record is not None]
+        self.buffer.add(records)
+        return len(records)
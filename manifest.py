@@ -0,0 +1,77 @@
+"""Files of the data directory verified against the SD card
+
+Every download checks the copy on the computer with a sha256 computed by the
+device while sending the file. The verified files are kept in
+data/.manifest.json with their size, modification time and sha256: as long
+as the local copy keeps the same size and time, a later sync with verify
+does not need to have the device hash it again.
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_FILE = ".manifest.json"
+
+
+def sha256_range(path, start=0, end=None):
+    """sha256 (hex) of the bytes of a file from start to end (the end of the file with None)"""
+    h = hashlib.sha256()
+    if end is None:
+        end = os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.seek(start)
+        left = end - start
+        while left > 0:
+            block = f.read(min(left, 1024 * 1024))
+            if not block:
+                break
+            h.update(block)
+            left -= len(block)
+    return h.hexdigest()
+
+
+class Manifest:
+    """{name: {"size", "mtime", "sha256"}} of the verified files of a data directory
+
+    sha256 is None for a copy completed with a verified tail: only the new
+    bytes were hashed then, the beginning was verified before.
+    """
+
+    def __init__(self, data_dir="data"):
+        self.path = os.path.join(data_dir, MANIFEST_FILE)
+        self.data_dir = data_dir
+        self.files = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.files = json.load(f)
+        except (OSError, ValueError):
+            self.files = {}
+
+    def save(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.files, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def record(self, name, sha256, path=None):
+        """Remember that the local copy of name (or path, its .part) matches the card"""
+        st = os.stat(path or os.path.join(self.data_dir, name))
+        self.files[name] = {"size": st.st_size, "mtime": st.st_mtime, "sha256": sha256}
+
+    def forget(self, name):
+        self.files.pop(name, None)
+
+    def verified(self, name, path=None):
+        """Whether the local copy is still the one that was verified (same size and modification time)"""
+        entry = self.files.get(name)
+        if entry is None:
+            return False
+        try:
+            st = os.stat(path or os.path.join(self.data_dir, name))
+        except OSError:
+            return False
+        return st.st_size == entry["size"] and st.st_mtime == entry["mtime"]
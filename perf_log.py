@@ -0,0 +1,248 @@
+"""Timing of the device operations and performance log
+
+Every operation run by a DeviceWorker is timed by phase: connect (opening
+the port and entering the raw REPL), mount (SD card), transfer (streaming
+the files), write (putting them on disk, in parallel with the transfer) and
+command (the rest: the other device round trips). Bytes moved, reconnection
+retries and errors are counted too. Each operation ends up as one JSON line
+in data/perf_log.jsonl:
+
+    {"time": "...", "device": "/dev/ttyACM0", "operation": "Downloading 3 file(s)",
+     "seconds": 2.41, "phases": {"connect": 0.12, "mount": 0.31, "transfer": 1.9, ...},
+     "bytes": 1048576, "retries": 0, "error": null}
+
+and in rolling per-device statistics (throughput, percentiles of the round
+trip latency) shown by the GUI, to spot bad cables, slow SD cards and
+overloaded USB hubs. The code timed only needs `with perf_log.phase("mount"):`,
+outside of an operation it does nothing.
+"""
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+LOG_FILE = os.path.join("data", "perf_log.jsonl")
+# the log is renamed to .1 above this size
+MAX_LOG_SIZE = 5 * 1024 * 1024
+# phases that run while the transfer does, not counted in the duration of the other ones
+PARALLEL_PHASES = {"write"}
+
+log_path = LOG_FILE  # None to keep the statistics without writing the log
+
+DeviceStats = collections.namedtuple("DeviceStats", [
+    "device", "operations", "throughput", "latency_p50", "latency_p90", "latency_p99", "retries", "errors"])
+
+_local = threading.local()
+_lock = threading.Lock()
+_devices = {}
+
+
+class _DeviceHistory:
+    def __init__(self):
+        self.operations = 0
+        self.round_trips = collections.deque(maxlen=200)
+        self.transfers = collections.deque(maxlen=20)  # (bytes, seconds)
+        self.retries = collections.deque(maxlen=50)  # per operation
+        self.errors = collections.deque(maxlen=50)
+        self.last = None
+
+
+class Operation:
+    """Timings of one device operation, filled by the phases run in its thread"""
+
+    def __init__(self, device, name):
+        self.device = device
+        self.name = name
+        self.phases = collections.defaultdict(float)
+        self.bytes = 0
+        self.retries = 0
+        self.round_trips = []
+        self.error = None
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        self._stack = []  # [phase, start, time spent in the phases inside it]
+
+    def record(self):
+        data = {
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "device": self.device,
+            "operation": self.name,
+            "seconds": round(self.seconds, 4),
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            "bytes": self.bytes,
+            "retries": self.retries,
+            "error": self.error,
+        }
+        if self.round_trips:
+            data["round_trip_ms"] = round(sorted(self.round_trips)[len(self.round_trips) // 2] * 1000, 2)
+        return data
+
+
+@contextlib.contextmanager
+def operation(device, name):
+    """Time one operation of a device (DeviceWorker runs every job inside one)"""
+    op = Operation(device, name)
+    previous = current()
+    _local.operation = op
+    try:
+        yield op
+    except BaseException as e:
+        op.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _local.operation = previous
+        op.seconds = time.perf_counter() - op.start
+        sequential = sum(seconds for name, seconds in op.phases.items() if name not in PARALLEL_PHASES)
+        op.phases["command"] += max(op.seconds - sequential, 0.0)
+        _add(op)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Add the time spent inside to a phase of the current operation
+
+    A phase inside another one is not counted twice: the time of a
+    reconnection in the middle of a transfer goes to connect only.
+    """
+    op = current()
+    if op is None:
+        yield
+        return
+    entry = [name, time.perf_counter(), 0.0]
+    op._stack.append(entry)
+    try:
+        yield
+    finally:
+        op._stack.pop()
+        elapsed = time.perf_counter() - entry[1]
+        op.phases[name] += elapsed - entry[2]
+        if op._stack:
+            op._stack[-1][2] += elapsed
+
+
+def current():
+    """The operation running in this thread, None outside of one"""
+    return getattr(_local, "operation", None)
+
+
+def set_device(device):
+    op = current()
+    if op is not None and device:
+        op.device = device
+
+
+def add_phase(name, seconds):
+    """Time measured elsewhere (in another thread) for a phase of the current operation"""
+    op = current()
+    if op is not None:
+        op.phases[name] += seconds
+
+
+def add_bytes(n):
+    op = current()
+    if op is not None:
+        op.bytes += n
+
+
+def retry():
+    op = current()
+    if op is not None:
+        op.retries += 1
+
+
+def round_trip(seconds):
+    """One measure of the link latency: a command sent and the device answer"""
+    op = current()
+    if op is not None:
+        op.round_trips.append(seconds)
+
+
+def _add(op):
+    with _lock:
+        history = _devices.setdefault(op.device, _DeviceHistory())
+        history.operations += 1
+        history.last = op
+        history.round_trips.extend(op.round_trips)
+        history.retries.append(op.retries)
+        history.errors.append(op.error is not None)
+        if op.bytes and op.phases.get("transfer"):
+            history.transfers.append((op.bytes, op.phases["transfer"]))
+        if log_path:
+            _write(op.record())
+
+
+def _write(record):
+    try:
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        if os.path.exists(log_path) and os.path.getsize(log_path) > MAX_LOG_SIZE:
+            os.replace(log_path, log_path + ".1")
+        with open(log_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"could not write the performance log: {e}")
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def stats(device):
+    """DeviceStats of the last operations of a device
+
+    throughput is in bytes per second of transfer, the latencies in seconds.
+    """
+    with _lock:
+        history = _devices.get(device)
+        if history is None:
+            return None
+        transferred = sum(n for n, seconds in history.transfers)
+        transfer_time = sum(seconds for n, seconds in history.transfers)
+        return DeviceStats(
+            device, history.operations,
+            transferred / transfer_time if transfer_time else None,
+            _percentile(history.round_trips, 0.5),
+            _percentile(history.round_trips, 0.9),
+            _percentile(history.round_trips, 0.99),
+            sum(history.retries), sum(history.errors))
+
+
+def last_operation(device):
+    """The Operation that ended last on a device"""
+    with _lock:
+        history = _devices.get(device)
+        return history.last if history else None
+
+
+def all_stats():
+    """DeviceStats of every device that talked to the computer"""
+    with _lock:
+        devices = [device for device, history in _devices.items() if history.round_trips or history.transfers]
+    return [stats(device) for device in sorted(devices)]
+
+
+def format_stats(s):
+    """One line summary of a DeviceStats"""
+    text = f"{os.path.basename(s.device)}: {s.operations} ops"
+    if s.throughput:
+        text += f", {s.throughput / 1024:.0f} KB/s"
+    if s.latency_p50 is not None:
+        text += (f", latency p50 {s.latency_p50 * 1000:.1f} / p90 {s.latency_p90 * 1000:.1f} / "
+                 f"p99 {s.latency_p99 * 1000:.1f} ms")
+    if s.retries:
+        text += f", {s.retries} retries"
+    if s.errors:
+        text += f", {s.errors} errors"
+    return text
+
+
+def format_operation(op):
+    """Duration of an operation and of its phases, longest first"""
+    phases = ", ".join(f"{name} {seconds:.2f}" for name, seconds in sorted(op.phases.items(), key=lambda p: -p[1])
+                       if seconds >= 0.005)
+    return f"{op.name}: {op.seconds:.2f} s" + (f" ({phases})" if phases else "")
@@ -1,8 +1,16 @@
 import vfs
 import sdcard
 import time
+import machine
 from machine import SPI, Pin
 
+# SPI clock used to talk to the SD card once it is initialised (1320000 is the default of the sdcard driver)
+# the computer can define SD_BAUDRATE before running this file to read the card faster
+try:
+    SD_BAUDRATE
+except NameError:
+    SD_BAUDRATE = 1320000
+
 # Setup SPI for the SD card on the Adafruit Pi Cowbell datalogging shield
 cs = Pin(17,Pin.OUT)
 
@@ -16,7 +24,7 @@ spi = machine.SPI(0,
                   mosi=Pin(19),
                   miso=Pin(16))
 
-sd = sdcard.SDCard(spi, cs)
+sd = sdcard.SDCard(spi, cs, baudrate=SD_BAUDRATE)
 # we use the now standard (as of the latest micropython version) vfs library 
 filsys = vfs.VfsFat(sd)
 
@@ -0,0 +1,27 @@
+# Helpers executed on the device to set and read the Cowbell clock precisely
+# The GUI loads this file once per connection and then calls the functions below
+import time
+import urtc
+import machine
+from machine import I2C, Pin
+
+# set the I2C of the clock on pins 5 and 4 of the cowbell datalogger from adafruit
+i2c_clock = I2C(0,scl=Pin(5), sda=Pin(4))
+rtc = urtc.PCF8523(i2c_clock)
+
+
+def wait_second_edge():
+    # the PCF8523 only gives whole seconds: wait for the next tick and print the new time right away
+    second = rtc.datetime().second
+    while True:
+        dt = rtc.datetime()
+        if dt.second != second:
+            break
+    print(dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+
+
+def set_clocks(year, month, day, weekday, hour, minute, second):
+    # writing the seconds restarts the 1 Hz divider of the PCF8523: the computer calls this on a second boundary
+    rtc.datetime(urtc.datetime_tuple(year=year, month=month, day=day, weekday=weekday,
+                                     hour=hour, minute=minute, second=second))
+    machine.RTC().datetime((year, month, day, weekday, hour, minute, second, 0))
@@ -0,0 +1,113 @@
+"""Index of the SD card files (name, size, modification time), cached per device
+
+The whole card, subfolders included, is listed by one walk on the device
+that only reads the directories (sizes come with them). The modification
+times need one stat per file, so they are asked only for the files that
+are new or changed size since the cached listing in data/.sd_index/.
+"""
+import collections
+import json
+import os
+
+FileEntry = collections.namedtuple("FileEntry", ["name", "size", "mtime"])
+
+CACHE_DIR = os.path.join("data", ".sd_index")
+# above this many changed files one walk with stat is cheaper than sending their names
+STAT_ALL_THRESHOLD = 200
+# seconds between 1970 and 2000, for firmware with the micropython 2000 epoch
+EPOCH_2000 = 946684800
+
+
+def _read_lines(session, code):
+    session.ensure_sd_mounted()
+    session.ensure_script("sd_tools.py")
+    return session.exec(code, timeout=120).splitlines()
+
+
+def _parse(lines, with_mtime):
+    offset = 0
+    entries = {}
+    for line in lines:
+        line = line.rstrip("\r")
+        if not line or line == "END":
+            continue
+        if line.startswith("Y "):
+            offset = EPOCH_2000 if int(line[2:]) == 2000 else 0
+            continue
+        if with_mtime:
+            size, mtime, name = line.split(" ", 2)
+            entries[name] = FileEntry(name, int(size), int(mtime) + offset)
+        else:
+            size, name = line.split(" ", 1)
+            entries[name] = int(size)
+    return entries
+
+
+def walk(session):
+    """{name: size} of every file of the SD card"""
+    return _parse(_read_lines(session, "walk()"), False)
+
+
+class SDIndex:
+    """Listing of the SD card of one device, kept up to date incrementally"""
+
+    def __init__(self, device_id, cache_dir=CACHE_DIR):
+        self.device_id = device_id
+        self.path = os.path.join(cache_dir, f"{device_id}.json")
+        self.files = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.files = {name: FileEntry(name, size, mtime) for name, (size, mtime) in json.load(f).items()}
+        except (OSError, ValueError):
+            self.files = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({e.name: [e.size, e.mtime] for e in self.files.values()}, f)
+        os.replace(tmp, self.path)
+
+    def refresh(self, session):
+        """Update from the device, return the names of the new or changed files"""
+        sizes = walk(session)
+        changed = [name for name, size in sizes.items()
+                   if name not in self.files or self.files[name].size != size]
+        if len(changed) > STAT_ALL_THRESHOLD:
+            fresh = _parse(_read_lines(session, "walk(True)"), True)
+        elif changed:
+            fresh = _parse(_read_lines(session, f"stat_files({changed!r})"), True)
+        else:
+            fresh = {}
+        self.files = {name: fresh.get(name) or self.files[name] for name in sizes
+                      if name in fresh or name in self.files}
+        self.save()
+        return changed
+
+    @property
+    def entries(self):
+        return sorted(self.files.values())
+
+
+def sort_entries(entries, key="name", reverse=False):
+    """Sort by "name", "size" or "date" """
+    if key == "size":
+        return sorted(entries, key=lambda e: (e.size, e.name), reverse=reverse)
+    if key == "date":
+        return sorted(entries, key=lambda e: (e.mtime, e.name), reverse=reverse)
+    return sorted(entries, key=lambda e: e.name.lower(), reverse=reverse)
+
+
+def filter_entries(entries, text="", min_size=0, since=None, until=None):
+    """Files whose name contains text, at least min_size bytes and modified between since and until (epoch)"""
+    text = text.lower()
+    return [e for e in entries
+            if text in e.name.lower() and e.size >= min_size
+            and (since is None or e.mtime >= since) and (until is None or e.mtime <= until)]
+
+
+def total_bytes(entries):
+    return sum(e.size for e in entries)
@@ -0,0 +1,139 @@
+"""Quick look at the logger files of the SD card, without downloading them
+
+The scan runs on the device (sd_query.py) and only its result comes back:
+the last rows of a file are read backwards from its end, and one pass over
+the file counts the rows, finds the first and last time, the minimum and
+maximum of a column and the biggest gaps between timestamps. That takes a
+few lines on the serial link whatever the size of the file. read_from()
+follows the file being written, for the live view (live_monitor.py).
+"""
+import collections
+from datetime import datetime, timedelta
+
+from sd_index import EPOCH_2000
+
+FilePreview = collections.namedtuple("FilePreview", ["name", "size", "lines"])
+# first, last: datetimes of the first and last row, step: usual seconds between rows,
+# gaps: [(start datetime, seconds), ...] the biggest first, backwards: times going back
+FileSummary = collections.namedtuple("FileSummary", [
+    "name", "size", "rows", "header", "first", "last", "step", "gap_count", "gaps", "backwards",
+    "column", "count", "minimum", "maximum"])
+
+# seconds the device needs per byte of file for a summary, for the timeout (a Pico reads ~20 KB/s this way)
+SCAN_SECONDS_PER_BYTE = 1 / 10000
+
+
+def _exec(session, code, timeout=30):
+    session.ensure_sd_mounted()
+    session.ensure_script("sd_query.py")
+    lines = [line.rstrip("\r") for line in session.exec(code, timeout=timeout).splitlines()]
+    return [line for line in lines if line and line != "END"]
+
+
+def preview(session, name, rows=10):
+    """Last rows of a file, as FilePreview(name, size, lines)"""
+    size = 0
+    lines = []
+    for line in _exec(session, f"tail({name!r}, {int(rows)})"):
+        kind, _, value = line.partition(" ")
+        if kind == "S":
+            size = int(value)
+        elif kind == "L":
+            lines.append(value)
+    return FilePreview(name, size, lines)
+
+
+def latest_file(session):
+    """Name of the file of the SD card modified last (the one being written), None on an empty card"""
+    for line in _exec(session, "latest()"):
+        if line.startswith("N "):
+            return line[2:]
+    return None
+
+
+def read_from(session, name, offset, limit=4096):
+    """(new offset, [line, ...]) of the complete lines written to a file after offset
+
+    Only the last limit bytes are sent when more was written, so following a
+    file costs a small answer per call. From offset 0 the first line of the
+    file (the header) comes first anyway.
+    """
+    lines = []
+    for line in _exec(session, f"read_from({name!r}, {int(offset)}, {int(limit)})"):
+        kind, _, value = line.partition(" ")
+        if kind == "O":
+            offset = int(value)
+        elif kind == "L":
+            lines.append(value)
+    return offset, lines
+
+
+def summarize(session, name, column=1, gap=0, size=None):
+    """FileSummary of a file, scanned on the device
+
+    column is the index of the field (0 for the time) or its name in the
+    header, gap the seconds between rows counted as a gap (0: more than twice
+    the usual step). size, when known, only gives a better timeout.
+    """
+    timeout = 30 + (size * SCAN_SECONDS_PER_BYTE if size else 600)
+    values = dict(size=0, rows=0, header=None, first=None, last=None, step=0, gap_count=0, gaps=[], backwards=0,
+                  column=None, count=0, minimum=None, maximum=None)
+    epoch = datetime(1970, 1, 1)
+    for line in _exec(session, f"inspect({name!r}, {column!r}, {gap!r})", timeout):
+        kind, _, value = line.partition(" ")
+        if kind == "Y":
+            epoch = datetime(1970, 1, 1) + timedelta(seconds=EPOCH_2000 if int(value) == 2000 else 0)
+        elif kind == "S":
+            values["size"] = int(value)
+        elif kind == "H":
+            values["header"] = value
+        elif kind == "R":
+            values["rows"] = int(value)
+        elif kind == "T":
+            first, last, step, gap_count, backwards = (int(v) for v in value.split())
+            values.update(first=epoch + timedelta(seconds=first), last=epoch + timedelta(seconds=last), step=step,
+                          gap_count=gap_count, backwards=backwards)
+        elif kind == "C":
+            index, count, minimum, maximum = value.split()
+            values.update(column=int(index), count=int(count), minimum=float(minimum), maximum=float(maximum))
+        elif kind == "G":
+            start, seconds = (int(v) for v in value.split())
+            values["gaps"].append((epoch + timedelta(seconds=start), seconds))
+    if values["column"] is not None and values["header"]:
+        # the name of the column rather than its index
+        for sep in (",", ";", "\t"):
+            names = [n.strip() for n in values["header"].split(sep)]
+            if len(names) > values["column"] >= 1:
+                values["column"] = names[values["column"]]
+                break
+    return FileSummary(name, **values)
+
+
+def _duration(seconds):
+    if seconds < 120:
+        return f"{seconds} s"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f} min"
+    if seconds < 172800:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 86400:.1f} days"
+
+
+def format_summary(s):
+    """A few lines describing a FileSummary"""
+    lines = [f"{s.name}: {s.rows} rows, {s.size} bytes"]
+    if s.header:
+        lines.append(f"columns: {s.header}")
+    if s.first is not None:
+        lines.append(f"from {s.first:%Y-%m-%d %H:%M:%S} to {s.last:%Y-%m-%d %H:%M:%S}"
+                     + (f", every {_duration(s.step)}" if s.step else ""))
+    if s.count:
+        lines.append(f"{s.column}: min {s.minimum:g}, max {s.maximum:g} ({s.count} values)")
+    if s.gap_count:
+        lines.append(f"{s.gap_count} gap(s) in the timestamps, the biggest:")
+        lines += [f"  {start:%Y-%m-%d %H:%M:%S} {_duration(seconds)}" for start, seconds in s.gaps]
+    elif s.first is not None:
+        lines.append("no gap in the timestamps")
+    if s.backwards:
+        lines.append(f"the time goes back {s.backwards} time(s), was the clock set?")
+    return "\n".join(lines)
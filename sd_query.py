@@ -0,0 +1,223 @@
+# Look at a logger file on the device without downloading it
+# Run once per session to define the helpers (like sd_tools.py). They read the
+# file in small chunks, so the memory used does not depend on its size, and only
+# print a compact result ending with END.
+import os
+import time
+
+
+def tail(name, n=10, chunk=512, limit=8192):
+    # last n lines, reading backwards from the end of the file (at most limit bytes)
+    with open('/sd/' + name, 'rb') as f:
+        size = f.seek(0, 2)
+        pos = size
+        data = b''
+        while pos > 0 and data.count(b'\n') <= n and len(data) < limit:
+            step = min(chunk, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = data.split(b'\n')
+    if not lines[-1]:
+        lines.pop()
+    print('S', size)
+    for line in lines[-n:]:
+        _print_line('L', line)
+    print('END')
+
+
+def _print_line(kind, line):
+    line = line.rstrip(b'\r')
+    try:
+        print(kind, line.decode())
+    except UnicodeError:
+        print(kind, repr(line))
+
+
+class _Scan:
+    # state of one pass over a file, fed line by line
+
+    def __init__(self, column, gap, max_gaps):
+        self.column = column  # index of the field, or its name in the header
+        self.gap = gap
+        self.max_gaps = max_gaps
+        self.rows = 0
+        self.header = None
+        self.sep = None
+        self.count = 0
+        self.low = None
+        self.high = None
+        self.first = None
+        self.last = None
+        self.step = 0
+        self.early = []  # intervals seen before the step is known: (seconds, start)
+        self.gaps = []  # biggest gaps: (seconds, start)
+        self.gap_count = 0
+        self.backwards = 0
+        self.day = None
+        self.midnight = 0
+
+    def seconds(self, line):
+        # 'YYYY-MM-DD HH:MM:SS' at the start of the line (/ in the date, T , ; or tab before the time)
+        if len(line) < 19 or line[4:5] not in b'-/' or line[13:14] != b':' or line[16:17] != b':':
+            return None
+        try:
+            if line[:10] != self.day:
+                self.midnight = time.mktime((int(line[0:4]), int(line[5:7]), int(line[8:10]), 0, 0, 0, 0, 0))
+                self.day = line[:10]
+            return self.midnight + int(line[11:13]) * 3600 + int(line[14:16]) * 60 + int(line[17:19])
+        except ValueError:
+            return None
+
+    def line(self, line):
+        line = line.rstrip(b'\r')
+        if not line:
+            return
+        if not self.rows and self.header is None:
+            for sep in (b',', b';', b'\t'):
+                if sep in line:
+                    self.sep = sep
+                    break
+            if line[:1] not in b'0123456789':
+                self.header = line
+                if self.sep is not None and not isinstance(self.column, int):
+                    names = [f.strip().decode() for f in line.split(self.sep)]
+                    self.column = names.index(self.column) if self.column in names else None
+                return
+        self.rows += 1
+        t = self.seconds(line)
+        if t is not None:
+            if self.last is not None:
+                self.interval(t - self.last, self.last)
+            if self.first is None:
+                self.first = t
+            self.last = t
+        if isinstance(self.column, int) and self.sep is not None:
+            fields = line.split(self.sep)
+            if self.column < len(fields):
+                try:
+                    value = float(fields[self.column])
+                except ValueError:
+                    return
+                self.count += 1
+                if self.low is None or value < self.low:
+                    self.low = value
+                if self.high is None or value > self.high:
+                    self.high = value
+
+    def interval(self, seconds, start):
+        if seconds < 0:
+            self.backwards += 1
+            return
+        if not self.gap:
+            # the usual step is the smallest interval of the first rows, a gap is more than twice that
+            if len(self.early) < 10:
+                self.early.append((seconds, start))
+                return
+            if not self.step:
+                positive = [s for s, _ in self.early if s > 0]
+                self.step = min(positive) if positive else 1
+                self.gap = 2 * self.step
+                for s, t in self.early:
+                    self.interval(s, t)
+                self.early = []
+        if seconds > self.gap:
+            self.gap_count += 1
+            self.gaps.append((seconds, start))
+            if len(self.gaps) > self.max_gaps:
+                self.gaps.sort()
+                self.gaps.pop(0)
+
+    def finish(self):
+        # fewer intervals than needed for the step: look at them now
+        if self.early:
+            positive = [s for s, _ in self.early if s > 0]
+            self.step = min(positive) if positive else 0
+            self.gap = 2 * self.step
+            early, self.early = self.early, []
+            if self.gap:
+                for s, t in early:
+                    self.interval(s, t)
+
+
+def inspect(name, column=None, gap=0, chunk=512, max_gaps=5):
+    # one pass over the file: rows, first and last time, min and max of a column, biggest time gaps
+    scan = _Scan(column, gap, max_gaps)
+    buf = bytearray(chunk)
+    mv = memoryview(buf)
+    rest = b''
+    size = 0
+    with open('/sd/' + name, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            size += n
+            lines = (rest + bytes(mv[:n])).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                scan.line(line)
+            if len(rest) > 4096:
+                rest = b''  # not a text file, do not keep it all
+    scan.line(rest)
+    scan.finish()
+    print('Y', time.gmtime(0)[0])
+    print('S', size)
+    if scan.header is not None:
+        _print_line('H', scan.header)
+    print('R', scan.rows)
+    if scan.first is not None:
+        print('T', scan.first, scan.last, scan.step, scan.gap_count, scan.backwards)
+    if scan.count:
+        print('C', scan.column, scan.count, scan.low, scan.high)
+    for seconds, start in sorted(scan.gaps, reverse=True):
+        print('G', start, seconds)
+    print('END')
+
+
+def latest():
+    # the file of the card modified last, the one the logger writes to
+    best = None
+    folders = ['']
+    while folders:
+        folder = folders.pop()
+        for entry in os.ilistdir('/sd/' + folder if folder else '/sd'):
+            name = folder + '/' + entry[0] if folder else entry[0]
+            if entry[1] == 0x4000:
+                folders.append(name)
+                continue
+            mtime = os.stat('/sd/' + name)[8]
+            if best is None or mtime > best[0] or (mtime == best[0] and name > best[1]):
+                best = (mtime, name)
+    if best is not None:
+        print('N', best[1])
+    print('END')
+
+
+def read_from(name, offset, limit=4096):
+    # the complete lines written to a file after offset (the last limit bytes of them at most,
+    # after the first line of the file when reading from its start: the header of the columns)
+    head = b''
+    with open('/sd/' + name, 'rb') as f:
+        size = f.seek(0, 2)
+        if offset > size:
+            offset = 0  # a new file with the same name
+        skip = size - offset > limit
+        if skip and offset == 0:
+            f.seek(0)
+            head = f.readline()[:256]
+        if skip:
+            offset = size - limit
+        f.seek(offset)
+        data = f.read(size - offset)
+    if skip:
+        start = data.find(b'\n') + 1
+        data = data[start:]
+        offset += start
+    end = data.rfind(b'\n') + 1
+    print('O', offset + end)
+    if head.endswith(b'\n'):
+        _print_line('L', head[:-1])
+    for line in data[:end].split(b'\n')[:-1]:
+        _print_line('L', line)
+    print('END')
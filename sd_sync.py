@@ -0,0 +1,116 @@
+"""Incremental copy of the SD card into the data directory
+
+Logger files only grow, so a file already on the computer is brought up to
+date by transferring the bytes after the end of the local copy. A .part file
+left by an interrupted download is continued the same way. With verify=True
+the device hashes the part we already have, and the file is downloaded again
+from the start if the local copy is not a true beginning of the SD card file
+(the copies verified since their download, see manifest.py, are trusted).
+"""
+import collections
+import os
+
+from device_session import Cancelled
+from manifest import Manifest, sha256_range
+from sd_index import walk
+from sd_transfer import download_files
+
+# new: downloaded from the start, updated: only the new tail was transferred
+SyncResult = collections.namedtuple("SyncResult", ["new", "updated", "up_to_date", "failed", "bytes", "link_bytes",
+                                                   "seconds", "repaired"])
+
+
+def local_size(data_dir, name):
+    """Bytes of a file already on the computer: the complete copy or an interrupted .part"""
+    path = os.path.join(data_dir, name)
+    for candidate in (path, path + ".part"):
+        if os.path.exists(candidate):
+            return os.path.getsize(candidate), candidate
+    return 0, None
+
+
+def plan_sync(remote_files, data_dir="data"):
+    """Decide what to transfer for [(name, size), ...] on the SD card
+
+    Returns {name: offset} of the files to transfer and the list of files
+    already up to date.
+    """
+    to_transfer = {}
+    up_to_date = []
+    for name, size in remote_files:
+        have, path = local_size(data_dir, name)
+        if path is not None and path.endswith(".part") and have <= size:
+            to_transfer[name] = have
+        elif path is None or have > size:
+            # new file, or the file on the card was replaced by a shorter one
+            to_transfer[name] = 0
+        elif have < size:
+            to_transfer[name] = have
+        else:
+            up_to_date.append(name)
+    return to_transfer, up_to_date
+
+
+def file_sha256(path, length):
+    return sha256_range(path, 0, length)
+
+
+def verify_local_copies(session, plan, data_dir="data", up_to_date=(), cancel=None):
+    """Restart from zero the files whose local copy differs from the card (device side sha256)
+
+    The files of the manifest, verified when they were downloaded and not
+    changed since, are not hashed again.
+    """
+    session.ensure_sd_mounted()
+    session.ensure_script("sd_tools.py")
+    manifest = Manifest(data_dir)
+    checks = [name for name in plan if plan[name]] + list(up_to_date)
+    stale = []
+    for name in checks:
+        if cancel is not None and cancel.is_set():
+            raise Cancelled("sync cancelled")
+        have, path = local_size(data_dir, name)
+        if manifest.verified(name, path):
+            continue
+        remote_hash = session.exec(f"hash_prefix({name!r}, {have})", timeout=60).strip()
+        if remote_hash != file_sha256(path, have):
+            stale.append(name)
+            plan[name] = 0
+            manifest.forget(name)
+        elif not path.endswith(".part"):
+            manifest.record(name, remote_hash)
+    manifest.save()
+    return stale
+
+
+def sync_sd(session, data_dir="data", verify=False, progress=None, cancel=None, compress=False):
+    """Bring data_dir up to date with the SD card
+
+    Returns a SyncResult, failed being [(name, error), ...], bytes the
+    number of bytes transferred, link_bytes what they took on the serial link
+    (less with compress) and seconds the duration of the transfer.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    remote = sorted(walk(session).items())
+    plan, up_to_date = plan_sync(remote, data_dir)
+    if verify:
+        stale = verify_local_copies(session, plan, data_dir, up_to_date, cancel)
+        up_to_date = [name for name in up_to_date if name not in stale]
+    sizes = dict(remote)
+    names = sorted(plan)
+    # after the verification the beginning of every file continued from an offset matches the card
+    verified = [name for name in names if plan[name]] if verify else ()
+    # the offsets of plan_sync count the bytes of the .part when there is no complete copy
+    parts = [name for name in names if plan[name] and local_size(data_dir, name)[1].endswith(".part")]
+    result = download_files(session, names, data_dir, progress=progress, offsets=plan, cancel=cancel,
+                            compress=compress, verified=verified, parts=parts)
+    return SyncResult(
+        new=[name for name in result.downloaded if plan[name] == 0],
+        updated=[name for name in result.downloaded if plan[name] > 0],
+        up_to_date=up_to_date,
+        failed=result.failed,
+        bytes=sum(sizes[name] - plan[name] for name in result.downloaded),
+        link_bytes=result.link_bytes,
+        seconds=result.seconds,
+        repaired=result.repaired,
+    )
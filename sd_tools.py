@@ -0,0 +1,203 @@
+# Helpers executed on the device (after read_sd.py mounted the SD card)
+# The GUI loads this file once per connection and then calls the functions below
+import io
+import os
+import sys
+import time
+import struct
+import binascii
+import hashlib
+
+
+class _Sink(io.IOBase):
+    # collects what DeflateIO writes, sent as blocks after each chunk
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+def _can_deflate(wbits):
+    # False on firmware without the deflate module or built without its compression
+    try:
+        import deflate
+        d = deflate.DeflateIO(_Sink(), deflate.RAW, wbits)
+        d.write(b' ')
+        d.close()
+        return True
+    except (ImportError, AttributeError, OSError, ValueError):
+        return False
+
+
+def _send_blocks(out, sink, chunk):
+    data = sink.data
+    for i in range(0, len(data), chunk):
+        piece = data[i:i + chunk]
+        out.write(struct.pack('<HI', len(piece), binascii.crc32(piece)))
+        out.write(piece)
+    sink.data = bytearray()
+
+
+def send_files(names, chunk=4096, offsets=None, binary=True, compress=False, wbits=10, verify=True):
+    # binary: raw blocks of <length, crc32> + data on sys.stdout.buffer (no hex, half the bytes)
+    # otherwise one hex line per block, for firmware without sys.stdout.buffer
+    # compress: the binary blocks carry raw deflate data of the file (window of 2**wbits bytes)
+    # verify: the end line of each file gives the sha256 of the bytes sent, for the computer to check its copy
+    out = getattr(sys.stdout, 'buffer', None)
+    if out is None:
+        binary = False
+    if compress and (not binary or not _can_deflate(wbits)):
+        compress = False
+    if compress:
+        import deflate
+        sink = _Sink()
+    # announce the whole batch so the computer can show a total progress
+    if offsets is None:
+        offsets = [0] * len(names)
+    sizes = []
+    total = 0
+    for name, offset in zip(names, offsets):
+        try:
+            size = os.stat('/sd/' + name)[6]
+        except OSError:
+            size = -1
+        sizes.append(size)
+        total += max(size - offset, 0)
+    print('T', len(names), total, 'C' if compress else 'B' if binary else 'H')
+    buf = bytearray(chunk)
+    mv = memoryview(buf)
+    for name, size, offset in zip(names, sizes, offsets):
+        if size < 0:
+            print('E', name)
+            continue
+        # only the part after offset is sent (the computer already has the beginning)
+        print('F', size, offset, name)
+        if compress:
+            d = deflate.DeflateIO(sink, deflate.RAW, wbits)
+        h = hashlib.sha256() if verify else None
+        with open('/sd/' + name, 'rb') as f:
+            f.seek(offset)
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                if h:
+                    h.update(mv[:n])
+                if compress:
+                    d.write(mv[:n])
+                    if sink.data:
+                        _send_blocks(out, sink, chunk)
+                elif binary:
+                    out.write(struct.pack('<HI', n, binascii.crc32(mv[:n])))
+                    out.write(mv[:n])
+                else:
+                    print('D', binascii.hexlify(mv[:n]).decode())
+        if compress:
+            d.close()
+            _send_blocks(out, sink, chunk)
+        if binary:
+            out.write(struct.pack('<HI', 0, 0))
+        if h:
+            print('Z', binascii.hexlify(h.digest()).decode())
+        else:
+            print('Z')
+    print('END')
+
+
+def send_range(name, offset, length, chunk=4096):
+    # length bytes of a file from offset, in the blocks of send_files (hex lines without sys.stdout.buffer)
+    out = getattr(sys.stdout, 'buffer', None)
+    print('B' if out else 'H')
+    buf = bytearray(chunk)
+    mv = memoryview(buf)
+    with open('/sd/' + name, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            n = f.readinto(buf)
+            if not n:
+                break
+            n = min(n, length)
+            length -= n
+            if out:
+                out.write(struct.pack('<HI', n, binascii.crc32(mv[:n])))
+                out.write(mv[:n])
+            else:
+                print('D', binascii.hexlify(mv[:n]).decode())
+    if out:
+        out.write(struct.pack('<HI', 0, 0))
+    print('Z')
+
+
+def hash_ranges(name, start, end, segment=65536, chunk=1024):
+    # sha256 of each segment of [start, end) of a file, then of the whole range, to find a corrupted region
+    whole = hashlib.sha256()
+    buf = bytearray(chunk)
+    mv = memoryview(buf)
+    with open('/sd/' + name, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            h = hashlib.sha256()
+            left = min(segment, end - position)
+            while left > 0:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                n = min(n, left)
+                h.update(mv[:n])
+                whole.update(mv[:n])
+                left -= n
+                position += n
+            print('S', binascii.hexlify(h.digest()).decode())
+            if left:
+                break
+    print('A', binascii.hexlify(whole.digest()).decode())
+    print('END')
+
+
+def hash_prefix(name, length, chunk=1024):
+    # sha256 of the first length bytes of a file, to check the copy on the computer
+    h = hashlib.sha256()
+    buf = bytearray(chunk)
+    with open('/sd/' + name, 'rb') as f:
+        while length > 0:
+            n = f.readinto(buf)
+            if not n:
+                break
+            n = min(n, length)
+            h.update(buf[:n])
+            length -= n
+    print(binascii.hexlify(h.digest()).decode())
+
+
+def walk(with_mtime=False, top='/sd'):
+    # every file of the card with its size (and modification time), one line each, subfolders included
+    if with_mtime:
+        print('Y', time.gmtime(0)[0])
+    folders = ['']
+    while folders:
+        folder = folders.pop()
+        for entry in os.ilistdir(top + '/' + folder if folder else top):
+            name = folder + '/' + entry[0] if folder else entry[0]
+            if entry[1] == 0x4000:
+                folders.append(name)
+            elif with_mtime:
+                st = os.stat(top + '/' + name)
+                print(st[6], st[8], name)
+            else:
+                print(entry[3] if len(entry) > 3 else os.stat(top + '/' + name)[6], name)
+    print('END')
+
+
+def stat_files(names, top='/sd'):
+    # size and modification time of some files only (the ones that changed since the last listing)
+    print('Y', time.gmtime(0)[0])
+    for name in names:
+        try:
+            st = os.stat(top + '/' + name)
+            print(st[6], st[8], name)
+        except OSError:
+            pass
+    print('END')
@@ -0,0 +1,372 @@
+"""Bulk download of SD card files over one device session
+
+All the selected files are streamed back to back by a single call of
+send_files() from sd_tools.py. The serial link is read in this thread while a
+writer thread puts the previous chunks on disk.
+
+Files come as raw binary blocks, each with its length and CRC32 (hex lines
+on firmware that cannot write binary to stdout). With compress=True the
+blocks carry the file compressed by the deflate module of the device, it is
+inflated here as the blocks come; firmware built without deflate compression
+sends plain blocks instead. A file is written as
+<name>.part and renamed when complete. When an offset
+is given only the end of the file is transferred: it is appended to the
+existing copy, or to the .part left by an interrupted transfer for the
+names given as parts.
+
+The device also sends the sha256 of what it read from the card, compared
+with the sha256 of what was written here. For a file that differs, the
+device hashes it again by segments and only the segments that differ are
+fetched again. The verified files go into the manifest of the data
+directory (manifest.py); a file completed from an offset only when its
+beginning was verified already, the device hashing the new tail only.
+"""
+import collections
+import hashlib
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import perf_log
+from device_session import Cancelled, DeviceError
+from manifest import Manifest, sha256_range
+
+# size of the regions hashed by the device to find where a file differs
+REPAIR_SEGMENT = 65536
+# error of the files that are not on the SD card (retrying will not help)
+NOT_FOUND = "file not found on the SD card"
+
+
+class _Writer(threading.Thread):
+    """Write the received files in the background so reading the device never waits for the disk"""
+
+    def __init__(self, dest_dir):
+        super().__init__(daemon=True)
+        self.dest_dir = dest_dir
+        self.queue = queue.Queue(maxsize=64)
+        self.saved = set()
+        self.errors = {}
+        # name: sha256 of the whole file for the files checked against the device (None when only a new tail was)
+        self.hashes = {}
+        self.mismatched = {}  # name: (path, start, end) of the files whose bytes do not hash like on the device
+        self.busy = 0.0  # seconds spent writing, for the performance log
+
+    def run(self):
+        f = None
+        current_path = None
+        start_offset = 0
+        received = 0
+        sent_hash = whole_hash = None
+        while True:
+            action, name, data = self.queue.get()
+            if action == "stop":
+                break
+            if name in self.errors:
+                continue
+            start = time.perf_counter()
+            final = os.path.join(self.dest_dir, name)
+            part = final + ".part"
+            try:
+                if action == "open":
+                    # data: the offset, and the file it goes to (the .part, or the copy of a growing log)
+                    offset, part = data
+                    # files of SD card subfolders go into the same subfolders
+                    os.makedirs(os.path.dirname(final), exist_ok=True)
+                    f = open(part, "r+b" if offset else "wb")
+                    # the device only hashes what it sends: the hash of the whole file is only known from the start
+                    whole_hash = hashlib.sha256() if not offset else None
+                    sent_hash = hashlib.sha256()
+                    f.seek(offset)
+                    f.truncate()
+                    current_path = part
+                    start_offset = offset
+                    received = 0
+                elif action == "data":
+                    f.write(data)
+                    sent_hash.update(data)
+                    if whole_hash is not None:
+                        whole_hash.update(data)
+                    received += len(data)
+                elif action == "close":
+                    # data: the sha256 computed by the device, None if it sent none
+                    f.close()
+                    f = None
+                    if data and sent_hash.hexdigest() != data:
+                        self.mismatched[name] = (current_path, start_offset, start_offset + received)
+                    else:
+                        if current_path != final:
+                            os.replace(current_path, final)
+                        self.saved.add(name)
+                        if data:
+                            self.hashes[name] = whole_hash.hexdigest() if whole_hash is not None else None
+                elif action == "abort":
+                    f.close()
+                    f = None
+            except OSError as e:
+                self.errors[name] = e
+                if f is not None:
+                    f.close()
+                    f = None
+            self.busy += time.perf_counter() - start
+        if f is not None:
+            f.close()
+
+    def put(self, action, name=None, data=None):
+        self.queue.put((action, name, data))
+
+
+BLOCK_HEADER = struct.Struct("<HI")
+
+# bytes: file data received, link_bytes: what it took on the serial link, seconds: duration of the transfer,
+# repaired: files whose hash differed from the device and that were fixed by fetching some segments again
+DownloadResult = collections.namedtuple("DownloadResult", ["downloaded", "failed", "bytes", "link_bytes", "seconds",
+                                                           "repaired"])
+
+
+def download_files(session, names, dest_dir="data", progress=None, chunk_size=4096, offsets=None, binary=True,
+                   cancel=None, compress=False, verify=True, verified=(), parts=()):
+    """Download several SD card files in one device round trip
+
+    offsets optionally maps a file name to the number of bytes already on the
+    computer, in the complete copy or, for the names of parts, in the .part
+    of an interrupted transfer. chunk_size (at most 65535) is the size of the blocks read from
+    the SD card. progress(name, file_bytes, file_size, total_bytes, total_size)
+    is called after every chunk. Setting the cancel threading.Event stops the
+    transfer. compress asks for deflate compressed blocks (text logs shrink
+    3 to 5 times), ignored by firmware that cannot compress. verify checks
+    each file with a sha256 of the device; a file completed from an offset
+    only goes into the manifest if the part already here was verified too,
+    from the manifest or by the caller (verified: the names it checked).
+    Returns DownloadResult(downloaded
+    names, [(name, error), ...], bytes, link_bytes, seconds, repaired names).
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    if not names:
+        return DownloadResult([], [], 0, 0, 0.0, [])
+    offsets = [(offsets or {}).get(name, 0) for name in names]
+    with perf_log.phase("transfer"):
+        return session.call(_download, session, list(names), dest_dir, progress, chunk_size, offsets, binary, cancel,
+                            compress, verify, verified, parts)
+
+
+def format_transfer(result):
+    """Amount, effective throughput, compression ratio and repairs of a DownloadResult (or SyncResult)"""
+    text = f"{result.bytes / 1024:.0f} KB in {result.seconds:.2f} s"
+    if result.seconds:
+        text += f", {result.bytes / 1024 / result.seconds:.0f} KB/s effective"
+    if result.link_bytes and result.link_bytes < result.bytes:
+        text += f", compressed {result.bytes / result.link_bytes:.1f}x ({result.link_bytes / 1024:.0f} KB on the link)"
+    if result.repaired:
+        text += f", {len(result.repaired)} file(s) differed from the SD card and were fetched again in part"
+    return text
+
+
+def _check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise Cancelled("download cancelled")
+
+
+def _received(writer, current, progress, total, data):
+    writer.put("data", current[0], data)
+    perf_log.add_bytes(len(data))
+    current[1] += len(data)
+    total[0] += len(data)
+    if progress:
+        progress(current[0], current[1], current[2], total[0], total[1])
+
+
+def _read_binary_file(session, writer, current, progress, total, cancel, compressed=False):
+    """Read the blocks of one file until the empty end block, checking their CRC
+
+    The CRC is the one of the block as sent, compressed blocks are inflated after the check.
+    """
+    inflate = zlib.decompressobj(-15) if compressed else None
+    while True:
+        n, crc = BLOCK_HEADER.unpack(session.read_exact(BLOCK_HEADER.size))
+        total[2] += BLOCK_HEADER.size + n
+        if not n:
+            if inflate is not None:
+                data = inflate.flush()
+                if data:
+                    _received(writer, current, progress, total, data)
+                if not inflate.eof:
+                    raise DeviceError(f"compressed data of {current[0]} ends early")
+            return
+        _check_cancel(cancel)
+        data = session.read_exact(n)
+        if zlib.crc32(data) != crc:
+            raise DeviceError(f"CRC error in {current[0]} at byte {current[1]}")
+        if inflate is not None:
+            try:
+                data = inflate.decompress(data)
+            except zlib.error as e:
+                raise DeviceError(f"bad compressed data in {current[0]} at byte {current[1]}: {e}")
+            if not data:
+                continue
+        _received(writer, current, progress, total, data)
+
+
+def fetch_range(session, name, offset, length, chunk_size=4096):
+    """length bytes of an SD card file from offset"""
+    def fetch():
+        session.exec_start(f"send_range({name!r}, {offset}, {length}, {chunk_size})")
+        data = bytearray()
+        if session.read_line().strip() == b"B":
+            while True:
+                n, crc = BLOCK_HEADER.unpack(session.read_exact(BLOCK_HEADER.size))
+                if not n:
+                    break
+                block = session.read_exact(n)
+                if zlib.crc32(block) != crc:
+                    raise DeviceError(f"CRC error in {name} at byte {offset + len(data)}")
+                data += block
+        while True:
+            line = session.read_line()
+            if line[:1] == b"D":
+                data += bytes.fromhex(line[2:].decode())
+            elif line[:1] == b"Z":
+                break
+        session.exec_finish()
+        perf_log.add_bytes(len(data))
+        return bytes(data)
+    return session.call(fetch)
+
+
+def _repair(session, name, path, start, end, chunk_size):
+    """Fetch again the segments of [start, end) of a file that differ from the card
+
+    Raises DeviceError if the file still differs afterwards.
+    """
+    remote = [line.split() for line in session.exec(f"hash_ranges({name!r}, {start}, {end}, {REPAIR_SEGMENT})",
+                                                    timeout=120).splitlines()]
+    segments = [words[1] for words in remote if words[:1] == ["S"]]
+    whole = next((words[1] for words in remote if words[:1] == ["A"]), None)
+    with open(path, "r+b") as f:
+        for i, expected in enumerate(segments):
+            offset = start + i * REPAIR_SEGMENT
+            length = min(REPAIR_SEGMENT, end - offset)
+            f.seek(offset)
+            if hashlib.sha256(f.read(length)).hexdigest() != expected:
+                data = fetch_range(session, name, offset, length, chunk_size)
+                f.seek(offset)
+                f.write(data)
+    if sha256_range(path, start, end) != whole:
+        raise DeviceError(f"{name} still differs from the SD card after fetching it again")
+
+
+def _download(session, names, dest_dir, progress, chunk_size, offsets, binary, cancel, compress=False, verify=True,
+              verified=(), parts=()):
+    # in the call: after a reconnection the device may have rebooted, without the card mounted nor send_files
+    session.ensure_sd_mounted()
+    session.ensure_script("sd_tools.py")
+    # where the tail of each file goes: its .part, or the complete copy of a growing log
+    targets = {}
+    for name, offset in zip(names, offsets):
+        final = os.path.join(dest_dir, name)
+        targets[name] = final if offset and name not in parts else final + ".part"
+    # the device only hashes the tail it sends: an appended file is verified if its beginning already was
+    manifest = Manifest(dest_dir)
+    appended = {name for name, offset in zip(names, offsets) if offset}
+    trusted = {name for name in appended
+               if name in verified or (name not in parts and manifest.verified(name))}
+    writer = _Writer(dest_dir)
+    writer.start()
+    failed = {}
+    error = None
+    current = None
+    start = time.perf_counter()
+    # file bytes transferred so far, bytes announced by the device, bytes read on the link
+    total = [0, 0, 0]
+    try:
+        session.exec_start(f"send_files({names!r}, {chunk_size}, {offsets!r}, {binary!r}, {compress!r}, "
+                           f"verify={verify!r})")
+        line = session.read_line()
+        # T <files> <bytes> <kind>, anything else is a traceback or a device out of sync
+        header = line.split()
+        if len(header) != 4 or header[0] != b"T" or not header[2].isdigit():
+            raise DeviceError(f"unexpected answer to send_files: {line.decode(errors='replace')}")
+        total[1] = int(header[2])
+        # B: binary blocks, C: compressed binary blocks, H: hex lines
+        binary = header[3] in (b"B", b"C")
+        compressed = header[3] == b"C"
+        while True:
+            line = session.read_line()
+            kind = line[:1]
+            _check_cancel(cancel)
+            if kind == b"D":
+                total[2] += len(line)
+                _received(writer, current, progress, total, bytes.fromhex(line[2:].decode()))
+            elif kind == b"F":
+                _, size, offset, name = line.decode().split(" ", 3)
+                current = [name, int(offset), int(size)]
+                # from the start (the device may restart a file that got shorter): always into the .part
+                target = targets[name] if current[1] else os.path.join(dest_dir, name) + ".part"
+                writer.put("open", name, (current[1], target))
+                if progress:
+                    progress(name, current[1], current[2], total[0], total[1])
+                if binary:
+                    _read_binary_file(session, writer, current, progress, total, cancel, compressed)
+            elif kind == b"Z":
+                writer.put("close", current[0], line[2:].strip().decode() or None)
+                current = None
+            elif line == b"END":
+                break
+            elif kind == b"E":
+                failed[line[2:].decode()] = NOT_FOUND
+        session.exec_finish()
+    except (DeviceError, OSError) as e:
+        if isinstance(e, DeviceError):
+            # the device may still be sending: stop it, the next operation starts from a clean connection
+            session.interrupt()
+        else:
+            # the link is gone (unplugged): keep the files already saved, the next operation reconnects
+            session.close()
+        error = e
+        if current is not None:
+            writer.put("abort", current[0])
+    finally:
+        writer.put("stop")
+        writer.join()
+        perf_log.add_phase("write", writer.busy)
+    hashes = dict(writer.hashes)
+    repaired = []
+    for name, (path, first, end) in writer.mismatched.items():
+        try:
+            if error is not None:
+                raise DeviceError("different from the SD card")
+            _repair(session, name, path, first, end, chunk_size)
+        except (DeviceError, OSError) as e:
+            failed[name] = str(e)
+            # drop what could not be verified, the next sync transfers it again
+            with open(path, "r+b") as f:
+                f.truncate(first)
+            continue
+        final = os.path.join(dest_dir, name)
+        if path != final:
+            os.replace(path, final)
+        writer.saved.add(name)
+        hashes[name] = sha256_range(final)
+        repaired.append(name)
+    for name in appended - trusted:
+        hashes.pop(name, None)
+    _update_manifest(manifest, names, hashes)
+    downloaded = [name for name in names if name in writer.saved]
+    for name in names:
+        if name not in writer.saved and name not in failed:
+            failed[name] = str(writer.errors.get(name) or error or "transfer interrupted")
+    if error is not None and not downloaded:
+        raise error
+    return DownloadResult(downloaded, list(failed.items()), total[0], total[2], time.perf_counter() - start, repaired)
+
+
+def _update_manifest(manifest, names, hashes):
+    # the files rewritten without a check are not verified anymore
+    for name in names:
+        if name in hashes:
+            manifest.record(name, hashes[name])
+        else:
+            manifest.forget(name)
+    manifest.save()
@@ -0,0 +1,161 @@
+"""Transfers, job queue and reconnection against the simulated device (device_simulator.py)
+
+    python -m pytest tests
+
+The simulator serves the raw REPL on a pty, so these only run where pty exists (not on Windows).
+"""
+import filecmp
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("pty")
+serial = pytest.importorskip("serial")
+
+import job_queue
+import perf_log
+from device_session import DeviceError, DeviceSession
+from device_simulator import SimulatedDevice
+from sd_transfer import download_files
+
+# nothing in the performance log of the user
+perf_log.log_path = None
+
+
+@pytest.fixture
+def device():
+    with SimulatedDevice() as device:
+        yield device
+
+
+@pytest.fixture
+def session(device):
+    session = DeviceSession(device.port)
+    yield session
+    session.close()
+
+
+def unplug(session):
+    """The port fails like when the cable is pulled"""
+    def fail(*args):
+        raise serial.SerialException("device reports readiness to read but returned no data")
+    session.serial.read = session.serial.write = fail
+
+
+def same_as_card(device, dest, name):
+    return filecmp.cmp(os.path.join(device.sd_dir, name), os.path.join(dest, name), shallow=False)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_download(device, session, tmp_path, compress):
+    names = device.populate_sd(3, 50000, folders=2)
+    result = download_files(session, names, str(tmp_path), compress=compress)
+    assert result.downloaded == names
+    assert result.failed == []
+    assert all(same_as_card(device, tmp_path, name) for name in names)
+
+
+def test_missing_file(device, session, tmp_path):
+    names = device.populate_sd(1, 10000)
+    result = download_files(session, names + ["nothing.csv"], str(tmp_path))
+    assert result.downloaded == names
+    assert [name for name, error in result.failed] == ["nothing.csv"]
+
+
+def test_resume_from_part(device, session, tmp_path):
+    name, = device.populate_sd(1, 100000)
+    with open(os.path.join(device.sd_dir, name), "rb") as f:
+        data = f.read()
+    # an older complete copy does not stop the .part from being continued
+    (tmp_path / name).write_bytes(data[:1000])
+    (tmp_path / (name + ".part")).write_bytes(data[:30000])
+    result = download_files(session, [name], str(tmp_path), offsets={name: 30000}, parts=[name])
+    assert result.downloaded == [name]
+    assert result.bytes == len(data) - 30000
+    assert same_as_card(device, tmp_path, name)
+    assert not (tmp_path / (name + ".part")).exists()
+
+
+def test_cancel_keeps_finished_files(device, session, tmp_path):
+    names = device.populate_sd(3, 100000)
+    cancel = threading.Event()
+
+    def progress(name, file_bytes, file_size, total_bytes, total_size):
+        if name == names[1] and file_bytes > 20000:
+            cancel.set()
+    result = download_files(session, names, str(tmp_path), progress=progress, cancel=cancel)
+    assert result.downloaded == names[:1]
+    assert same_as_card(device, tmp_path, names[0])
+    assert not (tmp_path / names[2]).exists()
+
+
+def test_unexpected_answer(device, session, tmp_path):
+    names = device.populate_sd(1, 10000)
+    download_files(session, names, str(tmp_path))
+    # the board rebooted without the session noticing: send_files is gone
+    device._soft_reboot()
+    with pytest.raises(DeviceError):
+        download_files(session, names, str(tmp_path))
+    assert download_files(session, names, str(tmp_path)).downloaded == names
+
+
+def test_reconnect(device, session):
+    session.device_id()
+    unplug(session)
+    assert session.device_id() == device.unique_id.hex()
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    return job_queue.JobQueue(str(tmp_path / "jobs.sqlite"))
+
+
+def test_job_cancelled(device, session, jobs, tmp_path):
+    names = device.populate_sd(3, 100000)
+    job_id = jobs.add("download", names=names, dest_dir=str(tmp_path / "data"))
+    cancel = threading.Event()
+
+    def progress(name, file_bytes, file_size, total_bytes, total_size):
+        if name == names[1] and file_bytes > 20000:
+            cancel.set()
+    assert job_queue.run_job(session, jobs, jobs.get(job_id), progress, cancel) == "cancelled"
+    job = jobs.get(job_id)
+    assert job.attempts == 0
+    assert job.progress["done"] == names[:1]
+
+
+def test_job_survives_a_reboot(device, session, jobs, tmp_path):
+    names = device.populate_sd(2, 50000)
+    job_id = jobs.add("download", names=names, dest_dir=str(tmp_path / "data"))
+    session.ensure_sd_mounted()
+    session.ensure_script("sd_tools.py")
+    exec_start = session.exec_start
+
+    def wiggle(code):
+        if code.startswith("send_files"):
+            # the cable moves as the download starts: the board reboots and the write fails once
+            session.exec_start = exec_start
+            device._soft_reboot()
+            raise serial.SerialException("write failed")
+        return exec_start(code)
+    session.exec_start = wiggle
+    assert job_queue.run_job(session, jobs, jobs.get(job_id)) == "done"
+    assert all(same_as_card(device, tmp_path / "data", name) for name in names)
+
+
+def test_job_resumes_after_a_lost_link(device, session, jobs, tmp_path):
+    names = device.populate_sd(2, 100000)
+    dest = tmp_path / "data"
+    job_id = jobs.add("download", names=names, dest_dir=str(dest))
+
+    def progress(name, file_bytes, file_size, total_bytes, total_size):
+        if name == names[1] and file_bytes > 20000 and session.connected:
+            unplug(session)  # in the middle of the second file
+    assert job_queue.run_job(session, jobs, jobs.get(job_id), progress) == "queued"
+    assert jobs.get(job_id).progress["done"] == names[:1]
+    assert job_queue.run_job(session, jobs, jobs.get(job_id)) == "done"
+    assert all(same_as_card(device, dest, name) for name in names)
@@ -0,0 +1,32 @@
+"""Startup time of the window, against the targets of benchmark.py
+
+    python -m pytest tests
+
+The window itself is only started with a display (DISPLAY on Linux, or run
+under xvfb-run), the imports are always checked.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+
+
+def test_lazy_modules_not_imported_by_the_window_script():
+    assert not set(benchmark.window_modules()) & set(benchmark.LAZY_MODULES)
+
+
+def test_window_modules_import_within_budget():
+    seconds, lazy = benchmark.time_imports()
+    # what the window imports must not bring the fleet mode or the live monitor with it
+    assert lazy == []
+    assert seconds < benchmark.IMPORT_TARGET
+
+
+@pytest.mark.skipif(not benchmark.has_display(), reason="no display to show the window")
+def test_window_shown_within_target():
+    shown, total = benchmark.time_window()
+    assert shown < benchmark.STARTUP_TARGET
@@ -0,0 +1,112 @@
+"""Listbox that stays fast with thousands of files
+
+Only the visible rows are ever inserted in the Tk listbox: scrolling just
+replaces their text, and the selection is kept on the side as indices of
+the full list.
+"""
+import tkinter as tk
+
+
+class VirtualListbox(tk.Frame):
+    """Multiple selection list of any number of items, showing `height` rows"""
+
+    def __init__(self, master, height=6, format_item=str, on_select=None, **listbox_options):
+        super().__init__(master)
+        self.format_item = format_item
+        self.on_select = on_select
+        self.items = []
+        self.selected = set()
+        self.top = 0
+        self.message = None
+        self.listbox = tk.Listbox(self, height=height, selectmode=tk.MULTIPLE, exportselection=False,
+                                  **listbox_options)
+        self.listbox.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = tk.Scrollbar(self, orient="vertical", command=self._scroll)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.grid_columnconfigure(0, weight=1)
+        self.listbox.bind("<<ListboxSelect>>", self._selection_changed)
+        self.listbox.bind("<MouseWheel>", lambda e: self._scroll("scroll", -1 if e.delta > 0 else 1, "units"))
+        self.listbox.bind("<Button-4>", lambda e: self._scroll("scroll", -1, "units"))
+        self.listbox.bind("<Button-5>", lambda e: self._scroll("scroll", 1, "units"))
+        # the arrow keys would move inside the few real rows only
+        self.listbox.bind("<Up>", lambda e: self._scroll("scroll", -1, "units") or "break")
+        self.listbox.bind("<Down>", lambda e: self._scroll("scroll", 1, "units") or "break")
+
+    @property
+    def rows(self):
+        return int(self.listbox.cget("height"))
+
+    def set_items(self, items, keep_selection=False):
+        """Show a new list, keeping the selected items that are still there if asked"""
+        previous = set(self.selected_items()) if keep_selection else set()
+        self.items = list(items)
+        self.selected = {i for i, item in enumerate(self.items) if item in previous}
+        self.message = None
+        self.top = min(self.top, max(len(self.items) - self.rows, 0)) if keep_selection else 0
+        self._redraw()
+
+    def set_message(self, text):
+        """Show a single line of text instead of items ("No device found"...)"""
+        self.items = []
+        self.selected = set()
+        self.message = text
+        self.top = 0
+        self._redraw()
+
+    def selected_items(self):
+        return [self.items[i] for i in sorted(self.selected)]
+
+    def select_all(self):
+        self.selected = set(range(len(self.items)))
+        self._redraw()
+        self._notify()
+
+    def clear_selection(self):
+        self.selected = set()
+        self._redraw()
+        self._notify()
+
+    def _redraw(self):
+        self.listbox.delete(0, tk.END)
+        if self.message is not None:
+            self.listbox.insert(tk.END, self.message)
+            self.scrollbar.set(0, 1)
+            return
+        visible = self.items[self.top:self.top + self.rows]
+        for item in visible:
+            self.listbox.insert(tk.END, self.format_item(item))
+        for row in range(len(visible)):
+            if self.top + row in self.selected:
+                self.listbox.selection_set(row)
+        total = len(self.items)
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + self.rows) / total))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            top = int(float(amount) * len(self.items))
+        else:
+            step = self.rows if unit == "pages" else 1
+            top = self.top + int(amount) * step
+        top = max(0, min(top, len(self.items) - self.rows))
+        if top != self.top:
+            self.top = top
+            self._redraw()
+
+    def _selection_changed(self, event=None):
+        if self.message is not None:
+            self.listbox.selection_clear(0, tk.END)
+            return
+        shown = set(self.listbox.curselection())
+        for row in range(min(self.rows, len(self.items) - self.top)):
+            if row in shown:
+                self.selected.add(self.top + row)
+            else:
+                self.selected.discard(self.top + row)
+        self._notify()
+
+    def _notify(self):
+        if self.on_select:
+            self.on_select()